@@ -13,12 +13,14 @@ import streamlit as st
 import streamlit.components.v1 as components
 
 from core.config import PRINT_PAGE_SCRIPT
-from core.state import ss_init
+from core.state import ss_init, navigate_to
 from components.navigation import inject_css
 from db.schema import init_db
-from db.repo_products import get_default_operator_email
+from db.catalog import get_catalog
 from db.repo_ticketing import get_preview_html, get_receipt_print_html
 from services.ticketing_service import get_receipt_preview_html, wrap_receipt_for_preview
+from services.prefetch import maybe_prefetch_manage
+from services.photo_persist import start_photo_worker
 from ui.page_ticketing import ticketing_page
 from ui.page_manage import manage_page
 
@@ -69,6 +71,31 @@ def _render_print_page(rid: int) -> None:
     components.html(html_with_script, height=900)
 
 
+# ---------------------------------------------------------------------------
+# Page navigation — only the active page runs on a rerun
+# ---------------------------------------------------------------------------
+
+PAGES = [
+    ("ticketing", "开票（前台）", ticketing_page),
+    ("manage", "管理（后台）", manage_page),
+]
+
+
+def _page_nav():
+    """Tab-style buttons bound to current_page; returns the active page key."""
+    keys = [k for k, _, _ in PAGES]
+    if st.session_state.get("current_page") not in keys:
+        st.session_state.current_page = keys[0]
+    active = st.session_state.current_page
+    cols = st.columns([1, 1, 4])
+    for col, (key, label, _) in zip(cols, PAGES):
+        with col:
+            st.button(label, key=f"_nav_{key}", use_container_width=True,
+                      type="primary" if key == active else "secondary",
+                      on_click=navigate_to, args=(key,))
+    return active
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
@@ -86,6 +113,7 @@ def main():
         st.error(f"数据库初始化失败: {e}")
         st.exception(e)
         return
+    start_photo_worker()
 
     # --- URL parameter routing ---
     params = getattr(st, "query_params", None) or {}
@@ -117,7 +145,7 @@ def main():
 
     # --- Normal app ---
     try:
-        default_email = get_default_operator_email()
+        default_email = get_catalog().default_operator_email()
         ss_init(default_email)
     except Exception as e:
         st.error(f"会话初始化失败: {e}")
@@ -130,11 +158,12 @@ def main():
         "**请选择：** 点击下方 **「开票」** 做前台收银开票，"
         "点击 **「管理」** 进入后台（月汇总、客户/操作员/物料等）。"
     )
-    tab_open, tab_manage = st.tabs(["开票（前台）", "管理（后台）"])
-    with tab_open:
-        ticketing_page()
-    with tab_manage:
-        manage_page()
+    active = _page_nav()
+    for key, _, render in PAGES:
+        if key == active:
+            render()
+    if active == "ticketing":
+        maybe_prefetch_manage()
 
 
 if __name__ == "__main__":
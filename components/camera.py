@@ -0,0 +1,109 @@
+"""
+Camera capture — cam_bridge component wrapper and frame transport.
+
+The cam_bridge iframe (components/cam_bridge/index.html) sends a capture as
+one binary component value (setComponentValue, dataType "bytes"), no JSON
+and no base64. Little-endian layout:
+
+    header  "CAMB" | u8 version | u32 capture_token | f64 captured_at_ms | u8 n_frames
+    frame   u8 cam_index | u8 brightness | u16 w | u16 h | f64 ts_ms | u32 length | JPEG
+
+A component value persists across reruns, so read_new_capture() compares
+the header with the one last handled and returns without parsing the frames
+when it is unchanged. Capture → server latency per frame (browser ts to
+parse time) is kept in a bounded window for the photo diagnostics panel.
+"""
+
+import os
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+
+import streamlit.components.v1 as components
+
+MAGIC = b"CAMB"
+VERSION = 1
+_HEADER = struct.Struct("<4sBIdB")
+_FRAME = struct.Struct("<BBHHdI")
+
+CameraFrame = namedtuple("CameraFrame", "cam_index data brightness w h ts")
+Capture = namedtuple("Capture", "token captured_at frames")
+
+_CAM_BRIDGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cam_bridge")
+_cam_bridge_fn = components.declare_component("pos_cam_bridge", path=_CAM_BRIDGE_DIR)
+
+_latency_lock = threading.Lock()
+_latency_ms = deque(maxlen=200)
+
+
+def cam_bridge(capture_token: int, key: str = "cam_bridge_main"):
+    """Render the two live cameras; a new *capture_token* takes one frame per
+    camera. Returns the last capture payload (bytes) or None."""
+    value = _cam_bridge_fn(key=key, capture_token=capture_token, default=None)
+    return bytes(value) if isinstance(value, (bytes, bytearray, memoryview)) else None
+
+
+def encode_capture(token, captured_at, frames) -> bytes:
+    """Python twin of encodeCapture() in cam_bridge/index.html (tests, tools).
+    *frames*: [(cam_index, jpeg_bytes, brightness, w, h, ts_ms), ...]"""
+    out = [_HEADER.pack(MAGIC, VERSION, token, captured_at, len(frames))]
+    for cam_idx, data, brightness, w, h, ts in frames:
+        out.append(_FRAME.pack(cam_idx, brightness, w, h, ts, len(data)))
+        out.append(data)
+    return b"".join(out)
+
+
+def parse_capture(payload: bytes) -> Capture:
+    """Decode a cam_bridge payload; ValueError if it is malformed."""
+    if len(payload) < _HEADER.size:
+        raise ValueError("capture payload too short")
+    magic, version, token, captured_at, n = _HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"unknown capture payload {magic!r} v{version}")
+    view = memoryview(payload)
+    frames, off = [], _HEADER.size
+    now_ms = time.time() * 1000.0
+    for _ in range(n):
+        if off + _FRAME.size > len(payload):
+            raise ValueError("capture payload truncated")
+        cam_idx, brightness, w, h, ts, length = _FRAME.unpack_from(payload, off)
+        off += _FRAME.size
+        if off + length > len(payload):
+            raise ValueError("capture payload truncated")
+        frames.append(CameraFrame(cam_idx, bytes(view[off:off + length]), brightness, w, h, ts))
+        off += length
+        with _latency_lock:
+            _latency_ms.append(now_ms - ts)
+    return Capture(token, captured_at, frames)
+
+
+def read_new_capture(payload, last_key):
+    """(capture, key) for a payload not handled yet, else (None, last_key).
+    Store *key* and pass it back on the next rerun. Malformed payloads are
+    logged once and skipped."""
+    if not payload:
+        return None, last_key
+    key = bytes(payload[:_HEADER.size])
+    if key == last_key:
+        return None, last_key
+    try:
+        return parse_capture(payload), key
+    except ValueError as e:
+        print(f"[camera] dropped capture payload: {e}")
+        return None, key
+
+
+def capture_latency_stats() -> dict:
+    """Capture → server latency over the last frames: count, last, p50, p95 (ms)."""
+    with _latency_lock:
+        values = list(_latency_ms)
+    if not values:
+        return {"count": 0, "last_ms": None, "p50_ms": None, "p95_ms": None}
+    ordered = sorted(values)
+    return {
+        "count": len(values),
+        "last_ms": round(values[-1], 1),
+        "p50_ms": round(ordered[len(ordered) // 2], 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+    }
@@ -8,6 +8,45 @@ import os
 # 使用绝对路径，优先环境变量 SCRAP_DB_PATH，避免“写 A 读 B”问题
 DB_PATH = os.path.abspath(os.getenv("SCRAP_DB_PATH", "scrap_pos.db"))
 
+# 连接池：进程内最多保留的 SQLite 连接数，以及取连接的最长等待（秒）
+DB_POOL_SIZE = int(os.getenv("SCRAP_DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = 30.0
+
+# 单写线程：在该时间窗（毫秒）内到达的写请求合并为一个事务提交（group commit）
+WRITE_BATCH_WINDOW_MS = float(os.getenv("SCRAP_WRITE_BATCH_WINDOW_MS", "3"))
+WRITE_BATCH_MAX = 64
+
+# 查询统计：常开；超过 SLOW_QUERY_MS 的语句进入有界慢查询日志
+QUERY_STATS_ENABLED = os.getenv("SCRAP_QUERY_STATS", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("SCRAP_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_SIZE = 200
+QUERY_STATS_MAX_KEYS = 500
+
+# 照片存储：按内容 sha256 寻址的目录树（默认与 DB 同目录），主库只存 hash/size/mime
+PHOTO_STORE_DIR = os.path.abspath(os.getenv(
+    "SCRAP_PHOTO_DIR", os.path.splitext(DB_PATH)[0] + "_photos"))
+# 缩略图：写入时生成一次（需要 Pillow），管理端默认只显示缩略图
+PHOTO_THUMB_MAX_PX = 320
+PHOTO_THUMB_QUALITY = 75
+# 照片落库队列：Confirm 时照片先写入本地 spool 目录（进程崩溃后重启继续），
+# 后台线程写库并校验，失败时按退避重试，共尝试 N 次
+PHOTO_SPOOL_DIR = os.path.abspath(os.getenv(
+    "SCRAP_PHOTO_SPOOL_DIR", os.path.splitext(DB_PATH)[0] + "_photo_spool"))
+PHOTO_PERSIST_ATTEMPTS = int(os.getenv("SCRAP_PHOTO_PERSIST_ATTEMPTS", "3"))
+# 每个会话内未 Confirm 的照片缓存：总字节上限（MB）与过期秒数（LRU + TTL 淘汰）
+PENDING_PHOTO_CACHE_MB = float(os.getenv("SCRAP_PENDING_PHOTO_MB", "16"))
+PENDING_PHOTO_TTL_S = float(os.getenv("SCRAP_PENDING_PHOTO_TTL_S", "1800"))
+
+# 后台预取：停留在开票页时，每隔 N 秒在后台线程刷新管理页的缓存查询（月汇总）；0 = 关闭
+PREFETCH_MANAGE_INTERVAL_S = float(os.getenv("SCRAP_PREFETCH_MANAGE_S", "60"))
+
+# 目录快照（客户/操作员/分类/物料/Tier/设置）：版本号存在库里（catalog_changes），
+# 任何进程写入后 +1 即失效；另外超过该秒数强制重载，兜底绕过 repo 直接改库的情况
+CATALOG_MAX_AGE_S = float(os.getenv("SCRAP_CATALOG_MAX_AGE_S", "300"))
+
+# 开票页客户搜索：下拉框最多显示的匹配条数（按相关度、新客户优先）
+CLIENT_SEARCH_TOP_K = int(os.getenv("SCRAP_CLIENT_SEARCH_TOP_K", "20"))
+
 RECEIPT_HEADER_LINES = ["YG METAL", "RC 4449276", "test@ygmetal.com"]
 RECEIPT_WIDTH = 48
 LEGAL_TEXT = (
@@ -0,0 +1,107 @@
+"""
+Pending photos — per-session cache of captured frames not yet confirmed.
+
+Each material pick starts a line token; the camera fragment stores that
+line's frames under it and Confirm Line takes them out (pop). Tokens that
+are never confirmed (Clear, category switch, re-pick) would otherwise stay
+in session_state for the whole shift, so the cache:
+  - keeps the byte total under PENDING_PHOTO_CACHE_MB, evicting the least
+    recently used token first (the newest entry is always kept),
+  - drops entries older than PENDING_PHOTO_TTL_S,
+  - counts hits, misses, evictions, expiries and bytes held (stats()).
+It lives only in session_state, so it is freed with the session.
+"""
+
+import time
+from collections import OrderedDict
+
+from core.config import PENDING_PHOTO_CACHE_MB, PENDING_PHOTO_TTL_S
+
+
+class PendingPhotos:
+    __slots__ = ("photos", "meta", "ts", "nbytes")
+
+    def __init__(self, photos, meta, ts):
+        self.photos = photos        # {cam_index: jpeg bytes}
+        self.meta = meta or {}
+        self.ts = ts
+        self.nbytes = sum(len(b) for b in photos.values())
+
+
+class PendingPhotoCache:
+    def __init__(self, max_bytes=None, ttl_s=None, clock=time.time):
+        self.max_bytes = int(PENDING_PHOTO_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.ttl_s = PENDING_PHOTO_TTL_S if ttl_s is None else ttl_s
+        self._clock = clock
+        self._entries = OrderedDict()   # token -> PendingPhotos, least recently used first
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, token):
+        return token in self._entries
+
+    def _drop(self, token):
+        entry = self._entries.pop(token)
+        self.bytes -= entry.nbytes
+        return entry
+
+    def _expire(self):
+        if self.ttl_s <= 0:
+            return
+        cutoff = self._clock() - self.ttl_s
+        for token in [t for t, e in self._entries.items() if e.ts < cutoff]:
+            self._drop(token)
+            self.expired += 1
+
+    def put(self, token, photos, meta=None):
+        """Store the frames {cam_index: bytes} for *token* (replacing older ones)."""
+        if token in self._entries:
+            self._drop(token)
+        entry = PendingPhotos(dict(photos), meta, self._clock())
+        self._entries[token] = entry
+        self.bytes += entry.nbytes
+        self._expire()
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        return entry
+
+    def get(self, token):
+        """Entry for *token* (marked recently used), or None."""
+        self._expire()
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return entry
+
+    def peek(self, token):
+        """Entry for *token* without touching LRU order or counters (diagnostics)."""
+        return self._entries.get(token)
+
+    def pop(self, token):
+        """Take the entry for *token* out of the cache (Confirm Line)."""
+        entry = self.get(token)
+        if entry is not None:
+            self._drop(token)
+        return entry
+
+    def discard(self, token):
+        if token in self._entries:
+            self._drop(token)
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+            "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions, "expired": self.expired,
+        }
@@ -0,0 +1,92 @@
+"""
+In-progress receipt — compact line buffer held in session_state.
+
+Lines are small __slots__ records; the subtotal is kept in integer cents
+and adjusted on every append / update / delete, so reading it costs
+nothing. A DataFrame is only built for st.data_editor and the print
+formatter (see core.state.receipt_view_df, cached per edit version).
+"""
+
+import pandas as pd
+
+RECEIPT_COLUMNS = ["Del", "material", "unit_price", "gross", "tare", "net", "total"]
+
+
+def _num(v) -> float:
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if f != f else f  # NaN → 0, like recompute_receipt_df
+
+
+class ReceiptLine:
+    __slots__ = ("material", "unit_price", "gross", "tare", "net", "total")
+
+    def __init__(self, material, unit_price, gross, tare):
+        self.material = "" if material is None else str(material)
+        self.set_values(unit_price, gross, tare)
+
+    def set_values(self, unit_price, gross, tare):
+        self.unit_price = _num(unit_price)
+        self.gross = _num(gross)
+        self.tare = _num(tare)
+        self.net = max(0.0, self.gross - self.tare)
+        self.total = round(self.net * self.unit_price, 2)
+
+    @property
+    def cents(self) -> int:
+        return int(round(self.total * 100))
+
+
+class ReceiptBuffer:
+    __slots__ = ("lines", "_cents", "rev")
+
+    def __init__(self):
+        self.lines = []
+        self._cents = 0
+        self.rev = 0  # bumped on every change; part of the DataFrame cache key
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def subtotal(self) -> float:
+        return self._cents / 100.0
+
+    def append(self, material, unit_price, gross, tare) -> ReceiptLine:
+        line = ReceiptLine(material, unit_price, gross, tare)
+        self.lines.append(line)
+        self._cents += line.cents
+        self.rev += 1
+        return line
+
+    def update(self, i, unit_price, gross, tare):
+        line = self.lines[i]
+        self._cents -= line.cents
+        line.set_values(unit_price, gross, tare)
+        self._cents += line.cents
+        self.rev += 1
+
+    def delete(self, indices):
+        drop = set(indices)
+        for i in drop:
+            self._cents -= self.lines[i].cents
+        self.lines = [ln for i, ln in enumerate(self.lines) if i not in drop]
+        self.rev += 1
+
+    def clear(self):
+        self.lines = []
+        self._cents = 0
+        self.rev += 1
+
+    def rows(self):
+        """(material, unit_price, gross, tare, net, total) per line — finalize_ticket input."""
+        return [(ln.material, ln.unit_price, ln.gross, ln.tare, ln.net, ln.total)
+                for ln in self.lines]
+
+    def to_df(self) -> pd.DataFrame:
+        if not self.lines:
+            return pd.DataFrame(columns=RECEIPT_COLUMNS)
+        return pd.DataFrame(
+            [(False, *row) for row in self.rows()], columns=RECEIPT_COLUMNS)
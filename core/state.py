@@ -3,11 +3,16 @@ Session-state initialisation and Phase-2 ticketing state machine.
 Single source of truth for ALL session_state keys.
 """
 
+import functools
+import inspect
 import time
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
 
 from core.config import DEBOUNCE_MS
+from core.photo_cache import PendingPhotoCache
+from core.receipt import ReceiptBuffer
 
 # ---------------------------------------------------------------------------
 # Phase 2 — Ticketing step definitions
@@ -32,9 +37,8 @@ def ss_init(default_operator_email: str = "admin@youli-trade.com"):
         "unit_price": "",
         "client_search": "",
         "_show_add_client": False,
-        "receipt_df": pd.DataFrame(columns=[
-            "Del", "material", "unit_price", "gross", "tare", "net", "total"
-        ]),
+        # In-progress receipt (core/receipt.py); DataFrame view via receipt_view_df()
+        "receipt_buf": ReceiptBuffer(),
         "focus_request": None,
         "_keypad_pending": None,
         "key_target": "gross",
@@ -69,9 +73,9 @@ def ss_init(default_operator_email: str = "admin@youli-trade.com"):
         "_current_line_photos": None,
         "_receipt_line_photos": [],
         "pending_item_photos": None,
-        # 拍照按 token 绑定：每个 line 一个 token，避免被 rerun 覆盖
-        "pending_photos_by_token": {},
-        "pending_photo_ts_by_token": {},
+        # 拍照按 token 绑定：每个 line 一个 token，避免被 rerun 覆盖；
+        # 有字节上限 + LRU/TTL 淘汰，放弃的 token 不会一直占内存
+        "pending_photos": PendingPhotoCache(),
         "current_line_token": None,
         "_saved_gross_before_tare": "",
         "_draft_receipt_id": None,
@@ -89,6 +93,18 @@ def bump_receipt_ver():
     st.session_state._receipt_edit_ver = st.session_state.get("_receipt_edit_ver", 0) + 1
 
 
+def receipt_view_df() -> pd.DataFrame:
+    """DataFrame of the receipt buffer, rebuilt only when the buffer or the
+    edit version changed since the last call."""
+    buf = st.session_state.receipt_buf
+    key = (st.session_state.get("_receipt_edit_ver", 0), buf.rev)
+    cached = st.session_state.get("_receipt_df_cache")
+    if cached is None or cached[0] != key:
+        cached = (key, buf.to_df())
+        st.session_state["_receipt_df_cache"] = cached
+    return cached[1]
+
+
 # ---------------------------------------------------------------------------
 # Phase 2 — State-machine helpers
 # ---------------------------------------------------------------------------
@@ -134,3 +150,64 @@ def record_action():
 def navigate_to(page: str):
     st.session_state.current_page = "__switching__"
     st.session_state.current_page = page
+
+
+# ---------------------------------------------------------------------------
+# Phase 6 — Fragments (partial reruns of the ticketing page)
+# ---------------------------------------------------------------------------
+# Each ticketing area is a keyed st.fragment; an interaction reruns only the
+# fragment it happened in. Cross-area changes are made in widget callbacks,
+# which name the fragments that must redraw (rerun_fragments). Fragments
+# exchange data through session_state only — see the key lists in
+# ui/page_ticketing.py.
+FRAG_RECEIPT = "receipt_preview"
+FRAG_MATERIALS = "material_grid"
+FRAG_CAMERA = "camera"
+FRAG_CLIENT = "client_picker"
+FRAG_RECEIVING = "receiving"
+
+
+def _keyed_fragments_supported() -> bool:
+    frag = getattr(st, "fragment", None)
+    if frag is None:
+        return False
+    try:
+        return "key" in inspect.signature(frag).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+# Older Streamlit (no keyed fragments / keyed st.rerun): render the areas as
+# plain functions, every interaction reruns the whole page as before.
+FRAGMENTS_ENABLED = _keyed_fragments_supported()
+
+
+def fragment(key: str):
+    """Decorator: keyed st.fragment, timed into session_state["_frag_ms"][key]."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                ms = st.session_state.setdefault("_frag_ms", {})
+                ms[key] = round((time.perf_counter() - t0) * 1000, 1)
+        return st.fragment(timed, key=key) if FRAGMENTS_ENABLED else timed
+    return deco
+
+
+def rerun_fragments(*keys: str):
+    """From a widget callback: rerun exactly these fragments, in this order."""
+    if FRAGMENTS_ENABLED:
+        st.rerun(scope=list(keys))
+
+
+def rerun_fragment():
+    """From a fragment body: rerun that fragment (whole app on a full run)."""
+    if FRAGMENTS_ENABLED:
+        try:
+            st.rerun(scope="fragment")
+        except StreamlitAPIException:
+            pass
+    st.rerun()
@@ -29,11 +29,7 @@ def recompute_receipt_df(df: pd.DataFrame) -> pd.DataFrame:
 
 def current_subtotal() -> float:
     import streamlit as st
-    df = st.session_state.receipt_df
-    if df.empty:
-        return 0.0
-    df = recompute_receipt_df(df)
-    return float(df["total"].sum())
+    return st.session_state.receipt_buf.subtotal
 
 
 def rpad(s, w):
@@ -0,0 +1,135 @@
+"""
+Catalog snapshot — clients, operators, categories, materials and settings,
+loaded once and shared by every session.
+
+The repo write functions for these tables call bump_catalog_version(conn)
+inside the write that changes the data, so the change and the new version
+commit together. The version lives in the DB (one row per change in
+catalog_changes, migration 13), so writes from every process sharing the
+DB file move it. get_catalog() compares it with one primary-key
+lookup and reloads only when it moved (or the snapshot is older than
+CATALOG_MAX_AGE_S, which covers edits made outside the repo functions). A
+ticketing rerun that does not follow a catalog change runs no catalog
+queries besides that version check.
+
+Each change row also records which table (and row key, when known)
+changed, so derived structures such as services/price_book.py can update
+just the affected rows (catalog_changes_since).
+
+The snapshot's DataFrames are shared: callers must copy before mutating.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from core.config import CATALOG_MAX_AGE_S
+from db.connection import get_connection, qone, run_write
+
+_load_lock = threading.Lock()   # one loader at a time
+_snapshot = None
+_CHANGES_KEEP = 256             # change rows kept; older ones are pruned on bump
+
+_VERSION_SQL = "SELECT COALESCE(MAX(version), 0) AS v FROM catalog_changes"
+
+
+def catalog_version() -> int:
+    row = qone(_VERSION_SQL)
+    return int(row["v"]) if row else 0
+
+
+def bump_catalog_version(conn, table=None, key=None) -> int:
+    """Record a change to a catalog table on *conn*, inside the run_write that
+    changes it. *key* is the row id the change is about (material id, client
+    id), or None for "any row"."""
+    version = conn.execute(
+        "INSERT INTO catalog_changes(tbl, key, changed_at) VALUES(?,?,?)",
+        (table, key, datetime.now().isoformat(timespec="seconds")),
+    ).lastrowid
+    conn.execute("DELETE FROM catalog_changes WHERE version <= ?",
+                 (version - _CHANGES_KEEP,))
+    return version
+
+
+def catalog_write(sql, params, table, key=None) -> int:
+    """Run one write statement and its bump_catalog_version in one
+    transaction; returns the statement's rowcount."""
+    def _write(conn):
+        rowcount = conn.execute(sql, params).rowcount
+        bump_catalog_version(conn, table, key)
+        return rowcount
+
+    return run_write(_write)
+
+
+def catalog_changes_since(version):
+    """[(table, key), ...] for changes after *version*, oldest first; None if
+    the log no longer reaches back that far (rebuild from scratch)."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT version, tbl, key FROM catalog_changes WHERE version > ? "
+            "ORDER BY version", (version,)).fetchall()
+    if rows and rows[0][0] != version + 1:
+        return None
+    return [(t, k) for _v, t, k in rows]
+
+
+class CatalogSnapshot:
+    def __init__(self, version, clients, operators, categories, materials, settings):
+        self.version = version
+        self.loaded_at = time.time()
+        self.clients = clients
+        self.operators = operators
+        self.categories = categories
+        self.materials = materials
+        self.settings = settings
+        self._client_tier = dict(zip(clients["code"], map(int, clients["tier_level"])))
+        self._client_id = dict(zip(clients["code"], map(int, clients["id"])))
+
+    def get_setting(self, key: str, default: str = "") -> str:
+        return self.settings.get(key, default)
+
+    def default_operator_email(self) -> str:
+        """Same result as repo_products.get_default_operator_email (lowest id)."""
+        if self.operators.empty:
+            return "admin@youli-trade.com"
+        return self.operators["email"].iloc[-1]  # operators are ordered id DESC
+
+    def client_tier(self, client_code: str) -> int:
+        """Same result as repo_customers.get_client_tier (0 = base price)."""
+        return self._client_tier.get(client_code, 0)
+
+    def client_id(self, client_code: str):
+        """clients.id for an active client code, or None."""
+        return self._client_id.get(client_code)
+
+
+def _load(version) -> CatalogSnapshot:
+    from db.repo_customers import get_clients
+    from db.repo_products import get_categories, get_materials, get_operators, get_all_settings
+
+    settings = get_all_settings()
+    return CatalogSnapshot(
+        version, get_clients(), get_operators(), get_categories(), get_materials(),
+        dict(zip(settings["key"], settings["value"])))
+
+
+def _fresh(snap, version) -> bool:
+    return (snap is not None and snap.version == version
+            and time.time() - snap.loaded_at < CATALOG_MAX_AGE_S)
+
+
+def get_catalog() -> CatalogSnapshot:
+    """Current snapshot; loads it when the catalog changed since the last load."""
+    global _snapshot
+    snap = _snapshot
+    version = catalog_version()
+    if _fresh(snap, version):
+        return snap
+    with _load_lock:
+        snap = _snapshot
+        if not _fresh(snap, version):
+            # Version read before loading: a write that lands during the load
+            # leaves the snapshot one version behind, so it reloads next time.
+            snap = _snapshot = _load(version)
+        return snap
@@ -0,0 +1,76 @@
+"""
+Code allocator — client codes and withdraw codes without random probing.
+
+Each kind of code has a row in code_sequences (migration 10). A code is
+taken by bumping that row's counter n inside the writer transaction
+(UPDATE ... RETURNING), which SQLite serialises across every terminal
+sharing the DB file, and mapping n through a keyed permutation of the
+code space:
+
+    code = base + E_secret(n mod modulus)
+
+E is a 6-round Feistel network over [0, a²), a = ceil(sqrt(modulus)), with
+HMAC-SHA256 under the row's random secret as round function;
+values >= modulus are encrypted again (cycle walking). The first *modulus*
+values of n therefore give *modulus* distinct codes, and without the secret
+codes already seen say nothing about the next one — a withdraw code is
+what pays out a ticket. The *taken* check skips codes still in use (client
+codes, unpaid tickets' withdraw codes), e.g. ones handed out before the
+allocator existed; a hit just takes the next n.
+"""
+
+import hashlib
+import hmac
+import math
+
+from db.connection import run_write
+
+CLIENT_CODE = "client_code"
+WITHDRAW_CODE = "withdraw_code"
+
+# name -> (modulus, base, width); width zero-pads the decimal code
+CODE_SPACES = {
+    CLIENT_CODE: (1_000_000, 0, 6),          # 000000 – 999999
+    WITHDRAW_CODE: (900_000, 100_000, 6),    # 100000 – 999999
+}
+
+_MAX_SKIPS = 1000
+_ROUNDS = 6
+
+
+def _permute(n, modulus, secret) -> int:
+    """Keyed permutation of [0, modulus): Feistel network + cycle walking."""
+    key = bytes.fromhex(secret)
+    a = math.isqrt(modulus - 1) + 1
+    x = n
+    while True:
+        left, right = divmod(x, a)
+        for i in range(_ROUNDS):
+            digest = hmac.new(key, f"{i}:{right}".encode(), hashlib.sha256).digest()
+            left, right = right, (left + int.from_bytes(digest[:8], "big")) % a
+        x = left * a + right
+        if x < modulus:
+            return x
+
+
+def next_code(conn, name, taken=None) -> str:
+    """Allocate the next *name* code on *conn* (inside a write transaction).
+    *taken(conn, code)* → True skips a code that is already in use."""
+    for _ in range(_MAX_SKIPS):
+        row = conn.execute(
+            "UPDATE code_sequences SET next_n = next_n + 1 WHERE name = ? "
+            "RETURNING next_n - 1, modulus, secret, base, width",
+            (name,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"unknown code sequence {name!r}")
+        n, modulus, secret, base, width = row
+        code = f"{base + _permute(n % modulus, modulus, secret):0{width}d}"
+        if taken is None or not taken(conn, code):
+            return code
+    raise RuntimeError(f"code space {name!r} exhausted")
+
+
+def allocate_code(name, taken=None) -> str:
+    """next_code() in its own write transaction."""
+    return run_write(lambda conn: next_code(conn, name, taken))
@@ -3,13 +3,346 @@ Phase 3 — Centralised DB access with safe transactions.
 
 Every DB interaction in the app goes through helpers defined here.
 UI and services must NEVER write raw SQL — they call repo functions instead.
+
+Connections come from a process-wide bounded pool: each connection is opened
+and PRAGMA-configured once, then reused by whichever thread checks it out.
+
+Writes go through run_write(): a single writer thread owns the only write
+connection and commits requests that arrive close together as one
+transaction (group commit). Readers keep using pooled WAL snapshots.
+
+qdf/qone/exec_sql/run_write/get_connection are instrumented: per-statement
+latency histograms, rows, calling repo function and lock wait are kept in
+memory, and slow statements land in a bounded slow-query log.
 """
 
+import atexit
+import os
+import queue
 import sqlite3
+import sys
+import threading
+import time
+from collections import deque
 import pandas as pd
+from concurrent.futures import Future
 from contextlib import contextmanager
 
-from core.config import DB_PATH
+from core.config import (
+    DB_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT, WRITE_BATCH_WINDOW_MS, WRITE_BATCH_MAX,
+    QUERY_STATS_ENABLED, SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE, QUERY_STATS_MAX_KEYS,
+)
+
+
+# ---------------------------------------------------------------------------
+# Query instrumentation
+# ---------------------------------------------------------------------------
+
+# Histogram bucket upper bounds in ms; the last bucket is open-ended.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_SKIP_FILES = {os.path.abspath(__file__), os.path.abspath(__import__("contextlib").__file__)}
+
+
+def _caller() -> str:
+    """First frame outside this module (and contextlib), as 'module.function'."""
+    f = sys._getframe(2)
+    while f is not None and os.path.abspath(f.f_code.co_filename) in _SKIP_FILES:
+        f = f.f_back
+    if f is None:
+        return "?"
+    return f"{f.f_globals.get('__name__', '?')}.{f.f_code.co_name}"
+
+
+class QueryStats:
+    """Thread-safe in-memory aggregates keyed by (normalised SQL, caller)."""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, slow_log_size=SLOW_QUERY_LOG_SIZE,
+                 max_keys=QUERY_STATS_MAX_KEYS):
+        self.slow_ms = slow_ms
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._norm = {}
+        self._slow = deque(maxlen=slow_log_size)
+
+    def _normalise(self, sql):
+        n = self._norm.get(sql)
+        if n is None:
+            n = " ".join(str(sql).split())[:400]
+            if len(self._norm) < 4 * self.max_keys:
+                self._norm[sql] = n
+        return n
+
+    def record(self, sql, caller, elapsed, rows=None, lock_wait=0.0, error=None):
+        ms = elapsed * 1000.0
+        wait_ms = lock_wait * 1000.0
+        bucket = len(LATENCY_BUCKETS_MS)
+        for i, ub in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= ub:
+                bucket = i
+                break
+        with self._lock:
+            text = self._normalise(sql)
+            key = (text, caller)
+            e = self._entries.get(key)
+            if e is None:
+                if len(self._entries) >= self.max_keys:
+                    key = ("<other>", "<other>")
+                    e = self._entries.get(key)
+                if e is None:
+                    e = self._entries[key] = {
+                        "sql": key[0], "caller": key[1], "count": 0, "errors": 0,
+                        "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "lock_wait_ms": 0.0,
+                        "hist": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                    }
+            e["count"] += 1
+            e["total_ms"] += ms
+            e["max_ms"] = max(e["max_ms"], ms)
+            e["lock_wait_ms"] += wait_ms
+            e["hist"][bucket] += 1
+            if rows:
+                e["rows"] += rows
+            if error is not None:
+                e["errors"] += 1
+            if ms >= self.slow_ms:
+                self._slow.append({
+                    "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "ms": round(ms, 1), "lock_wait_ms": round(wait_ms, 1),
+                    "rows": rows, "caller": caller, "sql": text,
+                    "error": None if error is None else repr(error)[:200],
+                })
+
+    @staticmethod
+    def _percentile(hist, count, q):
+        if not count:
+            return 0.0
+        need = q * count
+        seen = 0
+        for i, n in enumerate(hist):
+            seen += n
+            if seen >= need:
+                return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        """List of per-statement dicts, worst total time first."""
+        with self._lock:
+            entries = [dict(e, hist=list(e["hist"])) for e in self._entries.values()]
+        out = []
+        for e in entries:
+            n = e["count"]
+            out.append({
+                "caller": e["caller"], "sql": e["sql"], "count": n, "errors": e["errors"],
+                "total_ms": round(e["total_ms"], 1),
+                "avg_ms": round(e["total_ms"] / n, 2) if n else 0.0,
+                "p95_ms_le": self._percentile(e["hist"], n, 0.95),
+                "max_ms": round(e["max_ms"], 1),
+                "rows": e["rows"],
+                "lock_wait_ms": round(e["lock_wait_ms"], 1),
+                "hist": e["hist"],
+            })
+        out.sort(key=lambda r: r["total_ms"], reverse=True)
+        return out
+
+    def slow_log(self):
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._slow.clear()
+
+
+_stats = QueryStats()
+
+
+def query_stats(limit=None):
+    """Per-statement aggregates (count, avg/p95/max ms, rows, lock wait), worst first."""
+    rows = _stats.snapshot()
+    return rows[:limit] if limit else rows
+
+
+def slow_queries():
+    """Bounded slow-query log, newest first."""
+    return _stats.slow_log()
+
+
+def reset_query_stats():
+    _stats.reset()
+
+
+# ---------------------------------------------------------------------------
+# Connection pool
+# ---------------------------------------------------------------------------
+
+def _open_connection(path):
+    """Open a connection and run the per-connection PRAGMAs (once)."""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded pool of long-lived SQLite connections.
+      - at most *max_size* connections are ever open at the same time
+      - a thread gets back the connection it used last when it is idle
+      - checkout blocks up to *timeout* seconds when every connection is in use
+    """
+
+    def __init__(self, path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._idle = []
+        self._opened = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._closed = False
+        self._affinity = threading.local()
+
+    def acquire(self):
+        """Check out a connection. Returns (conn, wait_seconds)."""
+        t0 = time.perf_counter()
+        deadline = t0 + self.timeout
+        preferred = getattr(self._affinity, "conn", None)
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    if preferred is not None and preferred in self._idle:
+                        self._idle.remove(preferred)
+                        conn = preferred
+                    else:
+                        conn = self._idle.pop()
+                    break
+                if self._opened < self.max_size:
+                    self._opened += 1
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    raise RuntimeError(
+                        f"DB pool exhausted: {self._in_use}/{self.max_size} "
+                        f"connections in use after {self.timeout:.0f}s")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            wait = time.perf_counter() - t0
+            self._checkouts += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+        if conn is None:
+            try:
+                conn = _open_connection(self.path)
+            except Exception:
+                with self._cond:
+                    self._opened -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        self._affinity.conn = conn
+        return conn, wait
+
+    def release(self, conn, discard=False):
+        """Return *conn* to the pool; *discard* closes it instead (broken connection)."""
+        with self._cond:
+            self._in_use -= 1
+            discard = discard or self._closed
+            if discard:
+                self._opened -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+        if discard:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def close(self):
+        """Close all idle connections (checked-out ones are closed on release)."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._closed = True
+        for conn in idle:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> dict:
+        with self._cond:
+            n = self._checkouts
+            return {
+                "max_size": self.max_size,
+                "open": self._opened,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": n,
+                "wait_ms_avg": (self._wait_total / n * 1000.0) if n else 0.0,
+                "wait_ms_max": self._wait_max * 1000.0,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+def close_pool():
+    """Close every pooled connection; the next get_connection() starts a fresh pool."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+def pool_stats() -> dict:
+    """Pool size, connections in use and checkout wait times (for diagnostics)."""
+    return get_pool().stats()
+
+
+@contextmanager
+def _pooled():
+    """Yield (conn, checkout_wait_s); nested use on one thread shares the outer connection."""
+    outer = getattr(_local, "conn", None)
+    if outer is not None:
+        yield outer, 0.0
+        return
+
+    pool = get_pool()
+    conn, wait = pool.acquire()
+    _local.conn = conn
+    discard = False
+    try:
+        yield conn, wait
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            discard = True
+        raise
+    finally:
+        _local.conn = None
+        pool.release(conn, discard=discard)
 
 
 @contextmanager
@@ -19,20 +352,251 @@ def get_connection():
       - timeout=30 s (avoid immediate SQLITE_BUSY under contention)
       - foreign-key enforcement
       - automatic COMMIT on success, ROLLBACK on exception
-      - connection is always closed
+      - connection is always returned to the pool
+    Nested use on the same thread shares the outer connection; only the
+    outermost block commits or rolls back.
     """
-    print(f"[DB] get_connection DB_PATH={DB_PATH}")
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys=ON")
+    if not QUERY_STATS_ENABLED:
+        with _pooled() as (conn, _wait):
+            yield conn
+        return
+    caller = _caller()
+    t0 = time.perf_counter()
+    wait = 0.0
+    err = None
     try:
-        yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
+        with _pooled() as (conn, wait):
+            yield conn
+    except Exception as e:
+        err = e
         raise
     finally:
-        conn.close()
+        _stats.record("<get_connection block>", caller, time.perf_counter() - t0,
+                      lock_wait=wait, error=err)
+
+
+# ---------------------------------------------------------------------------
+# Single writer with group commit
+# ---------------------------------------------------------------------------
+
+class WriteQueue:
+    """
+    One thread, one write connection. Each request is a callable fn(conn)
+    run inside its own SAVEPOINT, so a failing request is rolled back alone
+    while the rest of its batch still commits. Requests arriving within
+    *window_ms* of the first one share a single BEGIN IMMEDIATE … COMMIT.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path, window_ms=WRITE_BATCH_WINDOW_MS, max_batch=WRITE_BATCH_MAX):
+        self.path = path
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self._q = queue.Queue()
+        self._thread = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._failed = 0
+        self._max_batch_seen = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+    def submit(self, fn):
+        """Run fn(conn) on the writer thread; return its result or re-raise its error."""
+        if threading.current_thread() is self._thread:
+            return fn(self._conn)
+        fut = Future()
+        # Start-check and put under one lock: a writer whose open failed drains
+        # the queue under the same lock, so every item is either failed by it
+        # or lands in front of a new writer that tries to open again.
+        with self._lock:
+            self._ensure_started()
+            self._q.put((fn, fut, time.perf_counter()))
+        return fut.result()
+
+    def _ensure_started(self):
+        # caller holds self._lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="pos-db-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._q.put(self._STOP)
+            thread.join(timeout)
+
+    def _run(self):
+        try:
+            conn = _open_connection(self.path)
+        except Exception as e:
+            with self._lock:
+                self._thread = None  # next submit starts a new writer
+                while True:
+                    try:
+                        item = self._q.get_nowait()
+                    except queue.Empty:
+                        return
+                    if item is not self._STOP:
+                        item[1].set_exception(e)
+        conn.isolation_level = None  # explicit BEGIN/COMMIT below
+        self._conn = conn
+        try:
+            while True:
+                item = self._q.get()
+                if item is self._STOP:
+                    break
+                batch = [item]
+                stop = False
+                deadline = time.perf_counter() + self.window
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    try:
+                        nxt = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt is self._STOP:
+                        stop = True
+                        break
+                    batch.append(nxt)
+                self._commit_batch(conn, batch)
+                if stop:
+                    break
+        finally:
+            self._conn = None
+            conn.close()
+
+    def _commit_batch(self, conn, batch):
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, fut, _enq in batch:
+                conn.execute("SAVEPOINT pos_write")
+                try:
+                    result = fn(conn)
+                except Exception as e:
+                    if not conn.in_transaction:
+                        raise  # SQLite aborted the whole transaction
+                    conn.execute("ROLLBACK TO pos_write")
+                    conn.execute("RELEASE pos_write")
+                    outcomes.append((fut, None, e))
+                else:
+                    conn.execute("RELEASE pos_write")
+                    outcomes.append((fut, result, None))
+            conn.execute("COMMIT")
+        except BaseException as e:
+            # BEGIN/COMMIT failed (e.g. SQLITE_BUSY from another process):
+            # nothing in this batch was committed, every caller gets the error.
+            if conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            outcomes = [(fut, None, e) for _fn, fut, _enq in batch]
+
+        failed = 0
+        for fut, result, err in outcomes:
+            if err is None:
+                fut.set_result(result)
+            else:
+                failed += 1
+                fut.set_exception(err)
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._failed += failed
+            self._max_batch_seen = max(self._max_batch_seen, len(batch))
+            for _fn, _fut, enq in batch:
+                w = started - enq
+                self._queue_wait_total += w
+                self._queue_wait_max = max(self._queue_wait_max, w)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            n = self._requests
+            return {
+                "batches": self._batches,
+                "requests": n,
+                "failed": self._failed,
+                "avg_batch": (n / self._batches) if self._batches else 0.0,
+                "max_batch": self._max_batch_seen,
+                "queued": self._q.qsize(),
+                "queue_wait_ms_avg": (self._queue_wait_total / n * 1000.0) if n else 0.0,
+                "queue_wait_ms_max": self._queue_wait_max * 1000.0,
+            }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> WriteQueue:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteQueue(DB_PATH)
+    return _writer
+
+
+def stop_writer():
+    """Drain and stop the writer thread; the next run_write() starts a new one."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
+
+
+atexit.register(stop_writer)
+
+
+def run_write(fn):
+    """
+    Execute fn(conn) on the single writer connection inside a transaction and
+    return its result (e.g. cur.lastrowid). Exceptions raised by *fn* roll back
+    only its own changes and are re-raised in the calling thread.
+    *fn* must not commit/rollback itself, and the caller must not hold an open
+    write transaction on a pooled connection while waiting.
+    """
+    return _submit_write(fn, None, _caller() if QUERY_STATS_ENABLED else None)
+
+
+def _submit_write(fn, sql, caller):
+    writer = get_writer()
+    if not QUERY_STATS_ENABLED:
+        return writer.submit(fn)
+    box = {}
+
+    def _timed(conn):
+        box["wait"] = time.perf_counter() - t0
+        return fn(conn)
+
+    t0 = time.perf_counter()
+    err = None
+    result = None
+    try:
+        result = writer.submit(_timed)
+        return result
+    except Exception as e:
+        err = e
+        raise
+    finally:
+        rows = result if sql is not None and isinstance(result, int) else None
+        _stats.record(sql if sql is not None else "<run_write>", caller,
+                      time.perf_counter() - t0, rows=rows,
+                      lock_wait=box.get("wait", 0.0), error=err)
+
+
+def writer_stats() -> dict:
+    """Group-commit counters: batches, requests per batch, queue wait."""
+    return get_writer().stats()
 
 
 # ---------------------------------------------------------------------------
@@ -48,22 +612,49 @@ def db():
 
 def qdf(sql, params=()):
     """Execute *sql* and return the result as a pandas DataFrame."""
-    with get_connection() as conn:
-        df = pd.read_sql_query(sql, conn, params=params)
-    return df
+    if not QUERY_STATS_ENABLED:
+        with _pooled() as (conn, _wait):
+            return pd.read_sql_query(sql, conn, params=params)
+    caller = _caller()
+    t0 = time.perf_counter()
+    wait = 0.0
+    df = None
+    err = None
+    try:
+        with _pooled() as (conn, wait):
+            df = pd.read_sql_query(sql, conn, params=params)
+        return df
+    except Exception as e:
+        err = e
+        raise
+    finally:
+        _stats.record(sql, caller, time.perf_counter() - t0,
+                      rows=None if df is None else len(df), lock_wait=wait, error=err)
 
 
 def qone(sql, params=()):
     """Execute *sql* and return the first row (or None)."""
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute(sql, params)
-        row = cur.fetchone()
-    return row
+    caller = _caller() if QUERY_STATS_ENABLED else None
+    t0 = time.perf_counter()
+    wait = 0.0
+    row = None
+    err = None
+    try:
+        with _pooled() as (conn, wait):
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            row = cur.fetchone()
+        return row
+    except Exception as e:
+        err = e
+        raise
+    finally:
+        if caller is not None:
+            _stats.record(sql, caller, time.perf_counter() - t0,
+                          rows=0 if row is None else 1, lock_wait=wait, error=err)
 
 
 def exec_sql(sql, params=()):
-    """Execute a single write statement inside a transaction."""
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute(sql, params)
+    """Execute a single write statement on the writer; return the affected row count."""
+    return _submit_write(lambda conn: conn.execute(sql, params).rowcount, sql,
+                         _caller() if QUERY_STATS_ENABLED else None)
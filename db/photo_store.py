@@ -0,0 +1,241 @@
+"""
+Photo store — content-addressed image storage outside the main DB.
+
+Images live under PHOTO_STORE_DIR as <ab>/<cd>/<sha256>; ticket_item_photos
+keeps only sha256 / size / mime. Objects are immutable and shared by hash,
+so put() is idempotent and the tree can be backed up incrementally.
+Rows written before the store existed still carry image_bytes; load()
+falls back to that BLOB until migrate_legacy_blobs() has moved them.
+
+A JPEG thumbnail (PHOTO_THUMB_MAX_PX) is made once at write time and
+stored as its own object (thumb_sha256); list views show thumbnails and
+fetch the full image only on demand. Without Pillow, or for bytes that do
+not decode, no thumbnail is made and readers fall back to the full image.
+
+Maintenance:
+    python -m db.photo_store migrate   # move legacy BLOB rows into the store
+    python -m db.photo_store thumbs    # make missing thumbnails
+    python -m db.photo_store gc        # delete objects no row references
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+from core.config import PHOTO_STORE_DIR, PHOTO_THUMB_MAX_PX, PHOTO_THUMB_QUALITY
+from db.connection import qdf, run_write
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails are optional
+    Image = None
+
+
+_missing_lock = threading.Lock()
+_missing_count = 0
+_missing_recent = deque(maxlen=20)   # (time, sha256) of the latest misses
+
+
+def object_path(sha256: str) -> str:
+    return os.path.join(PHOTO_STORE_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def put(data: bytes) -> str:
+    """Store *data* (if not already present) and return its sha256."""
+    sha = hashlib.sha256(data).hexdigest()
+    path = object_path(sha)
+    try:
+        # Dedup hit: refresh mtime so gc() treats it as new until the row commits
+        os.utime(path)
+        return sha
+    except FileNotFoundError:
+        pass
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return sha
+
+
+def get(sha256):
+    """Bytes for *sha256*, or None if the object is missing."""
+    if not sha256:
+        return None
+    try:
+        with open(object_path(sha256), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def make_thumbnail(data: bytes):
+    """JPEG thumbnail bytes for *data*, or None (no Pillow / not an image)."""
+    if Image is None or not data:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            im.thumbnail((PHOTO_THUMB_MAX_PX, PHOTO_THUMB_MAX_PX))
+            if im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+            out = io.BytesIO()
+            im.save(out, format="JPEG", quality=PHOTO_THUMB_QUALITY, optimize=True)
+    except Exception:
+        return None
+    thumb = out.getvalue()
+    # Already small images keep pointing at the original
+    return thumb if len(thumb) < len(data) else None
+
+
+def put_photo(data: bytes):
+    """Store the image and its thumbnail. Returns (sha256, size, thumb_sha256, thumb_size);
+    the thumb fields are None when no thumbnail was made."""
+    sha = put(data)
+    thumb = make_thumbnail(data)
+    if thumb is None:
+        return sha, len(data), None, None
+    return sha, len(data), put(thumb), len(thumb)
+
+
+def load(sha256, legacy_blob=None):
+    """Read path used by repo_ticketing: store object first, legacy BLOB second.
+    Missing values may arrive as NaN from a DataFrame row, hence the type checks."""
+    if isinstance(sha256, str) and sha256:
+        data = get(sha256)
+        if data is not None:
+            return data
+        _note_missing(sha256)
+    if isinstance(legacy_blob, (bytes, bytearray, memoryview)):
+        return bytes(legacy_blob)
+    return b""
+
+
+def _note_missing(sha256):
+    global _missing_count
+    with _missing_lock:
+        _missing_count += 1
+        _missing_recent.append((time.time(), sha256))
+
+
+def missing_stats() -> dict:
+    """Objects a row referenced but the store did not have (photo diagnostics)."""
+    with _missing_lock:
+        return {"count": _missing_count, "recent": [sha for _ts, sha in reversed(_missing_recent)]}
+
+
+def migrate_legacy_blobs(batch_size: int = 100) -> int:
+    """
+    Move ticket_item_photos rows that still hold image_bytes into the store,
+    *batch_size* rows per write transaction. Safe to re-run; returns rows moved.
+    Run VACUUM afterwards to give the freed pages back to the filesystem.
+    """
+    moved = 0
+    while True:
+        df = qdf(
+            "SELECT id, image_bytes FROM ticket_item_photos "
+            "WHERE sha256 IS NULL ORDER BY id LIMIT ?",
+            (batch_size,),
+        )
+        if df.empty:
+            return moved
+        refs = []
+        for _, r in df.iterrows():
+            blob = bytes(r["image_bytes"] or b"")
+            refs.append((*put_photo(blob), int(r["id"])))
+        run_write(lambda conn: conn.executemany(
+            "UPDATE ticket_item_photos SET sha256=?, size=?, thumb_sha256=?, thumb_size=?, "
+            "image_bytes=X'' WHERE id=? AND sha256 IS NULL",
+            refs,
+        ))
+        moved += len(refs)
+
+
+def backfill_thumbnails(batch_size: int = 100) -> int:
+    """Make thumbnails for stored photos that have none; returns thumbnails made.
+    Rows whose bytes do not decode are left as they are (full image is served)."""
+    made, last_id = 0, 0
+    while True:
+        df = qdf(
+            "SELECT id, sha256 FROM ticket_item_photos "
+            "WHERE sha256 IS NOT NULL AND thumb_sha256 IS NULL AND id > ? "
+            "ORDER BY id LIMIT ?",
+            (last_id, batch_size),
+        )
+        if df.empty:
+            return made
+        refs = []
+        for _, r in df.iterrows():
+            thumb = make_thumbnail(get(r["sha256"]) or b"")
+            if thumb is not None:
+                refs.append((put(thumb), len(thumb), int(r["id"])))
+        last_id = int(df["id"].iloc[-1])
+        if refs:
+            run_write(lambda conn: conn.executemany(
+                "UPDATE ticket_item_photos SET thumb_sha256=?, thumb_size=? WHERE id=?",
+                refs,
+            ))
+        made += len(refs)
+
+
+def referenced_hashes() -> set:
+    df = qdf("SELECT sha256 FROM ticket_item_photos WHERE sha256 IS NOT NULL "
+             "UNION SELECT thumb_sha256 FROM ticket_item_photos WHERE thumb_sha256 IS NOT NULL")
+    return set(df["sha256"]) if not df.empty else set()
+
+
+def gc(min_age_s: float = 3600) -> int:
+    """
+    Delete store objects no row references. Objects younger than *min_age_s*
+    are kept: put() runs before the row that references it is committed.
+    """
+    keep = referenced_hashes()
+    cutoff = time.time() - min_age_s
+    removed = 0
+    for folder, _dirs, files in os.walk(PHOTO_STORE_DIR):
+        for name in files:
+            if name in keep:
+                continue
+            path = os.path.join(folder, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+if __name__ == "__main__":
+    import sys
+
+    from db.connection import get_connection
+    from db.schema import init_db
+
+    init_db()
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "migrate":
+        print(f"moved {migrate_legacy_blobs()} photo rows into {PHOTO_STORE_DIR}")
+        if "--vacuum" in sys.argv:
+            with get_connection() as conn:
+                conn.execute("VACUUM")
+            print("VACUUM done")
+    elif cmd == "thumbs":
+        print(f"made {backfill_thumbnails()} thumbnails")
+    elif cmd == "gc":
+        print(f"removed {gc()} unreferenced objects")
+    else:
+        print("usage: python -m db.photo_store migrate [--vacuum] | thumbs | gc")
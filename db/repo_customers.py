@@ -2,35 +2,39 @@
 Repository — client / customer DB operations (with B3 CRUD).
 """
 
-import random
 from datetime import datetime
 
-from db.connection import get_connection, qdf, qone, exec_sql
+from db.catalog import bump_catalog_version, catalog_write
+from db.codes import CLIENT_CODE, allocate_code, next_code
+from db.connection import qdf, qone, run_write
 
 
 def get_clients():
-    return qdf("SELECT code, name, phone, COALESCE(tier_level, 0) AS tier_level FROM clients WHERE deleted=0 ORDER BY id DESC")
+    return qdf("SELECT id, code, name, phone, COALESCE(tier_level, 0) AS tier_level FROM clients WHERE deleted=0 ORDER BY id DESC")
+
+
+def _client_code_taken(conn, code) -> bool:
+    return conn.execute("SELECT 1 FROM clients WHERE code=?", (code,)).fetchone() is not None
 
 
 def gen_code_6() -> str:
-    for _ in range(200):
-        code = f"{random.randint(0, 999999):06d}"
-        if not qone("SELECT 1 FROM clients WHERE code=?", (code,)):
-            return code
-    mx = qone("SELECT MAX(CAST(code as INTEGER)) AS m FROM clients")
-    m = int(mx["m"] or 0)
-    return f"{(m + 1) % 1000000:06d}"
+    """Next free 6-digit client code (db/codes.py)."""
+    return allocate_code(CLIENT_CODE, _client_code_taken)
 
 
 def save_customer(name: str, phone: str) -> str:
-    code = gen_code_6()
-    with get_connection() as conn:
-        conn.execute(
+    def _write(conn):
+        # Code and row in one transaction: no other terminal can take the code in between
+        code = next_code(conn, CLIENT_CODE, _client_code_taken)
+        client_id = conn.execute(
             "INSERT INTO clients(code,name,phone,created_at) VALUES(?,?,?,?)",
             (code, name.strip(), phone.strip(),
              datetime.now().isoformat(timespec="seconds")),
-        )
-    return code
+        ).lastrowid
+        bump_catalog_version(conn, "clients", client_id)
+        return code
+
+    return run_write(_write)
 
 
 def get_all_clients_df():
@@ -44,9 +48,19 @@ def get_all_clients_df():
 
 def update_client(client_id: int, name: str, phone: str, email: str = "",
                    id_number: str = "", tier_level: int = 0):
-    exec_sql(
+    catalog_write(
         "UPDATE clients SET name=?, phone=?, email=?, id_number=?, tier_level=? WHERE id=?",
         (name.strip(), phone.strip(), email.strip(), id_number.strip(), int(tier_level), client_id),
+        "clients", client_id,
+    )
+
+
+def get_client_by_id(client_id: int):
+    """One client row incl. deleted flag — client search index upkeep."""
+    return qone(
+        "SELECT id, code, name, phone, COALESCE(tier_level, 0) AS tier_level, deleted "
+        "FROM clients WHERE id=?",
+        (client_id,),
     )
 
 
@@ -57,4 +71,4 @@ def get_client_tier(client_code: str) -> int:
 
 
 def delete_client(client_id: int):
-    exec_sql("UPDATE clients SET deleted=1 WHERE id=?", (client_id,))
+    catalog_write("UPDATE clients SET deleted=1 WHERE id=?", (client_id,), "clients", client_id)
@@ -3,10 +3,10 @@ Repository — materials, categories, operators, and settings.
 Includes B3 CRUD operations for categories and materials.
 """
 
-import random
 from datetime import datetime
 
-from db.connection import get_connection, qdf, qone, exec_sql
+from db.catalog import bump_catalog_version, catalog_write
+from db.connection import qdf, qone, run_write
 
 
 # ---------------------------------------------------------------------------
@@ -18,13 +18,15 @@ def get_categories():
 
 
 def add_category(name: str, sort_order: int = 0) -> int:
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute(
+    def _write(conn):
+        cat_id = conn.execute(
             "INSERT INTO material_categories(name, sort_order) VALUES(?,?)",
             (name.strip(), sort_order),
-        )
-        return cur.lastrowid
+        ).lastrowid
+        bump_catalog_version(conn, "material_categories", cat_id)
+        return cat_id
+
+    return run_write(_write)
 
 
 def delete_category(cat_id: int) -> bool:
@@ -35,7 +37,8 @@ def delete_category(cat_id: int) -> bool:
     )
     if row and row["c"] > 0:
         return False
-    exec_sql("DELETE FROM material_categories WHERE id=?", (cat_id,))
+    catalog_write("DELETE FROM material_categories WHERE id=?", (cat_id,),
+                   "material_categories", cat_id)
     return True
 
 
@@ -53,6 +56,22 @@ def get_materials():
     """)
 
 
+def get_material_price_rows():
+    """Active materials' price fields — price book (services/price_book.py)."""
+    return qdf(
+        "SELECT id, unit_price, min_unit_price, max_unit_price "
+        "FROM materials WHERE deleted=0 ORDER BY id"
+    )
+
+
+def get_material_price_row(mat_id: int):
+    return qone(
+        "SELECT id, unit_price, min_unit_price, max_unit_price, deleted "
+        "FROM materials WHERE id=?",
+        (mat_id,),
+    )
+
+
 def get_all_materials_df():
     return qdf("""
         SELECT m.id, c.name AS category, m.item_code, m.name, m.unit,
@@ -66,32 +85,35 @@ def get_all_materials_df():
 
 def add_material(category_id: int, item_code: str, name: str, unit: str,
                  unit_price: float, min_price: float, max_price: float) -> int:
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("""
+    def _write(conn):
+        mat_id = conn.execute("""
             INSERT INTO materials(category_id, item_code, name, unit,
                                   unit_price, min_unit_price, max_unit_price,
                                   deleted, created_at)
             VALUES(?,?,?,?,?,?,?,0,?)
         """, (category_id, item_code.strip(), name.strip(), unit.strip(),
               unit_price, min_price, max_price,
-              datetime.now().isoformat(timespec="seconds")))
-        return cur.lastrowid
+              datetime.now().isoformat(timespec="seconds"))).lastrowid
+        bump_catalog_version(conn, "materials", mat_id)
+        return mat_id
+
+    return run_write(_write)
 
 
 def update_material(mat_id: int, unit_price: float, min_price: float, max_price: float):
-    exec_sql(
+    catalog_write(
         "UPDATE materials SET unit_price=?, min_unit_price=?, max_unit_price=? WHERE id=?",
         (unit_price, min_price, max_price, mat_id),
+        "materials", mat_id,
     )
 
 
 def delete_material(mat_id: int):
-    exec_sql("UPDATE materials SET deleted=1 WHERE id=?", (mat_id,))
+    catalog_write("UPDATE materials SET deleted=1 WHERE id=?", (mat_id,), "materials", mat_id)
 
 
 def restore_material(mat_id: int):
-    exec_sql("UPDATE materials SET deleted=0 WHERE id=?", (mat_id,))
+    catalog_write("UPDATE materials SET deleted=0 WHERE id=?", (mat_id,), "materials", mat_id)
 
 
 # ---------------------------------------------------------------------------
@@ -110,17 +132,19 @@ def get_all_operators_df():
 
 
 def add_operator(email: str, name: str) -> int:
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute(
+    def _write(conn):
+        op_id = conn.execute(
             "INSERT INTO operators(email,name,deleted,created_at) VALUES(?,?,0,?)",
             (email.strip(), name.strip(), datetime.now().isoformat(timespec="seconds")),
-        )
-        return cur.lastrowid
+        ).lastrowid
+        bump_catalog_version(conn, "operators", op_id)
+        return op_id
+
+    return run_write(_write)
 
 
 def delete_operator(op_id: int):
-    exec_sql("UPDATE operators SET deleted=1 WHERE id=?", (op_id,))
+    catalog_write("UPDATE operators SET deleted=1 WHERE id=?", (op_id,), "operators", op_id)
 
 
 def get_default_operator_email() -> str:
@@ -137,12 +161,13 @@ def get_setting(key: str, default: str = "") -> str:
     return r["value"] if r else default
 
 
-def save_setting(key: str, value: str):
-    exec_sql("INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)", (key, value))
+def get_all_settings():
+    return qdf("SELECT key, value FROM settings")
 
 
-def gen_withdraw_code() -> str:
-    return str(random.randint(100000, 999999))
+def save_setting(key: str, value: str):
+    catalog_write("INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)", (key, value),
+                   "settings", key)
 
 
 # ---------------------------------------------------------------------------
@@ -161,15 +186,24 @@ def get_material_tiers(material_id: int) -> dict:
     return result
 
 
+def get_all_material_tiers():
+    """All tier rows (material_id, tier_level, pct_adjustment) — price book."""
+    return qdf("SELECT material_id, tier_level, pct_adjustment FROM material_tier_prices")
+
+
 def save_material_tiers(material_id: int, tiers: dict):
     """Save tier percentages for a material. tiers = {1: 10.0, 2: 15.0, ...}"""
-    with get_connection() as conn:
-        for level, pct in tiers.items():
-            conn.execute(
-                "INSERT INTO material_tier_prices(material_id, tier_level, pct_adjustment) "
-                "VALUES(?,?,?) ON CONFLICT(material_id, tier_level) DO UPDATE SET pct_adjustment=?",
-                (material_id, int(level), float(pct), float(pct)),
-            )
+    rows = [(material_id, int(level), float(pct), float(pct)) for level, pct in tiers.items()]
+
+    def _write(conn):
+        conn.executemany(
+            "INSERT INTO material_tier_prices(material_id, tier_level, pct_adjustment) "
+            "VALUES(?,?,?) ON CONFLICT(material_id, tier_level) DO UPDATE SET pct_adjustment=?",
+            rows,
+        )
+        bump_catalog_version(conn, "material_tier_prices", material_id)
+
+    run_write(_write)
 
 
 def get_client_material_prices(client_id: int):
@@ -185,21 +219,35 @@ def get_client_material_prices(client_id: int):
     """, (client_id,))
 
 
+def get_all_client_material_prices():
+    """Every client override (client_id, material_id, adjust_type, adjust_value) — price book."""
+    return qdf(
+        "SELECT client_id, material_id, adjust_type, adjust_value FROM client_material_prices"
+    )
+
+
 def save_client_material_price(client_id: int, material_id: int,
                                adjust_type: str, adjust_value: float):
     """Save or update a client-specific material price adjustment."""
-    with get_connection() as conn:
-        conn.execute(
-            "INSERT INTO client_material_prices(client_id, material_id, adjust_type, adjust_value) "
-            "VALUES(?,?,?,?) ON CONFLICT(client_id, material_id) DO UPDATE "
-            "SET adjust_type=?, adjust_value=?",
-            (client_id, material_id, adjust_type, float(adjust_value),
-             adjust_type, float(adjust_value)),
-        )
+    catalog_write(
+        "INSERT INTO client_material_prices(client_id, material_id, adjust_type, adjust_value) "
+        "VALUES(?,?,?,?) ON CONFLICT(client_id, material_id) DO UPDATE "
+        "SET adjust_type=?, adjust_value=?",
+        (client_id, material_id, adjust_type, float(adjust_value),
+         adjust_type, float(adjust_value)),
+        "client_material_prices", client_id,
+    )
 
 
 def delete_client_material_price(record_id: int):
-    exec_sql("DELETE FROM client_material_prices WHERE id=?", (record_id,))
+    def _write(conn):
+        row = conn.execute("DELETE FROM client_material_prices WHERE id=? RETURNING client_id",
+                           (record_id,)).fetchone()
+        if row is not None:
+            # key: only this client's overrides are re-read by the price book
+            bump_catalog_version(conn, "client_material_prices", row[0])
+
+    run_write(_write)
 
 
 def get_client_adjusted_price(client_id: int, material_id: int, base_price: float):
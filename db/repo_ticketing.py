@@ -2,30 +2,41 @@
 Repository — all ticket / receipt DB operations.
 Phase 3: finalize_ticket() is fully atomic (single transaction).
 MVP: Confirm 即落库 — create_draft_receipt, insert_receipt_line, insert_line_photos.
+All writes run on the single writer via run_write() (group commit).
+Writes that change a finalized receipt keep daily_rollups in the same transaction.
 """
 
+import json
 import os
 import uuid
 from datetime import datetime
 
 from core.config import DB_PATH
-from db.connection import get_connection, qdf, qone
+from db import photo_store
+from db.codes import WITHDRAW_CODE, next_code
+from db.connection import qdf, qone, exec_sql, run_write
+from db.rollups import apply_receipt, receipt_rollup, receipt_rollup_delta, receipts_rollup
 
 def _db_path_abs():
     return os.path.abspath(DB_PATH)
 
 
+def _issue_keys(issue_time):
+    """(issue_date, issue_month, issue_year) for 'YYYY-MM-DD HH:MM:SS'."""
+    s = issue_time or ""
+    return s[:10], s[:7], s[:4]
+
+
 # ---------------------------------------------------------------------------
 # Print-preview storage
 # ---------------------------------------------------------------------------
 
 def save_preview_html(html_content: str) -> str:
     token = str(uuid.uuid4())
-    with get_connection() as conn:
-        conn.execute(
-            "INSERT INTO print_previews(token, html, created_at) VALUES(?,?,?)",
-            (token, html_content, datetime.now().isoformat()),
-        )
+    exec_sql(
+        "INSERT INTO print_previews(token, html, created_at) VALUES(?,?,?)",
+        (token, html_content, datetime.now().isoformat()),
+    )
     return token
 
 
@@ -35,13 +46,10 @@ def get_preview_html(token: str):
 
 
 def save_receipt_print_html(html_content: str) -> int:
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO receipt_print(html, created_at) VALUES(?,?)",
-            (html_content, datetime.now().isoformat()),
-        )
-        return cur.lastrowid
+    return run_write(lambda conn: conn.execute(
+        "INSERT INTO receipt_print(html, created_at) VALUES(?,?)",
+        (html_content, datetime.now().isoformat()),
+    ).lastrowid)
 
 
 def get_receipt_print_html(rid: int):
@@ -70,68 +78,77 @@ def get_receipt_lines(receipt_id: int):
 
 def create_draft_receipt():
     """创建草稿单据，返回 receipt_id。"""
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO receipts(issue_time, issued_by, ticketing_method,
-                                 withdraw_code, client_code, client_name,
-                                 subtotal, rounding_amount, voided, withdrawn)
-            VALUES('', '', '', '', '', '', 0, 0, 0, 0)
-        """)
-        return cur.lastrowid
+    return run_write(lambda conn: conn.execute("""
+        INSERT INTO receipts(issue_time, issued_by, ticketing_method,
+                             withdraw_code, client_code, client_name,
+                             subtotal, rounding_amount, voided, withdrawn)
+        VALUES('', '', '', '', '', '', 0, 0, 0, 0)
+    """).lastrowid)
 
 
 def insert_receipt_line(receipt_id: int, material_name: str, unit_price: float,
                        gross: float, tare: float, net: float, total: float):
     """插入一条 receipt_line，返回 line_id (receipt_lines.id)。"""
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO receipt_lines(receipt_id, material_name, unit_price,
-                                      gross, tare, net, total)
-            VALUES(?,?,?,?,?,?,?)
-        """, (receipt_id, material_name, unit_price, gross, tare, net, total))
-        return cur.lastrowid
+    return run_write(lambda conn: conn.execute("""
+        INSERT INTO receipt_lines(receipt_id, material_name, unit_price,
+                                  gross, tare, net, total)
+        VALUES(?,?,?,?,?,?,?)
+    """, (receipt_id, material_name, unit_price, gross, tare, net, total)).lastrowid)
+
+
+def _store_photos(photos):
+    """Write photo bytes + thumbnails to the photo store (outside any DB transaction).
+    Returns [(cam_index, sha256, size, thumb_sha256, thumb_size), ...]."""
+    refs = []
+    for cam_idx, payload in photos:
+        blob = payload if isinstance(payload, bytes) else b""
+        refs.append((cam_idx, *photo_store.put_photo(blob)))
+    return refs
+
+
+_INSERT_PHOTO_REF_SQL = (
+    "INSERT INTO ticket_item_photos"
+    "(ticket_item_id, cam_index, image_bytes, mime, sha256, size, thumb_sha256, thumb_size) "
+    "VALUES(?,?,X'',?,?,?,?,?)"
+)
 
 
 def insert_line_photos(ticket_item_id: int, photos: list):
     """
     写入 ticket_item_photos。photos = [(cam_index, image_bytes), ...]，允许只写 cam1。
-    写入后立刻 SELECT 验证，返回 {"ticket_item_id", "photo_count", "lengths"}。
+    图片字节进 photo_store，表里只存 sha256/size/mime。
+    写入后立刻 SELECT 验证，返回 {"ticket_item_id", "photo_count", "lengths"}；
+    line 已被删除时不写，返回 None（services/photo_persist 异步调用）。
     失败时打印完整异常 + ticket_item_id/cam_index/len(bytes)/DB_PATH，不吞异常。
     """
     import traceback
     db_path = _db_path_abs()
-    with get_connection() as conn:
+    refs = _store_photos(photos)
+
+    def _write(conn):
         cur = conn.cursor()
-        for cam_idx, payload in photos:
-            blob = payload if isinstance(payload, bytes) else b""
+        if cur.execute("SELECT 1 FROM receipt_lines WHERE id = ?",
+                       (ticket_item_id,)).fetchone() is None:
+            return None
+        for cam_idx, sha, size, thumb_sha, thumb_size in refs:
             try:
-                cur.execute(
-                    "INSERT INTO ticket_item_photos"
-                    "(ticket_item_id, cam_index, image_bytes, mime) VALUES(?,?,?,?)",
-                    (ticket_item_id, cam_idx, blob, "image/jpeg"),
-                )
-                print(
-                    "[insert_line_photos] OK:",
-                    "DB_PATH=", db_path,
-                    "ticket_item_id=", ticket_item_id,
-                    "cam_index=", cam_idx,
-                    "len(image_bytes)=", len(blob),
-                )
+                cur.execute(_INSERT_PHOTO_REF_SQL,
+                            (ticket_item_id, cam_idx, "image/jpeg", sha, size,
+                             thumb_sha, thumb_size))
             except Exception as e:
                 print(
                     "[insert_line_photos] FAILED:",
                     "ticket_item_id=", ticket_item_id,
                     "cam_index=", cam_idx,
-                    "len(image_bytes)=", len(blob),
+                    "len(image_bytes)=", size,
                     "DB_PATH=", db_path,
                 )
                 traceback.print_exc()
                 raise
         # 强校验：count / lengths / sum
         cur.execute(
-            "SELECT length(image_bytes) AS len FROM ticket_item_photos WHERE ticket_item_id = ?",
+            "SELECT COALESCE(size, length(image_bytes)) AS len "
+            "FROM ticket_item_photos WHERE ticket_item_id = ?",
             (ticket_item_id,),
         )
         rows = cur.fetchall()
@@ -149,38 +166,74 @@ def insert_line_photos(ticket_item_id: int, photos: list):
             "lengths": lengths,
         }
 
+    return run_write(_write)
+
+
+def _withdraw_code_taken(conn, code) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM receipts WHERE withdraw_code=? AND withdrawn=0 AND voided=0 LIMIT 1",
+        (code,),
+    ).fetchone() is not None
+
+
+def _withdraw_code(conn, wcode):
+    """*wcode*, or a new 6-digit code not held by an unpaid ticket (db/codes.py).
+    Allocated inside the finalize write, so the check and the row that uses
+    the code commit together — no other terminal can take it in between."""
+    return wcode or next_code(conn, WITHDRAW_CODE, _withdraw_code_taken)
+
 
 def update_receipt_on_finalize(receipt_id: int, issue_time: str, issued_by: str,
-                               method: str, wcode: str, client_code: str, client_name: str,
-                               subtotal: float, rounding: float):
-    """将草稿 receipt 更新为正式单据（不插 line，line 已在 Confirm 时写入）。"""
-    with get_connection() as conn:
-        conn.execute("""
-            UPDATE receipts SET issue_time=?, issued_by=?, ticketing_method=?,
-                withdraw_code=?, client_code=?, client_name=?,
-                subtotal=?, rounding_amount=?
-            WHERE id=?
-        """, (issue_time, issued_by, method, wcode, client_code, client_name,
-              subtotal, rounding, receipt_id))
+                               method: str, wcode, client_code: str, client_name: str,
+                               subtotal: float, rounding: float) -> str:
+    """将草稿 receipt 更新为正式单据（不插 line，line 已在 Confirm 时写入）。
+    wcode=None 时在同一事务内分配取款码；返回使用的取款码。"""
+    def _write(conn):
+        code = _withdraw_code(conn, wcode)
+        with receipt_rollup(conn, receipt_id):
+            conn.execute("""
+                UPDATE receipts SET issue_time=?, issue_date=?, issue_month=?, issue_year=?,
+                    issued_by=?, ticketing_method=?,
+                    withdraw_code=?, client_code=?, client_name=?,
+                    subtotal=?, rounding_amount=?
+                WHERE id=?
+            """, (issue_time, *_issue_keys(issue_time), issued_by, method, code,
+                  client_code, client_name, subtotal, rounding, receipt_id))
+        return code
+
+    return run_write(_write)
 
 
 def delete_receipt_line(line_id: int):
     """删除一条 line 及其照片。"""
-    with get_connection() as conn:
-        conn.execute("DELETE FROM ticket_item_photos WHERE ticket_item_id = ?", (line_id,))
-        conn.execute("DELETE FROM receipt_lines WHERE id = ?", (line_id,))
+    delete_receipt_lines([line_id])
+
+
+def delete_receipt_lines(line_ids):
+    """删除多条 line；照片由 ON DELETE CASCADE 一并删除（一条语句）。"""
+    ids = [int(lid) for lid in line_ids]
+    if not ids:
+        return
+    run_write(lambda conn: conn.execute(
+        "DELETE FROM receipt_lines WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(ids),),
+    ))
+
+
+def update_draft_lines(rows):
+    """Batch-update draft lines after receipt-preview edits (one transaction).
+    rows = [(unit_price, gross, tare, net, total, line_id), ...]"""
+    if not rows:
+        return
+    run_write(lambda conn: conn.executemany(
+        "UPDATE receipt_lines SET unit_price=?, gross=?, tare=?, net=?, total=? WHERE id=?",
+        rows,
+    ))
 
 
 def delete_draft_receipt(receipt_id: int):
-    """删除草稿单据及其所有 lines 和 photos。"""
-    with get_connection() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM receipt_lines WHERE receipt_id = ?", (receipt_id,))
-        for row in cur.fetchall():
-            lid = row["id"]
-            conn.execute("DELETE FROM ticket_item_photos WHERE ticket_item_id = ?", (lid,))
-        conn.execute("DELETE FROM receipt_lines WHERE receipt_id = ?", (receipt_id,))
-        conn.execute("DELETE FROM receipts WHERE id = ?", (receipt_id,))
+    """删除草稿单据；lines 和 photos 由 ON DELETE CASCADE 一并删除（一条语句）。"""
+    run_write(lambda conn: conn.execute("DELETE FROM receipts WHERE id = ?", (receipt_id,)))
 
 
 def get_latest_receipt_line_ids(limit: int = 5):
@@ -195,7 +248,8 @@ def get_latest_receipt_line_ids(limit: int = 5):
 def get_photo_verification_for_line(line_id: int):
     """返回该 line 在 ticket_item_photos 的 count 与各条 length(image_bytes)。"""
     df = qdf(
-        "SELECT cam_index, length(image_bytes) AS len FROM ticket_item_photos WHERE ticket_item_id = ?",
+        "SELECT cam_index, COALESCE(size, length(image_bytes)) AS len "
+        "FROM ticket_item_photos WHERE ticket_item_id = ?",
         (line_id,),
     )
     if df.empty:
@@ -207,6 +261,18 @@ def get_photo_verification_for_line(line_id: int):
     }
 
 
+_INSERT_LINE_SQL = (
+    "INSERT INTO receipt_lines(receipt_id, material_name, unit_price, gross, tare, net, total) "
+    "VALUES(?,?,?,?,?,?,?)"
+)
+_LINE_IDS_SQL = "SELECT id FROM receipt_lines WHERE receipt_id = ? ORDER BY id"
+_VERIFY_RECEIPT_PHOTOS_SQL = (
+    "SELECT p.ticket_item_id, COALESCE(p.size, length(p.image_bytes)) AS len "
+    "FROM receipt_lines l JOIN ticket_item_photos p ON p.ticket_item_id = l.id "
+    "WHERE l.receipt_id = ? ORDER BY p.ticket_item_id, p.cam_index"
+)
+
+
 def finalize_ticket(issue_time, issued_by, method, wcode,
                     client_code, client_name, subtotal, rounding, line_rows,
                     line_photos=None):
@@ -214,72 +280,114 @@ def finalize_ticket(issue_time, issued_by, method, wcode,
     Phase 3 — Atomic ticket creation.
     *line_rows*: list of (material_name, unit_price, gross, tare, net, total).
     *line_photos*: optional list, same length as line_rows; each element is
-        None or list of (cam_index, image_bytes) for that line (BLOB 存 ticket_item_photos).
-    Returns (receipt_id, verification_list). verification_list: list of
+        None or list of (cam_index, image_bytes) for that line (bytes 存 photo_store).
+    *wcode*: withdraw code, or None to allocate one in the same transaction.
+    Returns (receipt_id, verification_list, wcode). verification_list: list of
         {"ticket_item_id": int, "photo_count": int, "lengths": [int, int]}.
     """
-    verification = []
-    with get_connection() as conn:
+    photo_refs = [_store_photos(p) if p else None for p in (line_photos or [])]
+
+    def _write(conn):
+        verification = []
+        code = _withdraw_code(conn, wcode)
         cur = conn.cursor()
         cur.execute("""
-            INSERT INTO receipts(issue_time, issued_by, ticketing_method,
+            INSERT INTO receipts(issue_time, issue_date, issue_month, issue_year,
+                                 issued_by, ticketing_method,
                                  withdraw_code, client_code, client_name,
                                  subtotal, rounding_amount, voided, withdrawn)
-            VALUES(?,?,?,?,?,?,?,?,0,0)
-        """, (issue_time, issued_by, method, wcode,
+            VALUES(?,?,?,?,?,?,?,?,?,?,?,0,0)
+        """, (issue_time, *_issue_keys(issue_time), issued_by, method, code,
               client_code, client_name, float(subtotal), float(rounding)))
         rid = cur.lastrowid
 
-        line_ids = []
-        for row in line_rows:
-            cur.execute("""
-                INSERT INTO receipt_lines(receipt_id, material_name, unit_price,
-                                          gross, tare, net, total)
-                VALUES(?,?,?,?,?,?,?)
-            """, (rid, *row))
-            line_ids.append(cur.lastrowid)
-
-        # 写入 ticket_item_photos（BLOB）
-        if line_photos:
-            for i, photos in enumerate(line_photos):
-                if photos and i < len(line_ids):
-                    ticket_item_id = line_ids[i]
-                    for cam_idx, payload in photos:
-                        blob = payload if isinstance(payload, bytes) else b""
-                        cur.execute(
-                            "INSERT INTO ticket_item_photos"
-                            "(ticket_item_id, cam_index, image_bytes, mime) VALUES(?,?,?,?)",
-                            (ticket_item_id, cam_idx, blob, "image/jpeg"))
-
-        # 写入后立刻验证：每个 ticket_item_id 的照片条数 = 2，每条 bytes 长度 > 1000
+        # Bulk inserts; a new receipt's lines in id order are the rows just inserted
+        cur.executemany(_INSERT_LINE_SQL, [(rid, *row) for row in line_rows])
+        line_ids = [r[0] for r in cur.execute(_LINE_IDS_SQL, (rid,)).fetchall()]
+
+        # 写入 ticket_item_photos（只存 sha256/size，字节已在 photo_store）
+        cur.executemany(_INSERT_PHOTO_REF_SQL, [
+            (line_ids[i], cam_idx, "image/jpeg", sha, size, thumb_sha, thumb_size)
+            for i, refs in enumerate(photo_refs) if refs and i < len(line_ids)
+            for cam_idx, sha, size, thumb_sha, thumb_size in refs
+        ])
+
+        # 写入后立刻验证：一条查询取回整张单的照片长度（按 line、cam_index 排序）
+        found = {}
+        for r in cur.execute(_VERIFY_RECEIPT_PHOTOS_SQL, (rid,)).fetchall():
+            found.setdefault(r["ticket_item_id"], []).append(r["len"] or 0)
         for ticket_item_id in line_ids:
-            cur.execute(
-                "SELECT id, length(image_bytes) AS len FROM ticket_item_photos WHERE ticket_item_id = ?",
-                (ticket_item_id,),
-            )
-            rows = cur.fetchall()
+            lengths = found.get(ticket_item_id, [])
             verification.append({
                 "ticket_item_id": ticket_item_id,
-                "photo_count": len(rows),
-                "lengths": [r["len"] or 0 for r in rows],
+                "photo_count": len(lengths),
+                "lengths": lengths,
             })
+        apply_receipt(conn, rid, +1)
+        return rid, verification, code
 
-    return rid, verification
+    return run_write(_write)
 
 
-def get_item_photos(ticket_item_id: int):
+def get_item_photos(ticket_item_id: int, thumbnails: bool = False):
     """
-    从 DB 读取某一条 line 的两张照片（仅 ticket_item_photos，BLOB）。
+    读取某一条 line 的两张照片（ticket_item_photos → photo_store；旧行回退 BLOB）。
+    thumbnails=True 时优先返回缩略图（没有缩略图的行返回原图）。
     返回 [(cam_index, image_bytes), ...]，按 cam_index 排序。
     """
-    df = qdf(
-        "SELECT cam_index, image_bytes FROM ticket_item_photos "
-        "WHERE ticket_item_id = ? ORDER BY cam_index",
-        (ticket_item_id,),
-    )
+    if thumbnails:
+        sql = ("SELECT cam_index, COALESCE(thumb_sha256, sha256) AS sha256, "
+               "CASE WHEN sha256 IS NULL THEN image_bytes END AS image_bytes "
+               "FROM ticket_item_photos WHERE ticket_item_id = ? ORDER BY cam_index")
+    else:
+        sql = ("SELECT cam_index, sha256, "
+               "CASE WHEN sha256 IS NULL THEN image_bytes END AS image_bytes "
+               "FROM ticket_item_photos WHERE ticket_item_id = ? ORDER BY cam_index")
+    df = qdf(sql, (ticket_item_id,))
     if df.empty:
         return []
-    return [(int(r["cam_index"]), r["image_bytes"]) for _, r in df.iterrows()]
+    return [(int(r["cam_index"]), photo_store.load(r["sha256"], r["image_bytes"]))
+            for _, r in df.iterrows()]
+
+
+def _null(v):
+    """None for SQL NULLs that pandas turned into NaN."""
+    return None if v is None or v != v else v
+
+
+def get_receipt_photos(receipt_id: int, thumbnails: bool = False,
+                       metadata_only: bool = False):
+    """
+    一次查询取整张单据的照片（receipt_lines → ticket_item_photos 走索引）。
+    返回 {line_id: {cam_index: image_bytes}}；thumbnails=True 时优先缩略图。
+    metadata_only=True 时不读图片，值为
+        {"sha256", "size", "thumb_sha256", "thumb_size", "mime"}。
+    """
+    df = qdf("""
+        SELECT p.ticket_item_id AS line_id, p.cam_index, p.sha256, p.thumb_sha256,
+               COALESCE(p.size, length(p.image_bytes)) AS size, p.thumb_size, p.mime,
+               CASE WHEN ? = 0 AND p.sha256 IS NULL THEN p.image_bytes END AS image_bytes
+        FROM receipt_lines rl
+        JOIN ticket_item_photos p ON p.ticket_item_id = rl.id
+        WHERE rl.receipt_id = ?
+        ORDER BY rl.id, p.cam_index
+    """, (1 if metadata_only else 0, receipt_id))
+    out = {}
+    for r in df.itertuples(index=False):
+        cams = out.setdefault(int(r.line_id), {})
+        if metadata_only:
+            thumb_size = _null(r.thumb_size)
+            cams[int(r.cam_index)] = {
+                "sha256": _null(r.sha256),
+                "size": int(_null(r.size) or 0),
+                "thumb_sha256": _null(r.thumb_sha256),
+                "thumb_size": int(thumb_size) if thumb_size is not None else None,
+                "mime": r.mime,
+            }
+        else:
+            sha = (thumbnails and _null(r.thumb_sha256)) or _null(r.sha256)
+            cams[int(r.cam_index)] = photo_store.load(sha, r.image_bytes)
+    return out
 
 
 def get_line_photos(receipt_id: int):
@@ -290,36 +398,115 @@ def get_line_photos(receipt_id: int):
         (receipt_id,))
 
 
+def _set_voided(receipt_id: int, voided: int):
+    def _write(conn):
+        with receipt_rollup(conn, receipt_id):
+            conn.execute("UPDATE receipts SET voided = ? WHERE id = ?", (voided, receipt_id))
+
+    run_write(_write)
+
+
 def void_ticket(receipt_id: int):
-    with get_connection() as conn:
-        conn.execute(
-            "UPDATE receipts SET voided = 1 WHERE id = ?", (receipt_id,))
+    _set_voided(receipt_id, 1)
 
 
 def restore_ticket(receipt_id: int):
-    with get_connection() as conn:
-        conn.execute(
-            "UPDATE receipts SET voided = 0 WHERE id = ?", (receipt_id,))
+    _set_voided(receipt_id, 0)
+
+
+# ---------------------------------------------------------------------------
+# Payout — sellers collect their money with the withdraw code
+# ---------------------------------------------------------------------------
+
+def get_ticket_by_withdraw_code(wcode: str):
+    """
+    Ticket for *wcode* (index lookup): the newest unpaid one if any, else the
+    newest finalized one, so the caller can tell "already paid" / "voided".
+    New codes skip those held by unpaid tickets (finalize allocates them in
+    its own transaction), so at most one unpaid ticket has a code; a paid or
+    voided ticket's code can be issued again. None if unknown.
+    """
+    return qone("""
+        SELECT id, issue_time, issue_date, withdraw_code, client_code, client_name,
+               subtotal, rounding_amount, voided, withdrawn, withdrawn_at
+        FROM receipts
+        WHERE withdraw_code = ? AND issue_date != ''
+        ORDER BY (withdrawn = 0 AND voided = 0) DESC, id DESC
+        LIMIT 1
+    """, ((wcode or "").strip(),))
+
+
+def get_unpaid_tickets_df(day: str):
+    """Finalized, not voided, not withdrawn tickets of *day* (end-of-day payout)."""
+    return qdf("""
+        SELECT id, withdraw_code, issue_time, client_code, client_name, rounding_amount
+        FROM receipts
+        WHERE issue_date = ? AND voided = 0 AND withdrawn = 0
+        ORDER BY id
+    """, (day,))
+
+
+def mark_withdrawn(receipt_id: int) -> bool:
+    """Mark one ticket paid. False if it was already paid, voided or is a draft —
+    the guarded UPDATE makes paying the same code twice impossible."""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _write(conn):
+        with receipt_rollup(conn, receipt_id):
+            cur = conn.execute(
+                "UPDATE receipts SET withdrawn = 1, withdrawn_at = ? "
+                "WHERE id = ? AND withdrawn = 0 AND voided = 0 AND issue_date != ''",
+                (now, receipt_id),
+            )
+        return cur.rowcount == 1
+
+    return run_write(_write)
+
+
+def mark_withdrawn_batch(receipt_ids) -> list:
+    """Mark many tickets paid in one transaction; returns the ids actually
+    marked (ids already paid, voided or unknown are skipped)."""
+    ids = json.dumps([int(i) for i in receipt_ids])
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _write(conn):
+        payable = [r[0] for r in conn.execute(
+            "SELECT id FROM receipts WHERE id IN (SELECT value FROM json_each(?)) "
+            "AND withdrawn = 0 AND voided = 0 AND issue_date != ''", (ids,)).fetchall()]
+        if not payable:
+            return []
+        with receipts_rollup(conn, payable):
+            conn.execute(
+                "UPDATE receipts SET withdrawn = 1, withdrawn_at = ? "
+                "WHERE id IN (SELECT value FROM json_each(?))",
+                (now, json.dumps(payable)),
+            )
+        return payable
+
+    return run_write(_write)
 
 
 def update_receipt_lines(edited_lines, rounding, receipt_id):
     """
-    Save edited receipt lines and recalculated subtotal.
+    Save edited receipt lines; the subtotal is recomputed from receipt_lines
+    in the same transaction and daily_rollups is adjusted by the difference.
     *edited_lines*: list of (line_id, gross, tare, net, total).
     """
-    with get_connection() as conn:
-        cur = conn.cursor()
-        new_subtotal = 0.0
-        for (line_id, g, t, n, tot) in edited_lines:
-            cur.execute(
-                "UPDATE receipt_lines SET gross=?, tare=?, net=?, total=? WHERE id=?",
-                (g, t, n, tot, line_id),
+    def _write(conn):
+        with receipt_rollup_delta(conn, receipt_id):
+            conn.executemany(
+                "UPDATE receipt_lines SET gross=?, tare=?, net=?, total=? "
+                "WHERE id=? AND receipt_id=?",
+                [(g, t, n, tot, line_id, receipt_id) for (line_id, g, t, n, tot) in edited_lines],
             )
-            new_subtotal += tot
-        cur.execute(
-            "UPDATE receipts SET subtotal=?, rounding_amount=? WHERE id=?",
-            (new_subtotal, rounding, receipt_id),
-        )
+            conn.execute("""
+                UPDATE receipts SET rounding_amount=?,
+                    subtotal=(SELECT COALESCE(SUM(total), 0) FROM receipt_lines
+                              WHERE receipt_id=?)
+                WHERE id=?
+            """, (rounding, receipt_id, receipt_id))
+
+    run_write(_write)
 
 
 # ---------------------------------------------------------------------------
@@ -330,14 +517,14 @@ def get_receipt_detail_inquiry_df(from_str, to_str):
     return qdf("""
         SELECT
             r.id                                           AS "Ticket Id",
-            substr(r.issue_time, 1, 10)                    AS "Date Created",
+            r.issue_date                                   AS "Date Created",
             substr(r.issue_time, 12)                       AS "Time",
             CASE WHEN r.voided=1 THEN 'VOIDED' ELSE 'OPEN' END AS "Status",
             r.issued_by                                    AS "User",
             r.client_name                                  AS "Seller",
             r.rounding_amount                              AS "Total Amount"
         FROM receipts r
-        WHERE substr(r.issue_time, 1, 10) >= ? AND substr(r.issue_time, 1, 10) <= ?
+        WHERE r.issue_date BETWEEN ? AND ?
             AND r.voided = 0
         ORDER BY r.id DESC
         LIMIT 500
@@ -347,7 +534,7 @@ def get_receipt_detail_inquiry_df(from_str, to_str):
 def get_ticket_report_rows(from_str, to_str):
     return qdf("""
         SELECT r.* FROM receipts r
-        WHERE substr(r.issue_time,1,10) >= ? AND substr(r.issue_time,1,10) <= ?
+        WHERE r.issue_date BETWEEN ? AND ?
           AND r.voided=0
         ORDER BY r.id
     """, (from_str, to_str)).to_dict("records")
@@ -0,0 +1,149 @@
+"""
+Daily report rollups — receipts pre-aggregated per
+(day, ticketing_method, voided, withdrawn) in daily_rollups.
+
+The ticket write paths in repo_ticketing keep the table in step inside
+the same writer transaction: take the receipt out of its bucket before the
+change, put it back afterwards (see receipt_rollup()); line edits, which
+keep the receipt in its bucket, add the difference (receipt_rollup_delta()).
+Draft receipts (no issue_date yet) are not counted.
+
+Rebuild from scratch:  python -m db.rollups
+"""
+
+import json
+from contextlib import contextmanager
+
+from db.connection import run_write
+
+
+def _contribution(conn, receipt_id):
+    """(day, method, voided, withdrawn, net, subtotal, rounding) or None for drafts."""
+    row = conn.execute("""
+        SELECT r.issue_date, COALESCE(r.ticketing_method, ''),
+               COALESCE(r.voided, 0), COALESCE(r.withdrawn, 0),
+               (SELECT COALESCE(SUM(net), 0) FROM receipt_lines rl
+                WHERE rl.receipt_id = r.id),
+               COALESCE(r.subtotal, 0), COALESCE(r.rounding_amount, 0)
+        FROM receipts r WHERE r.id = ?
+    """, (receipt_id,)).fetchone()
+    if row is None or not row[0]:
+        return None
+    return tuple(row)
+
+
+def apply_receipt(conn, receipt_id, sign):
+    """Add (sign=+1) or remove (sign=-1) one receipt's contribution."""
+    _apply(conn, _contribution(conn, receipt_id), sign)
+
+
+def _apply(conn, c, sign):
+    if c is None:
+        return
+    day, method, voided, withdrawn, net, subtotal, rounding = c
+    _add_bucket(conn, (day, method, voided, withdrawn), sign,
+                sign * net, sign * subtotal, sign * rounding)
+
+
+def _add_bucket(conn, key, tickets, net, subtotal, rounding):
+    day, method, voided, withdrawn = key
+    conn.execute("""
+        INSERT INTO daily_rollups(day, method, voided, withdrawn,
+                                  tickets, net, subtotal, rounding)
+        VALUES(?,?,?,?,?,?,?,?)
+        ON CONFLICT(day, method, voided, withdrawn) DO UPDATE SET
+            tickets  = tickets  + excluded.tickets,
+            net      = net      + excluded.net,
+            subtotal = subtotal + excluded.subtotal,
+            rounding = rounding + excluded.rounding
+    """, (day, method, voided, withdrawn, tickets, net, subtotal, rounding))
+    if tickets < 0:
+        conn.execute(
+            "DELETE FROM daily_rollups WHERE day=? AND method=? AND voided=? "
+            "AND withdrawn=? AND tickets <= 0",
+            (day, method, voided, withdrawn))
+
+
+@contextmanager
+def receipt_rollup(conn, receipt_id):
+    """Wrap a change to one receipt (or its lines) so its bucket follows it."""
+    apply_receipt(conn, receipt_id, -1)
+    yield
+    apply_receipt(conn, receipt_id, +1)
+
+
+@contextmanager
+def receipt_rollup_delta(conn, receipt_id):
+    """receipt_rollup for changes that keep the receipt in its bucket (line
+    edits): one UPDATE by the net / subtotal / rounding difference. Falls
+    back to remove + add when the bucket did change."""
+    before = _contribution(conn, receipt_id)
+    yield
+    after = _contribution(conn, receipt_id)
+    if before is None or after is None or before[:4] != after[:4]:
+        _apply(conn, before, -1)
+        _apply(conn, after, +1)
+        return
+    conn.execute("""
+        UPDATE daily_rollups SET net = net + ?, subtotal = subtotal + ?,
+                                 rounding = rounding + ?
+        WHERE day=? AND method=? AND voided=? AND withdrawn=?
+    """, (after[4] - before[4], after[5] - before[5], after[6] - before[6], *after[:4]))
+
+
+_BUCKETS_OF_SQL = """
+    SELECT r.issue_date, COALESCE(r.ticketing_method, ''),
+           COALESCE(r.voided, 0), COALESCE(r.withdrawn, 0),
+           COUNT(*), COALESCE(SUM(l.net), 0),
+           COALESCE(SUM(r.subtotal), 0), COALESCE(SUM(r.rounding_amount), 0)
+    FROM receipts r
+    LEFT JOIN (SELECT receipt_id, SUM(net) AS net FROM receipt_lines
+               WHERE receipt_id IN (SELECT value FROM json_each(?))
+               GROUP BY receipt_id) l ON l.receipt_id = r.id
+    WHERE r.id IN (SELECT value FROM json_each(?)) AND r.issue_date != ''
+    GROUP BY 1, 2, 3, 4
+"""
+
+
+@contextmanager
+def receipts_rollup(conn, receipt_ids):
+    """receipt_rollup for many receipts at once (batch status changes): one
+    grouped query before and after, one upsert per bucket touched."""
+    ids = json.dumps([int(i) for i in receipt_ids])
+    before = conn.execute(_BUCKETS_OF_SQL, (ids, ids)).fetchall()
+    yield
+    after = conn.execute(_BUCKETS_OF_SQL, (ids, ids)).fetchall()
+    for row in before:
+        _add_bucket(conn, tuple(row[:4]), -row[4], -row[5], -row[6], -row[7])
+    for row in after:
+        _add_bucket(conn, tuple(row[:4]), row[4], row[5], row[6], row[7])
+
+
+def rebuild_rollups_on(conn):
+    conn.execute("DELETE FROM daily_rollups")
+    conn.execute("""
+        INSERT INTO daily_rollups(day, method, voided, withdrawn,
+                                  tickets, net, subtotal, rounding)
+        SELECT r.issue_date, COALESCE(r.ticketing_method, ''),
+               COALESCE(r.voided, 0), COALESCE(r.withdrawn, 0),
+               COUNT(*), COALESCE(SUM(l.net), 0),
+               COALESCE(SUM(r.subtotal), 0), COALESCE(SUM(r.rounding_amount), 0)
+        FROM receipts r
+        LEFT JOIN (SELECT receipt_id, SUM(net) AS net FROM receipt_lines
+                   GROUP BY receipt_id) l ON l.receipt_id = r.id
+        WHERE r.issue_date != ''
+        GROUP BY 1, 2, 3, 4
+    """)
+    return conn.execute("SELECT COUNT(*) FROM daily_rollups").fetchone()[0]
+
+
+def rebuild_rollups() -> int:
+    """Recompute daily_rollups from receipts; returns the number of buckets."""
+    return run_write(rebuild_rollups_on)
+
+
+if __name__ == "__main__":
+    from db.schema import init_db
+
+    init_db()
+    print(f"daily_rollups rebuilt: {rebuild_rollups()} rows")
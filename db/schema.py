@@ -1,229 +1,541 @@
 """
-Database schema creation and seed data.
-Called once at app startup via init_db().
+Database schema creation and seed data — versioned migrations.
+
+The schema version lives in PRAGMA user_version. Each entry in MIGRATIONS
+is applied once, in order, inside its own transaction, and bumps
+user_version on commit. init_db() runs the pending steps once per process;
+every later call (one per Streamlit rerun) returns without touching the DB.
+
+To change the schema, append a new step — never edit an applied one.
 """
 
+import secrets
+import threading
 from datetime import datetime
 
+from core.config import DB_PATH
+from db.codes import CODE_SPACES
 from db.connection import get_connection
+from db.rollups import rebuild_rollups_on
 
 
-def init_db():
-    """Create all tables if they don't exist, seed default rows, enable WAL."""
-    with get_connection() as conn:
-        cur = conn.cursor()
-
-        # WAL mode — persistent per DB file, safe to set once
-        cur.execute("PRAGMA journal_mode=WAL")
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS clients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            code TEXT UNIQUE,
-            name TEXT,
-            phone TEXT,
-            email TEXT,
-            id_number TEXT,
-            tier_level INTEGER DEFAULT 0,
-            deleted INTEGER DEFAULT 0,
-            created_at TEXT
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS operators (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE,
-            name TEXT,
-            deleted INTEGER DEFAULT 0,
-            created_at TEXT
-        )
-        """)
+# ---------------------------------------------------------------------------
+# Migration steps — each takes a cursor inside an open transaction
+# ---------------------------------------------------------------------------
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS material_categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE,
-            sort_order INTEGER DEFAULT 0
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS materials (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            category_id INTEGER,
-            item_code TEXT,
-            name TEXT,
-            unit TEXT DEFAULT 'LB',
-            unit_price REAL DEFAULT 0,
-            min_unit_price REAL DEFAULT 0,
-            max_unit_price REAL DEFAULT 0,
-            deleted INTEGER DEFAULT 0,
-            created_at TEXT,
-            FOREIGN KEY(category_id) REFERENCES material_categories(id)
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS receipts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            issue_time TEXT,
-            issued_by TEXT,
-            ticketing_method TEXT DEFAULT 'Print',
-            withdraw_code TEXT,
-            client_code TEXT,
-            client_name TEXT,
-            subtotal REAL DEFAULT 0,
-            rounding_amount REAL DEFAULT 0,
-            voided INTEGER DEFAULT 0,
-            withdrawn INTEGER DEFAULT 0
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS receipt_lines (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            receipt_id INTEGER,
-            material_name TEXT,
-            unit_price REAL,
-            gross REAL,
-            tare REAL,
-            net REAL,
-            total REAL,
-            FOREIGN KEY(receipt_id) REFERENCES receipts(id)
-        )
-        """)
+def _m001_baseline_tables(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS clients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code TEXT UNIQUE,
+        name TEXT,
+        phone TEXT,
+        email TEXT,
+        id_number TEXT,
+        deleted INTEGER DEFAULT 0,
+        created_at TEXT
+    )
+    """)
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-        """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS operators (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE,
+        name TEXT,
+        deleted INTEGER DEFAULT 0,
+        created_at TEXT
+    )
+    """)
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS print_previews (
-            token TEXT PRIMARY KEY,
-            html TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS material_categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE,
+        sort_order INTEGER DEFAULT 0
+    )
+    """)
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS receipt_print (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            html TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
-
-        # 每个 line item 两张照片（cam1 + cam2），存路径便于管理端读取（旧）
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS receipt_line_photos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            receipt_id INTEGER NOT NULL,
-            line_id INTEGER NOT NULL,
-            cam_index INTEGER NOT NULL,
-            photo_path TEXT NOT NULL,
-            created_at TEXT DEFAULT (datetime('now','localtime')),
-            FOREIGN KEY (receipt_id) REFERENCES receipts(id),
-            FOREIGN KEY (line_id) REFERENCES receipt_lines(id)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS materials (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category_id INTEGER,
+        item_code TEXT,
+        name TEXT,
+        unit TEXT DEFAULT 'LB',
+        unit_price REAL DEFAULT 0,
+        min_unit_price REAL DEFAULT 0,
+        max_unit_price REAL DEFAULT 0,
+        deleted INTEGER DEFAULT 0,
+        created_at TEXT,
+        FOREIGN KEY(category_id) REFERENCES material_categories(id)
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS receipts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        issue_time TEXT,
+        issued_by TEXT,
+        ticketing_method TEXT DEFAULT 'Print',
+        withdraw_code TEXT,
+        client_code TEXT,
+        client_name TEXT,
+        subtotal REAL DEFAULT 0,
+        rounding_amount REAL DEFAULT 0,
+        voided INTEGER DEFAULT 0,
+        withdrawn INTEGER DEFAULT 0
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS receipt_lines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        receipt_id INTEGER,
+        material_name TEXT,
+        unit_price REAL,
+        gross REAL,
+        tare REAL,
+        net REAL,
+        total REAL,
+        FOREIGN KEY(receipt_id) REFERENCES receipts(id)
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS print_previews (
+        token TEXT PRIMARY KEY,
+        html TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS receipt_print (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        html TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """)
+
+    # 每个 line item 两张照片（cam1 + cam2），存路径便于管理端读取（旧）
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS receipt_line_photos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        receipt_id INTEGER NOT NULL,
+        line_id INTEGER NOT NULL,
+        cam_index INTEGER NOT NULL,
+        photo_path TEXT NOT NULL,
+        created_at TEXT DEFAULT (datetime('now','localtime')),
+        FOREIGN KEY (receipt_id) REFERENCES receipts(id),
+        FOREIGN KEY (line_id) REFERENCES receipt_lines(id)
+    )
+    """)
+
+    # MVP 测试阶段：照片存 BLOB，管理端只从 DB 读（ticket_item_id = receipt_lines.id）
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ticket_item_photos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ticket_item_id INTEGER NOT NULL,
+        cam_index INTEGER NOT NULL,
+        image_bytes BLOB NOT NULL,
+        mime TEXT DEFAULT 'image/jpeg',
+        created_at TEXT DEFAULT (datetime('now','localtime')),
+        FOREIGN KEY (ticket_item_id) REFERENCES receipt_lines(id)
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS material_tier_prices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        material_id INTEGER NOT NULL,
+        tier_level INTEGER NOT NULL CHECK(tier_level BETWEEN 1 AND 5),
+        pct_adjustment REAL DEFAULT 0,
+        UNIQUE(material_id, tier_level),
+        FOREIGN KEY(material_id) REFERENCES materials(id)
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS client_material_prices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_id INTEGER NOT NULL,
+        material_id INTEGER NOT NULL,
+        adjust_type TEXT NOT NULL DEFAULT 'pct',
+        adjust_value REAL NOT NULL DEFAULT 0,
+        created_at TEXT DEFAULT (datetime('now','localtime')),
+        UNIQUE(client_id, material_id),
+        FOREIGN KEY(client_id) REFERENCES clients(id),
+        FOREIGN KEY(material_id) REFERENCES materials(id)
+    )
+    """)
+
+
+def _m002_clients_tier_level(cur):
+    # Databases created before tier pricing may already have the column
+    # (added by the old ad-hoc ALTER in init_db) — only add it when missing.
+    _add_column_if_missing(cur, "clients", "tier_level", "INTEGER DEFAULT 0")
+
+
+def _m003_seed_defaults(cur):
+    cur.execute("SELECT COUNT(*) FROM operators")
+    if cur.fetchone()[0] == 0:
+        cur.execute(
+            "INSERT INTO operators(email,name,created_at) VALUES(?,?,?)",
+            ("admin@youli-trade.com", "Andy Chen",
+             datetime.now().isoformat(timespec="seconds")),
         )
-        """)
-
-        # MVP 测试阶段：照片存 BLOB，管理端只从 DB 读（ticket_item_id = receipt_lines.id）
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS ticket_item_photos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ticket_item_id INTEGER NOT NULL,
-            cam_index INTEGER NOT NULL,
-            image_bytes BLOB NOT NULL,
-            mime TEXT DEFAULT 'image/jpeg',
-            created_at TEXT DEFAULT (datetime('now','localtime')),
-            FOREIGN KEY (ticket_item_id) REFERENCES receipt_lines(id)
+
+    cur.execute("SELECT COUNT(*) FROM material_categories")
+    if cur.fetchone()[0] == 0:
+        cats = [("Copper", 1), ("Alum", 2), ("Wire", 3),
+                ("Others", 4), ("Metal", 5)]
+        cur.executemany(
+            "INSERT INTO material_categories(name, sort_order) VALUES(?,?)", cats)
+
+    cur.execute("SELECT COUNT(*) FROM materials")
+    if cur.fetchone()[0] == 0:
+        cur.execute("SELECT id,name FROM material_categories")
+        cmap = {r[1]: r[0] for r in cur.fetchall()}
+        now = datetime.now().isoformat(timespec="seconds")
+        seed = [
+            (cmap["Copper"], "1001", "Bare Bright 光亮铜", "LB", 4.70, 2.70, 5.00),
+            (cmap["Copper"], "1002", "Cu#1 一号铜", "LB", 4.45, 2.50, 4.60),
+            (cmap["Copper"], "1003", "Cu#2 二号铜", "LB", 4.00, 2.20, 4.30),
+            (cmap["Wire"],   "2001", "Romex 电线", "LB", 2.50, 1.50, 3.50),
+            (cmap["Metal"],  "3001", "H/G 高铁", "LB", 0.18, 0.10, 0.30),
+            (cmap["Alum"],   "4001", "Alum Clean 干净铝", "LB", 0.75, 0.40, 1.20),
+            (cmap["Others"], "5001", "E-Motor 马达", "LB", 0.20, 0.10, 0.40),
+        ]
+        cur.executemany("""
+            INSERT INTO materials(category_id,item_code,name,unit,unit_price,
+                                  min_unit_price,max_unit_price,created_at)
+            VALUES(?,?,?,?,?,?,?,?)
+        """, [(a, b, c, d, e, f, g, now) for (a, b, c, d, e, f, g) in seed])
+
+    cur.execute("SELECT COUNT(*) FROM clients")
+    if cur.fetchone()[0] == 0:
+        cur.execute(
+            "INSERT INTO clients(code,name,phone,created_at) VALUES(?,?,?,?)",
+            ("000001", "Walk-in", "",
+             datetime.now().isoformat(timespec="seconds")),
         )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS material_tier_prices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            material_id INTEGER NOT NULL,
-            tier_level INTEGER NOT NULL CHECK(tier_level BETWEEN 1 AND 5),
-            pct_adjustment REAL DEFAULT 0,
-            UNIQUE(material_id, tier_level),
-            FOREIGN KEY(material_id) REFERENCES materials(id)
+
+    cur.execute("SELECT COUNT(*) FROM settings")
+    if cur.fetchone()[0] == 0:
+        cur.execute(
+            "INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)",
+            ("unit_price_adjustment_permitted", "Yes"),
         )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS client_material_prices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            client_id INTEGER NOT NULL,
-            material_id INTEGER NOT NULL,
-            adjust_type TEXT NOT NULL DEFAULT 'pct',
-            adjust_value REAL NOT NULL DEFAULT 0,
-            created_at TEXT DEFAULT (datetime('now','localtime')),
-            UNIQUE(client_id, material_id),
-            FOREIGN KEY(client_id) REFERENCES clients(id),
-            FOREIGN KEY(material_id) REFERENCES materials(id)
+
+
+def _m004_secondary_indexes(cur):
+    # Foreign-key lookups: lines by receipt, photos by line
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipt_lines_receipt "
+                "ON receipt_lines(receipt_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ticket_item_photos_item "
+                "ON ticket_item_photos(ticket_item_id, cam_index)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipt_line_photos_receipt "
+                "ON receipt_line_photos(receipt_id, line_id, cam_index)")
+    # Reports: open tickets by time; void list is small, keep it separate
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipts_open_issue_time "
+                "ON receipts(issue_time) WHERE voided=0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipts_voided "
+                "ON receipts(id) WHERE voided=1")
+    # Active (deleted=0) catalog / client lists
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_materials_active_category "
+                "ON materials(category_id, item_code) WHERE deleted=0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_clients_active "
+                "ON clients(id) WHERE deleted=0")
+
+
+def _m005_receipt_issue_keys(cur):
+    # Normalized date keys, written alongside issue_time by repo_ticketing,
+    # so report filters / GROUP BY become index range scans instead of substr().
+    _add_column_if_missing(cur, "receipts", "issue_date", "TEXT DEFAULT ''")
+    _add_column_if_missing(cur, "receipts", "issue_month", "TEXT DEFAULT ''")
+    _add_column_if_missing(cur, "receipts", "issue_year", "TEXT DEFAULT ''")
+    cur.execute("""
+        UPDATE receipts SET
+            issue_date  = substr(COALESCE(issue_time, ''), 1, 10),
+            issue_month = substr(COALESCE(issue_time, ''), 1, 7),
+            issue_year  = substr(COALESCE(issue_time, ''), 1, 4)
+    """)
+    cur.execute("DROP INDEX IF EXISTS idx_receipts_open_issue_time")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipts_issue_date "
+                "ON receipts(issue_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipts_open_date "
+                "ON receipts(issue_date) WHERE voided=0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipts_open_month "
+                "ON receipts(issue_month) WHERE voided=0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipts_open_year "
+                "ON receipts(issue_year) WHERE voided=0")
+
+
+def _m006_daily_rollups(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS daily_rollups (
+        day TEXT NOT NULL,
+        method TEXT NOT NULL DEFAULT '',
+        voided INTEGER NOT NULL DEFAULT 0,
+        withdrawn INTEGER NOT NULL DEFAULT 0,
+        tickets INTEGER NOT NULL DEFAULT 0,
+        net REAL NOT NULL DEFAULT 0,
+        subtotal REAL NOT NULL DEFAULT 0,
+        rounding REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, method, voided, withdrawn)
+    ) WITHOUT ROWID
+    """)
+    rebuild_rollups_on(cur)
+
+
+def _m007_photo_store_refs(cur):
+    # New photos go to db/photo_store.py; rows keep only hash/size/mime.
+    # Legacy rows keep image_bytes until `python -m db.photo_store migrate`.
+    _add_column_if_missing(cur, "ticket_item_photos", "sha256", "TEXT")
+    _add_column_if_missing(cur, "ticket_item_photos", "size", "INTEGER")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ticket_item_photos_legacy "
+                "ON ticket_item_photos(id) WHERE sha256 IS NULL")
+
+
+def _m008_photo_thumbnails(cur):
+    _add_column_if_missing(cur, "ticket_item_photos", "thumb_sha256", "TEXT")
+    _add_column_if_missing(cur, "ticket_item_photos", "thumb_size", "INTEGER")
+
+
+def _m009_cascade_deletes(cur):
+    # Deleting a receipt removes its lines, deleting a line removes its photos,
+    # so the delete APIs are single statements. SQLite cannot alter a foreign
+    # key: rebuild the child tables (runs with foreign_keys=OFF, see below).
+    _rebuild_table(cur, "ticket_item_photos", """
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ticket_item_id INTEGER NOT NULL,
+        cam_index INTEGER NOT NULL,
+        image_bytes BLOB NOT NULL,
+        mime TEXT DEFAULT 'image/jpeg',
+        created_at TEXT DEFAULT (datetime('now','localtime')),
+        sha256 TEXT,
+        size INTEGER,
+        thumb_sha256 TEXT,
+        thumb_size INTEGER,
+        FOREIGN KEY (ticket_item_id) REFERENCES receipt_lines(id) ON DELETE CASCADE
+    )
+    """)
+    _rebuild_table(cur, "receipt_line_photos", """
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        receipt_id INTEGER NOT NULL,
+        line_id INTEGER NOT NULL,
+        cam_index INTEGER NOT NULL,
+        photo_path TEXT NOT NULL,
+        created_at TEXT DEFAULT (datetime('now','localtime')),
+        FOREIGN KEY (receipt_id) REFERENCES receipts(id) ON DELETE CASCADE,
+        FOREIGN KEY (line_id) REFERENCES receipt_lines(id) ON DELETE CASCADE
+    )
+    """)
+    _rebuild_table(cur, "receipt_lines", """
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        receipt_id INTEGER,
+        material_name TEXT,
+        unit_price REAL,
+        gross REAL,
+        tare REAL,
+        net REAL,
+        total REAL,
+        FOREIGN KEY(receipt_id) REFERENCES receipts(id) ON DELETE CASCADE
+    )
+    """)
+    # Indexes went with the old tables; line_id is new — the cascade from
+    # receipt_lines looks receipt_line_photos up by it
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipt_lines_receipt "
+                "ON receipt_lines(receipt_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ticket_item_photos_item "
+                "ON ticket_item_photos(ticket_item_id, cam_index)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ticket_item_photos_legacy "
+                "ON ticket_item_photos(id) WHERE sha256 IS NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipt_line_photos_receipt "
+                "ON receipt_line_photos(receipt_id, line_id, cam_index)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipt_line_photos_line "
+                "ON receipt_line_photos(line_id)")
+
+
+_m009_cascade_deletes.foreign_keys_off = True
+
+
+def _m010_code_sequences(cur):
+    # Client / withdraw code allocation (db/codes.py): a counter per kind of
+    # code, mapped through a permutation keyed by the row's random secret.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS code_sequences (
+        name TEXT PRIMARY KEY,
+        next_n INTEGER NOT NULL DEFAULT 0,
+        modulus INTEGER NOT NULL,
+        secret TEXT,
+        base INTEGER NOT NULL DEFAULT 0,
+        width INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """)
+    for name, (modulus, base, width) in CODE_SPACES.items():
+        cur.execute(
+            "INSERT OR IGNORE INTO code_sequences(name, modulus, secret, base, width) "
+            "VALUES(?,?,?,?,?)",
+            (name, modulus, secrets.token_hex(32), base, width),
         )
-        """)
-
-        # Migrate: add tier_level to clients if missing
-        cur.execute("PRAGMA table_info(clients)")
-        col_names = [r[1] for r in cur.fetchall()]
-        if "tier_level" not in col_names:
-            cur.execute("ALTER TABLE clients ADD COLUMN tier_level INTEGER DEFAULT 0")
-
-        # ------------------------------------------------------------------
-        # Seed defaults (idempotent)
-        # ------------------------------------------------------------------
-        cur.execute("SELECT COUNT(*) c FROM operators")
-        if cur.fetchone()["c"] == 0:
-            cur.execute(
-                "INSERT INTO operators(email,name,created_at) VALUES(?,?,?)",
-                ("admin@youli-trade.com", "Andy Chen",
-                 datetime.now().isoformat(timespec="seconds")),
-            )
-
-        cur.execute("SELECT COUNT(*) c FROM material_categories")
-        if cur.fetchone()["c"] == 0:
-            cats = [("Copper", 1), ("Alum", 2), ("Wire", 3),
-                    ("Others", 4), ("Metal", 5)]
-            cur.executemany(
-                "INSERT INTO material_categories(name, sort_order) VALUES(?,?)", cats)
-
-        cur.execute("SELECT COUNT(*) c FROM materials")
-        if cur.fetchone()["c"] == 0:
-            cur.execute("SELECT id,name FROM material_categories")
-            cmap = {r["name"]: r["id"] for r in cur.fetchall()}
-            now = datetime.now().isoformat(timespec="seconds")
-            seed = [
-                (cmap["Copper"], "1001", "Bare Bright 光亮铜", "LB", 4.70, 2.70, 5.00),
-                (cmap["Copper"], "1002", "Cu#1 一号铜", "LB", 4.45, 2.50, 4.60),
-                (cmap["Copper"], "1003", "Cu#2 二号铜", "LB", 4.00, 2.20, 4.30),
-                (cmap["Wire"],   "2001", "Romex 电线", "LB", 2.50, 1.50, 3.50),
-                (cmap["Metal"],  "3001", "H/G 高铁", "LB", 0.18, 0.10, 0.30),
-                (cmap["Alum"],   "4001", "Alum Clean 干净铝", "LB", 0.75, 0.40, 1.20),
-                (cmap["Others"], "5001", "E-Motor 马达", "LB", 0.20, 0.10, 0.40),
-            ]
-            cur.executemany("""
-                INSERT INTO materials(category_id,item_code,name,unit,unit_price,
-                                      min_unit_price,max_unit_price,created_at)
-                VALUES(?,?,?,?,?,?,?,?)
-            """, [(a, b, c, d, e, f, g, now) for (a, b, c, d, e, f, g) in seed])
-
-        cur.execute("SELECT COUNT(*) c FROM clients")
-        if cur.fetchone()["c"] == 0:
-            cur.execute(
-                "INSERT INTO clients(code,name,phone,created_at) VALUES(?,?,?,?)",
-                ("000001", "Walk-in", "",
-                 datetime.now().isoformat(timespec="seconds")),
-            )
-
-        cur.execute("SELECT COUNT(*) c FROM settings")
-        if cur.fetchone()["c"] == 0:
-            cur.execute(
-                "INSERT OR REPLACE INTO settings(key,value) VALUES(?,?)",
-                ("unit_price_adjustment_permitted", "Yes"),
-            )
+
+
+def _m011_payout(cur):
+    # Payout station: look tickets up by withdraw code, record when paid
+    _add_column_if_missing(cur, "receipts", "withdrawn_at", "TEXT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_receipts_withdraw_code "
+                "ON receipts(withdraw_code)")
+
+
+def _m012_drop_month_year_indexes(cur):
+    # Month / year summaries read daily_rollups; these only slowed every write
+    cur.execute("DROP INDEX IF EXISTS idx_receipts_open_month")
+    cur.execute("DROP INDEX IF EXISTS idx_receipts_open_year")
+
+
+def _m013_catalog_changes(cur):
+    # Catalog version shared by every process: one row per catalog write
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_changes (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT,
+        key,
+        changed_at TEXT
+    )
+    """)
+
+
+def _m014_code_secrets(cur):
+    # Tables made by the first m010 (multiplier/shift mapping) get their secret
+    _add_column_if_missing(cur, "code_sequences", "secret", "TEXT")
+    for (name,) in cur.execute(
+            "SELECT name FROM code_sequences WHERE secret IS NULL").fetchall():
+        cur.execute("UPDATE code_sequences SET secret=? WHERE name=?",
+                    (secrets.token_hex(32), name))
+
+
+def _m015_drop_code_mult_shift(cur):
+    # Left over from the first m010; nothing reads them since m014
+    cols = {r[1] for r in cur.execute("PRAGMA table_info(code_sequences)").fetchall()}
+    for column in ("mult", "shift"):
+        if column in cols:
+            cur.execute(f"ALTER TABLE code_sequences DROP COLUMN {column}")
+
+
+def _rebuild_table(cur, table, create_sql):
+    """Recreate *table* from *create_sql* ("CREATE TABLE {table} ..."), keeping
+    its rows and its AUTOINCREMENT counter. Indexes must be recreated."""
+    new = f"_new_{table}"
+    cur.execute(create_sql.format(table=new))
+    old_cols = {r[1] for r in cur.execute(f"PRAGMA table_info({table})").fetchall()}
+    cols = ", ".join(r[1] for r in cur.execute(f"PRAGMA table_info({new})").fetchall()
+                     if r[1] in old_cols)
+    cur.execute(f"INSERT INTO {new}({cols}) SELECT {cols} FROM {table}")
+    row = cur.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+    cur.execute(f"DROP TABLE {table}")
+    cur.execute(f"ALTER TABLE {new} RENAME TO {table}")
+    if row is not None:
+        cur.execute("UPDATE sqlite_sequence SET seq=MAX(seq, ?) WHERE name=?", (row[0], table))
+
+
+def _add_column_if_missing(cur, table, column, decl):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [r[1] for r in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# (version, description, step) — append only, versions strictly increasing.
+MIGRATIONS = [
+    (1, "baseline tables", _m001_baseline_tables),
+    (2, "clients.tier_level", _m002_clients_tier_level),
+    (3, "seed default operator/categories/materials/client/settings", _m003_seed_defaults),
+    (4, "secondary + partial indexes", _m004_secondary_indexes),
+    (5, "receipts.issue_date/month/year + indexes", _m005_receipt_issue_keys),
+    (6, "daily_rollups", _m006_daily_rollups),
+    (7, "ticket_item_photos.sha256/size (photo store)", _m007_photo_store_refs),
+    (8, "ticket_item_photos thumbnails", _m008_photo_thumbnails),
+    (9, "ON DELETE CASCADE for receipt lines and photos", _m009_cascade_deletes),
+    (10, "code_sequences (client / withdraw code allocator)", _m010_code_sequences),
+    (11, "receipts.withdrawn_at + withdraw_code index (payout)", _m011_payout),
+    (12, "drop unused receipts month/year indexes", _m012_drop_month_year_indexes),
+    (13, "catalog_changes (DB-side catalog version)", _m013_catalog_changes),
+    (14, "code_sequences.secret (keyed code permutation)", _m014_code_secrets),
+    (15, "drop code_sequences.mult/shift", _m015_drop_code_mult_shift),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def get_schema_version(conn) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def apply_migrations(conn, target=SCHEMA_VERSION):
+    """
+    Apply every migration newer than the DB's user_version (up to *target*)
+    on *conn*, one transaction per step. Returns the list of applied versions.
+    Steps marked foreign_keys_off (table rebuilds) run with foreign key
+    enforcement switched off, as SQLite requires; it is restored afterwards.
+    """
+    applied = []
+    current = get_schema_version(conn)
+    for version, _desc, step in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        fk_off = getattr(step, "foreign_keys_off", False)
+        if fk_off:
+            fk_was = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+            conn.execute("PRAGMA foreign_keys=OFF")  # no-op inside a transaction
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            step(conn.cursor())
+            conn.execute(f"PRAGMA user_version={int(version)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            if fk_off:
+                conn.execute(f"PRAGMA foreign_keys={int(fk_was)}")
+        applied.append(version)
+    return applied
+
+
+_migrated_paths = set()
+_init_lock = threading.Lock()
+
+
+def init_db(force: bool = False):
+    """
+    Bring the DB at DB_PATH up to SCHEMA_VERSION and enable WAL.
+    Does real work only the first time per process (or with *force*).
+    """
+    if DB_PATH in _migrated_paths and not force:
+        return []
+    with _init_lock:
+        if DB_PATH in _migrated_paths and not force:
+            return []
+        with get_connection() as conn:
+            # WAL mode — persistent per DB file, safe to set once
+            conn.execute("PRAGMA journal_mode=WAL")
+            if get_schema_version(conn) >= SCHEMA_VERSION:
+                applied = []
+            else:
+                applied = apply_migrations(conn)
+        _migrated_paths.add(DB_PATH)
+        return applied
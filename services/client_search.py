@@ -0,0 +1,154 @@
+"""
+Client search index for the Receiving Area.
+
+In-memory index over "code name phone" of every active client:
+  - trigram postings for substring search (terms of 3+ characters),
+  - a sorted token list for prefix search (1–2 character terms).
+search() returns only the top-K matches, ranked
+    exact code / phone  →  token prefix  →  substring elsewhere,
+newest client first within a rank.
+
+The index is built from the catalog snapshot and follows it, so clients
+written by other processes show up as soon as the snapshot reloads:
+save_customer / update_client / delete_client log the client id with the
+catalog version and only that client's entry is re-read and re-indexed; an
+age-based snapshot reload rebuilds the index from the new snapshot.
+"""
+
+import heapq
+import threading
+from bisect import bisect_left, insort
+
+from core.config import CLIENT_SEARCH_TOP_K
+from db.catalog import catalog_changes_since, get_catalog
+from db.repo_customers import get_client_by_id
+
+_lock = threading.Lock()
+_index = None
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ClientSearchIndex:
+    def __init__(self, version, clients):
+        self.version = version
+        self.catalog = None     # snapshot the index was last synced with
+        self._entries = {}      # id -> (code, name, phone, haystack)
+        self._tri = {}          # trigram -> {id}
+        self._tokens = []       # sorted [(token, id)]
+        self._exact = {}        # lowercased code / phone -> {id}
+        for cid, code, name, phone in zip(
+                clients["id"], clients["code"], clients["name"], clients["phone"]):
+            self._add(int(cid), code, name, phone, bulk=True)
+        self._tokens.sort()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, cid, code, name, phone, bulk=False):
+        code, name, phone = code or "", name or "", phone or ""
+        hay = f"{code} {name} {phone}".lower()
+        self._entries[cid] = (code, name, phone, hay)
+        for key in {code.lower(), phone.lower()} - {""}:
+            self._exact.setdefault(key, set()).add(cid)
+        for g in _trigrams(hay):
+            self._tri.setdefault(g, set()).add(cid)
+        for tok in set(hay.split()):
+            if bulk:
+                self._tokens.append((tok, cid))
+            else:
+                insort(self._tokens, (tok, cid))
+
+    def _remove(self, cid):
+        entry = self._entries.pop(cid, None)
+        if entry is None:
+            return
+        code, _name, phone, hay = entry
+        for key in {code.lower(), phone.lower()} - {""}:
+            ids = self._exact.get(key)
+            if ids is not None:
+                ids.discard(cid)
+                if not ids:
+                    del self._exact[key]
+        for g in _trigrams(hay):
+            ids = self._tri.get(g)
+            if ids is not None:
+                ids.discard(cid)
+                if not ids:
+                    del self._tri[g]
+        for tok in set(hay.split()):
+            i = bisect_left(self._tokens, (tok, cid))
+            if i < len(self._tokens) and self._tokens[i] == (tok, cid):
+                del self._tokens[i]
+
+    def refresh(self, cid):
+        """Re-read one client after a write (gone if deleted)."""
+        self._remove(cid)
+        row = get_client_by_id(cid)
+        if row is not None and not row["deleted"]:
+            self._add(cid, row["code"], row["name"], row["phone"])
+
+    def _prefix_ids(self, term):
+        lo = bisect_left(self._tokens, (term,))
+        hi = bisect_left(self._tokens, (term + "\U0010ffff",), lo)
+        return {cid for _tok, cid in self._tokens[lo:hi]}
+
+    def search(self, term, k=CLIENT_SEARCH_TOP_K):
+        """Top-*k* [(code, name, phone)] for *term*; newest clients when empty."""
+        term = (term or "").strip().lower()
+        if not term:
+            return [self._entries[cid][:3] for cid in heapq.nlargest(k, self._entries)]
+        ids, seen = [], set()
+
+        def take(cands):
+            for cid in heapq.nlargest(k - len(ids), cands - seen):
+                ids.append(cid)
+                seen.add(cid)
+
+        # Rank 0: exact code / phone; rank 1: token prefix; rank 2: substring.
+        # Lower ranks are only computed while fewer than k results are found.
+        take(self._exact.get(term, set()))
+        if len(ids) < k:
+            take(self._prefix_ids(term))
+        if len(ids) < k and len(term) >= 3:
+            postings = sorted((self._tri.get(g, set()) for g in _trigrams(term)), key=len)
+            cands = set(postings[0]).intersection(*postings[1:]) - seen
+            take({c for c in cands if term in self._entries[c][3]})
+        return [self._entries[cid][:3] for cid in ids]
+
+
+def _apply(index, changes) -> bool:
+    for table, key in changes:
+        if table == "clients":
+            if key is None:
+                return False
+            index.refresh(int(key))
+        elif table is None:
+            return False
+    return True
+
+
+def get_client_index() -> ClientSearchIndex:
+    global _index
+    snap = get_catalog()
+    index = _index
+    if index is not None and index.catalog is snap:
+        return index
+    with _lock:
+        index = _index
+        if index is None or index.catalog is not snap:
+            # Same version, new snapshot: age-based reload, rebuild from it
+            changes = (catalog_changes_since(index.version)
+                       if index is not None and index.version != snap.version else None)
+            if changes is None or not _apply(index, changes):
+                index = _index = ClientSearchIndex(snap.version, snap.clients)
+            index.version, index.catalog = snap.version, snap
+        return index
+
+
+def search_clients(term, k=CLIENT_SEARCH_TOP_K):
+    index = get_client_index()
+    with _lock:  # refresh() from another session mutates in place
+        return index.search(term, k)
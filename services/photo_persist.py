@@ -0,0 +1,214 @@
+"""
+Photo persistence worker — Confirm Line does not wait on photo writes.
+
+submit_line_photos() spools the photo bytes to PHOTO_SPOOL_DIR (one
+directory per job, files fsynced, then renamed into place — the rename is
+the commit point) and returns. A single daemon thread stores each job
+through repo_ticketing.insert_line_photos, which verifies the rows it
+wrote; a failed attempt is retried with backoff, PHOTO_PERSIST_ATTEMPTS
+times in all.
+
+Every job ends in one final state, shown by photo_status():
+    saved    photos attached and verified; spool entry removed
+    dropped  the line was deleted before its photos were written
+    failed   every attempt failed; spool entry moved to failed/ for
+             manual recovery
+Jobs still in the spool when the process stops (crash, restart) are queued
+again by start_photo_worker() on the next start.
+"""
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from core.config import PHOTO_PERSIST_ATTEMPTS, PHOTO_SPOOL_DIR
+from db.repo_ticketing import get_photo_verification_for_line, insert_line_photos
+
+QUEUED, SAVING, SAVED, DROPPED, FAILED = "queued", "saving", "saved", "dropped", "failed"
+FINAL_STATES = (SAVED, DROPPED, FAILED)
+
+_STATUS_KEEP = 500       # line statuses kept in memory, oldest dropped first
+_RETRY_BASE_S = 0.5      # backoff before attempt 2; doubles each time
+
+_start_lock = threading.Lock()
+_cond = threading.Condition()   # guards _status; notified on every change
+_status = OrderedDict()         # line_id -> {"state", "attempts", "ts", ...}
+_queue = queue.Queue()
+_thread = None
+
+
+def _set_status(line_id, state, **info):
+    with _cond:
+        entry = _status.pop(line_id, None) or {"attempts": 0}
+        entry.update(info, state=state, ts=time.time())
+        _status[line_id] = entry
+        while len(_status) > _STATUS_KEEP:
+            _status.popitem(last=False)
+        _cond.notify_all()
+
+
+# ---- spool ---------------------------------------------------------------
+
+def _spool(line_id, photos) -> str:
+    os.makedirs(PHOTO_SPOOL_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=PHOTO_SPOOL_DIR, prefix=".tmp-")
+    try:
+        for cam_idx, data in photos:
+            with open(os.path.join(tmp, f"cam{int(cam_idx)}"), "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        path = os.path.join(PHOTO_SPOOL_DIR, f"{int(line_id)}-{uuid.uuid4().hex}")
+        os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return path
+
+
+def _read_spool(path):
+    photos = []
+    for name in sorted(os.listdir(path)):
+        if name.startswith("cam"):
+            with open(os.path.join(path, name), "rb") as f:
+                photos.append((int(name[3:]), f.read()))
+    return photos
+
+
+def _move_to_failed(path):
+    failed_dir = os.path.join(PHOTO_SPOOL_DIR, "failed")
+    os.makedirs(failed_dir, exist_ok=True)
+    try:
+        os.replace(path, os.path.join(failed_dir, os.path.basename(path)))
+    except OSError as e:
+        print(f"[photo_persist] could not move {path} to failed/: {e}")
+
+
+def _recover() -> int:
+    """Queue jobs left in the spool by an earlier process; remove half-written ones."""
+    if not os.path.isdir(PHOTO_SPOOL_DIR):
+        return 0
+    queued = 0
+    for name in sorted(os.listdir(PHOTO_SPOOL_DIR)):
+        path = os.path.join(PHOTO_SPOOL_DIR, name)
+        if name.startswith(".tmp-"):
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        line_id, sep, _ = name.partition("-")
+        if not sep or not line_id.isdigit():
+            continue  # failed/
+        _set_status(int(line_id), QUEUED, recovered=True)
+        _queue.put((int(line_id), path))
+        queued += 1
+    return queued
+
+
+# ---- worker --------------------------------------------------------------
+
+def _persist(line_id, path):
+    if not os.path.isdir(path):
+        return  # already handled (queued twice)
+    photos = _read_spool(path)
+    error = None
+    for attempt in range(1, PHOTO_PERSIST_ATTEMPTS + 1):
+        _set_status(line_id, SAVING, attempts=attempt)
+        try:
+            ver = get_photo_verification_for_line(line_id)
+            if not ver["photo_count"]:
+                # else: committed by an earlier process that stopped before
+                # removing the spool entry
+                ver = insert_line_photos(line_id, photos)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"[photo_persist] line_id={line_id} attempt {attempt} failed: {error}")
+            if attempt < PHOTO_PERSIST_ATTEMPTS:
+                time.sleep(_RETRY_BASE_S * 2 ** (attempt - 1))
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        if ver is None:
+            _set_status(line_id, DROPPED)
+        else:
+            _set_status(line_id, SAVED, photo_count=ver["photo_count"], lengths=ver["lengths"])
+        return
+    _move_to_failed(path)
+    _set_status(line_id, FAILED, error=error)
+
+
+def _run():
+    while True:
+        line_id, path = _queue.get()
+        try:
+            _persist(line_id, path)
+        except Exception as e:
+            print(f"[photo_persist] line_id={line_id} job failed: {e}")
+            _set_status(line_id, FAILED, error=f"{type(e).__name__}: {e}")
+        finally:
+            _queue.task_done()
+
+
+def start_photo_worker() -> bool:
+    """Start the worker (once per process) and queue spooled jobs from an
+    earlier run. Returns True if this call started it."""
+    global _thread
+    with _start_lock:
+        if _thread is not None:
+            return False
+        _recover()
+        _thread = threading.Thread(target=_run, name="photo-persist", daemon=True)
+        _thread.start()
+        return True
+
+
+# ---- public API ------------------------------------------------------------
+
+def submit_line_photos(line_id, photos):
+    """Hand *photos* [(cam_index, bytes), ...] for receipt line *line_id* to
+    the worker. Returns once they are in the spool."""
+    photos = [(cam_idx, bytes(data)) for cam_idx, data in photos if data]
+    if not photos:
+        return
+    start_photo_worker()
+    try:
+        path = _spool(line_id, photos)
+    except OSError as e:
+        # No spool (disk full / read-only): write synchronously rather than lose them
+        print(f"[photo_persist] spool failed ({e}); writing line_id={line_id} inline")
+        ver = insert_line_photos(line_id, photos)
+        _set_status(line_id, DROPPED if ver is None else SAVED,
+                    photo_count=ver["photo_count"] if ver else 0)
+        return
+    _set_status(line_id, QUEUED, photo_count=len(photos))
+    _queue.put((line_id, path))
+
+
+def photo_status(line_id):
+    """{"state", "attempts", "ts", ...} for *line_id*, or None if no job is known."""
+    with _cond:
+        entry = _status.get(line_id)
+        return dict(entry) if entry is not None else None
+
+
+def pending_photo_jobs() -> int:
+    with _cond:
+        return sum(1 for s in _status.values() if s["state"] not in FINAL_STATES)
+
+
+def wait_for_photos(line_ids=None, timeout=None) -> bool:
+    """Block until the jobs for *line_ids* (default: all) reached a final
+    state. Returns False on timeout."""
+    deadline = None if timeout is None else time.time() + timeout
+    wanted = None if line_ids is None else set(line_ids)
+    with _cond:
+        while True:
+            if not any(s["state"] not in FINAL_STATES
+                       for lid, s in _status.items() if wanted is None or lid in wanted):
+                return True
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            _cond.wait(remaining)
@@ -0,0 +1,53 @@
+"""
+Background prefetch for the page that is not on screen.
+
+Only the active page runs on a rerun (see app.py). While the cashier works
+on the ticketing page, a daemon thread refreshes the manage page's cached
+reads every PREFETCH_MANAGE_INTERVAL_S seconds — today that is the monthly
+invoice summary (st.cache_data, shared by 月票据汇总 and the Excel export),
+so opening it finds the result in the cache instead of waiting on the
+query. Uncached reads (today's ticket inquiry, the client list) are not
+prefetched: their results would be thrown away.
+"""
+
+import threading
+import time
+
+from core.config import PREFETCH_MANAGE_INTERVAL_S
+
+_lock = threading.Lock()
+_last_start = 0.0
+_running = False
+
+
+def prefetch_manage_data():
+    """Fill the manage page's cached reads (synchronous)."""
+    from services.report_service import get_monthly_invoice_summary
+
+    get_monthly_invoice_summary()
+
+
+def maybe_prefetch_manage() -> bool:
+    """Start a background prefetch unless one ran recently or is still running.
+    Returns True if a thread was started."""
+    global _last_start, _running
+    if PREFETCH_MANAGE_INTERVAL_S <= 0:
+        return False
+    with _lock:
+        if _running or time.time() - _last_start < PREFETCH_MANAGE_INTERVAL_S:
+            return False
+        _running = True
+        _last_start = time.time()
+
+    def _run():
+        global _running
+        try:
+            prefetch_manage_data()
+        except Exception as e:
+            print(f"[prefetch] manage data failed: {e}")
+        finally:
+            with _lock:
+                _running = False
+
+    threading.Thread(target=_run, name="manage-prefetch", daemon=True).start()
+    return True
@@ -0,0 +1,198 @@
+"""
+Price book — every effective unit price, precomputed.
+
+Built with array maths over materials x tiers (column 0 = no tier, 1-5 =
+material_tier_prices) plus the client overrides from client_material_prices
+(pct or fixed amount on the base price). Every price is rounded to 3
+decimals and clamped to the material's min_unit_price / max_unit_price
+(each only when > 0).
+
+Resolution for (client, material), O(1):
+    client override  →  tier price for the client's tier  →  base price
+
+The book follows the catalog snapshot (db/catalog.py), so it sees writes
+from other processes as soon as the snapshot does. After update_material,
+save_material_tiers or save_client_material_price only the touched material
+row / client overrides are recomputed; other catalog changes that affect
+prices (materials added, deleted or restored) and age-based snapshot
+reloads rebuild it from scratch.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from db.catalog import catalog_changes_since, get_catalog
+from db.repo_products import (
+    get_all_client_material_prices, get_all_material_tiers,
+    get_client_material_prices, get_material_price_row,
+    get_material_price_rows, get_material_tiers,
+)
+
+TIERS = 5
+
+_lock = threading.Lock()
+_book = None
+
+
+def _clamp(prices, lo, hi):
+    prices = np.where(lo > 0, np.maximum(prices, lo), prices)
+    return np.where(hi > 0, np.minimum(prices, hi), prices)
+
+
+def _num(values):
+    # np.array copies: pandas may hand out read-only views, rows are updated in place
+    return np.array(pd.to_numeric(pd.Series(values), errors="coerce").fillna(0), dtype=float)
+
+
+class PriceBook:
+    def __init__(self, version, materials, tiers, overrides):
+        self.version = version
+        self.catalog = None     # snapshot the book was last synced with
+        self.material_ids = materials["id"].to_numpy(int)
+        self._pos = {int(m): i for i, m in enumerate(self.material_ids)}
+        self._base = _num(materials["unit_price"])
+        self._lo = _num(materials["min_unit_price"])
+        self._hi = _num(materials["max_unit_price"])
+
+        self._pct = np.zeros((len(self.material_ids), TIERS + 1))
+        if not tiers.empty:
+            pos = tiers["material_id"].map(self._pos)
+            ok = pos.notna().to_numpy()
+            self._pct[pos[ok].to_numpy(int), tiers["tier_level"].to_numpy(int)[ok]] = \
+                _num(tiers["pct_adjustment"])[ok]
+        self.matrix = self._tier_prices(self._base, self._pct, self._lo, self._hi)
+
+        # {(client_id, material_id): (adjust_type, adjust_value)} and resolved prices
+        self._adjust = {}
+        self._override = {}
+        self._set_overrides(overrides)
+
+    @staticmethod
+    def _tier_prices(base, pct, lo, hi):
+        prices = np.round(base[:, None] * (1 + pct / 100.0), 3)
+        return _clamp(prices, lo[:, None], hi[:, None])
+
+    def _set_overrides(self, df):
+        """Resolve override rows (client_id, material_id, adjust_type, adjust_value)."""
+        if df.empty:
+            return
+        pos = df["material_id"].map(self._pos)
+        ok = pos.notna().to_numpy()
+        df = df[ok]
+        pos = pos[ok].to_numpy(int)
+        value = _num(df["adjust_value"])
+        base = self._base[pos]
+        prices = np.where(df["adjust_type"].to_numpy() == "pct",
+                          base * (1 + value / 100.0), base + value)
+        prices = _clamp(np.round(prices, 3), self._lo[pos], self._hi[pos])
+        keys = list(zip(df["client_id"].astype(int), df["material_id"].astype(int)))
+        self._adjust.update(zip(keys, zip(df["adjust_type"], value)))
+        self._override.update(zip(keys, prices.tolist()))
+
+    # ---- lookups ---------------------------------------------------------
+
+    def price(self, client_id, tier_level, material_id):
+        """Effective unit price, or None for a material not in the book."""
+        p = self._override.get((client_id, material_id))
+        if p is not None:
+            return p
+        i = self._pos.get(material_id)
+        if i is None:
+            return None
+        tier = tier_level if tier_level and 1 <= tier_level <= TIERS else 0
+        return float(self.matrix[i, tier])
+
+    def client_prices(self, client_id, tier_level) -> pd.Series:
+        """All effective prices for one client, indexed by material id (bulk re-pricing)."""
+        tier = tier_level if tier_level and 1 <= tier_level <= TIERS else 0
+        out = pd.Series(self.matrix[:, tier], index=self.material_ids)
+        for (cid, mid), p in self._override.items():
+            if cid == client_id:
+                out[mid] = p
+        return out
+
+    # ---- incremental updates --------------------------------------------
+
+    def update_material(self, material_id) -> bool:
+        """Recompute one material's row and its overrides; False if the
+        material set itself changed (caller rebuilds)."""
+        i = self._pos.get(material_id)
+        row = get_material_price_row(material_id)
+        if i is None or row is None or row["deleted"]:
+            return False
+        self._base[i] = float(row["unit_price"] or 0)
+        self._lo[i] = float(row["min_unit_price"] or 0)
+        self._hi[i] = float(row["max_unit_price"] or 0)
+        for tier, pct in get_material_tiers(material_id).items():
+            self._pct[i, tier] = pct
+        self.matrix[i] = self._tier_prices(
+            self._base[i:i + 1], self._pct[i:i + 1], self._lo[i:i + 1], self._hi[i:i + 1])[0]
+        touched = [(cid, mid, t, v) for (cid, mid), (t, v) in self._adjust.items()
+                   if mid == material_id]
+        self._set_overrides(pd.DataFrame(
+            touched, columns=["client_id", "material_id", "adjust_type", "adjust_value"]))
+        return True
+
+    def update_client(self, client_id):
+        for key in [k for k in self._adjust if k[0] == client_id]:
+            del self._adjust[key]
+            self._override.pop(key, None)
+        df = get_client_material_prices(client_id)
+        df["client_id"] = client_id
+        self._set_overrides(df)
+
+    def reload_overrides(self):
+        self._adjust.clear()
+        self._override.clear()
+        self._set_overrides(get_all_client_material_prices())
+
+
+def _build(version) -> PriceBook:
+    return PriceBook(version, get_material_price_rows(), get_all_material_tiers(),
+                     get_all_client_material_prices())
+
+
+def _apply(book, changes) -> bool:
+    """Apply catalog changes in place; False when a full rebuild is needed."""
+    for table, key in changes:
+        if table in ("materials", "material_tier_prices"):
+            if key is None or not book.update_material(int(key)):
+                return False
+        elif table == "client_material_prices":
+            if key is None:
+                book.reload_overrides()
+            else:
+                book.update_client(int(key))
+        elif table is None:
+            return False
+    return True
+
+
+def get_price_book(catalog=None) -> PriceBook:
+    """Book for the current catalog snapshot (*catalog*: get_catalog() result,
+    when the caller already has it)."""
+    global _book
+    snap = catalog if catalog is not None else get_catalog()
+    book = _book
+    if book is not None and book.catalog is snap:
+        return book
+    with _lock:
+        book = _book
+        if book is None or book.catalog is not snap:
+            # Same version, new snapshot: an age-based reload (edits outside the
+            # repo functions), which the change log cannot describe
+            changes = (catalog_changes_since(book.version)
+                       if book is not None and book.version != snap.version else None)
+            if changes is None or not _apply(book, changes):
+                book = _book = _build(snap.version)
+            book.version, book.catalog = snap.version, snap
+        return book
+
+
+def effective_price(client_code, material_id):
+    """Unit price for *client_code* buying *material_id* (None if unknown material)."""
+    catalog = get_catalog()
+    return get_price_book(catalog).price(
+        catalog.client_id(client_code), catalog.client_tier(client_code), material_id)
@@ -1,5 +1,6 @@
 """
 Report & summary queries (read-only).
+Summaries read the pre-aggregated daily_rollups table (db/rollups.py).
 """
 
 import time
@@ -13,10 +14,10 @@ from db.connection import qdf
 @st.cache_data(ttl=60)
 def get_monthly_invoice_summary(_start_date=None, _end_date=None, _status=None):
     df = qdf("""
-        SELECT substr(issue_time,1,7) AS yyyy_mm,
-               COUNT(*) AS cnt,
-               COALESCE(SUM(rounding_amount),0) AS total
-        FROM receipts
+        SELECT substr(day,1,7) AS yyyy_mm,
+               SUM(tickets) AS cnt,
+               ROUND(COALESCE(SUM(rounding),0), 2) AS total
+        FROM daily_rollups
         WHERE voided = 0
         GROUP BY yyyy_mm
         ORDER BY yyyy_mm DESC
@@ -50,13 +51,13 @@ def get_daily_summary_df(start_date=None, end_date=None,
     params = []
 
     if start_date:
-        where.append("substr(issue_time,1,10) >= ?")
+        where.append("day >= ?")
         params.append(start_date)
     if end_date:
-        where.append("substr(issue_time,1,10) <= ?")
+        where.append("day <= ?")
         params.append(end_date)
     if method_filter and method_filter != "All":
-        where.append("ticketing_method = ?")
+        where.append("method = ?")
         params.append(method_filter)
     if void_filter == "Not Voided":
         where.append("voided = 0")
@@ -70,36 +71,34 @@ def get_daily_summary_df(start_date=None, end_date=None,
     where_sql = (" WHERE " + " AND ".join(where)) if where else ""
 
     return qdf(f"""
-        SELECT substr(issue_time,1,10) AS issue_date,
-               COUNT(*) AS invoiced_quantity,
-               COALESCE(SUM(subtotal),0) AS subtotal,
-               COALESCE(SUM(rounding_amount),0) AS rounding_amount
-        FROM receipts r
+        SELECT day AS issue_date,
+               SUM(tickets) AS invoiced_quantity,
+               ROUND(SUM(subtotal), 2) AS subtotal,
+               ROUND(SUM(rounding), 2) AS rounding_amount
+        FROM daily_rollups
         {where_sql}
-        GROUP BY issue_date ORDER BY issue_date DESC LIMIT 1000
+        GROUP BY day ORDER BY day DESC LIMIT 1000
     """, tuple(params))
 
 
 def get_monthly_summary_df():
     return qdf("""
-        SELECT substr(issue_time,1,7) AS issue_month,
-               SUM((SELECT COALESCE(SUM(net),0) FROM receipt_lines rl
-                    WHERE rl.receipt_id=r.id)) AS invoiced_quantity,
-               SUM(subtotal) AS subtotal,
-               SUM(rounding_amount) AS rounding_amount
-        FROM receipts r WHERE voided=0
+        SELECT substr(day,1,7) AS issue_month,
+               ROUND(SUM(net), 3) AS invoiced_quantity,
+               ROUND(SUM(subtotal), 2) AS subtotal,
+               ROUND(SUM(rounding), 2) AS rounding_amount
+        FROM daily_rollups WHERE voided=0
         GROUP BY issue_month ORDER BY issue_month DESC LIMIT 1000
     """)
 
 
 def get_annual_summary_df():
     return qdf("""
-        SELECT substr(issue_time,1,4) AS issue_year,
-               SUM((SELECT COALESCE(SUM(net),0) FROM receipt_lines rl
-                    WHERE rl.receipt_id=r.id)) AS invoiced_quantity,
-               SUM(subtotal) AS subtotal,
-               SUM(rounding_amount) AS rounding_amount
-        FROM receipts r WHERE voided=0
+        SELECT substr(day,1,4) AS issue_year,
+               ROUND(SUM(net), 3) AS invoiced_quantity,
+               ROUND(SUM(subtotal), 2) AS subtotal,
+               ROUND(SUM(rounding), 2) AS rounding_amount
+        FROM daily_rollups WHERE voided=0
         GROUP BY issue_year ORDER BY issue_year DESC LIMIT 100
     """)
 
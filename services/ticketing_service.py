@@ -8,10 +8,9 @@ import html as html_module
 from datetime import datetime
 
 import streamlit as st
-import pandas as pd
 
 from core.config import RECEIPT_HEADER_LINES, RECEIPT_WIDTH, LEGAL_TEXT
-from core.utils import calc_line, recompute_receipt_df, rpad, rjust, sanitize_style_block
+from core.utils import rpad, rjust, sanitize_style_block
 from core.state import (
     record_action, bump_receipt_ver, STEP_SELECT_ITEM,
 )
@@ -20,7 +19,7 @@ from db.repo_ticketing import get_receipt, get_receipt_lines
 
 
 # ---------------------------------------------------------------------------
-# Add a line to the in-memory receipt DataFrame
+# Add a line to the in-memory receipt (core/receipt.py)
 # ---------------------------------------------------------------------------
 
 def add_line_to_receipt(override_gross=None, override_tare=None,
@@ -35,19 +34,8 @@ def add_line_to_receipt(override_gross=None, override_tare=None,
     tare = (override_tare if override_tare is not None
             else st.session_state.tare_input)
 
-    net, total = calc_line(unit_price, gross, tare)
-    new_row = {
-        "Del": False,
-        "material": st.session_state.picked_material_name,
-        "unit_price": float(unit_price or 0),
-        "gross": float(gross or 0),
-        "tare": float(tare or 0),
-        "net": float(net),
-        "total": float(round(total, 2)),
-    }
-    df = st.session_state.receipt_df
-    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    st.session_state.receipt_df = recompute_receipt_df(df)
+    st.session_state.receipt_buf.append(
+        st.session_state.picked_material_name, unit_price, gross, tare)
 
     st.session_state._reset_line_fields = True
     st.session_state.focus_request = "gross"
@@ -9,6 +9,7 @@ import os
 import py_compile
 import glob
 import sqlite3
+import tempfile
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -78,6 +79,293 @@ def test_db_init_and_tables():
     print(f"  [PASS] All required DB tables exist: {sorted(required)}")
 
 
+def test_schema_migrations():
+    from db.schema import apply_migrations, get_schema_version, init_db, SCHEMA_VERSION
+
+    # Fresh DB: every step runs once, re-running is a no-op
+    conn = sqlite3.connect(":memory:")
+    assert apply_migrations(conn) == list(range(1, SCHEMA_VERSION + 1))
+    assert get_schema_version(conn) == SCHEMA_VERSION
+    assert apply_migrations(conn) == []
+    assert conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0] == 1
+    indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert not indexes & {"idx_receipts_open_month", "idx_receipts_open_year"}, indexes
+    conn.close()
+
+    # Legacy DB (pre tier pricing, user_version 0, has data) upgrades in place
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT UNIQUE, "
+                 "name TEXT, phone TEXT, email TEXT, id_number TEXT, deleted INTEGER DEFAULT 0, created_at TEXT)")
+    conn.execute("INSERT INTO clients(code,name) VALUES('123456','Old Client')")
+    conn.commit()
+    apply_migrations(conn)
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(clients)")]
+    assert "tier_level" in cols
+    assert conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0] == 1, "seed must not touch existing clients"
+    conn.close()
+
+    # Process guard: after the first call init_db does nothing
+    init_db()
+    assert init_db() == []
+    print(f"  [PASS] Schema migrations up to v{SCHEMA_VERSION}, legacy upgrade, once-per-process init")
+
+
+# Tables that grow with daily use — a full scan of these is a bug.
+_LARGE_TABLES = {"receipts", "receipt_lines", "ticket_item_photos",
+                 "receipt_line_photos", "clients"}
+
+# Functions allowed to scan a large table, with the reason.
+_SCAN_ALLOWLIST = {
+    "get_all_clients_df": "admin list, rowid order + LIMIT 2000",
+    "get_latest_receipt_line_ids": "rowid order + LIMIT (Verify DB Photos)",
+}
+
+
+def _collect_sql(paths):
+    """Yield (file, function, sql) for every SQL string literal in *paths*."""
+    import ast
+    for path in paths:
+        tree = ast.parse(open(path, encoding="utf-8").read(), path)
+        for fn in ast.walk(tree):
+            if not isinstance(fn, ast.FunctionDef):
+                continue
+            doc = fn.body[0].value if isinstance(fn.body[0], ast.Expr) else None
+            for node in ast.walk(fn):
+                if node is doc:
+                    continue
+                if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                    sql = node.value.strip()
+                    head = sql.split(None, 1)[0].upper() if sql else ""
+                    if head in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+                        yield os.path.basename(path), fn.name, sql
+
+
+def _full_scans(conn, sql):
+    """Return large tables the plan for *sql* scans without a partial index."""
+    import re
+    partial = {r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND sql LIKE '%WHERE%'")}
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?")).fetchall()
+    hits = []
+    for row in plan:
+        m = re.match(r"SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?", row[3])
+        if not m or (m.group(2) in partial):
+            continue
+        name = m.group(1)
+        alias = re.search(r"(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?" + name + r"\b", sql, re.I)
+        table = alias.group(1) if alias else name
+        if table in _LARGE_TABLES:
+            hits.append(row[3])
+    return hits
+
+
+def test_query_plan_audit():
+    from db.schema import apply_migrations
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = sorted(glob.glob(os.path.join(root, "db", "repo_*.py")))
+    paths.append(os.path.join(root, "services", "report_service.py"))
+
+    conn = sqlite3.connect(":memory:")
+    apply_migrations(conn)
+    checked, problems = 0, []
+    for fname, func, sql in _collect_sql(paths):
+        checked += 1
+        hits = _full_scans(conn, sql)
+        if hits and func not in _SCAN_ALLOWLIST:
+            problems.append(f"{fname}:{func}: {hits}")
+    conn.close()
+    assert checked > 30, f"only {checked} SQL statements found"
+    assert not problems, "Unexpected full table scans:\n  " + "\n  ".join(problems)
+    print(f"  [PASS] Query plan audit: {checked} statements, no unexpected full scans")
+
+
+def test_report_issue_date_keys():
+    from db.schema import apply_migrations
+    from db.repo_ticketing import finalize_ticket, get_receipt_detail_inquiry_df, void_ticket
+    from services.report_service import get_daily_summary_df
+
+    # Backfill: rows written before the date keys existed get them on upgrade
+    conn = sqlite3.connect(":memory:")
+    apply_migrations(conn, target=4)
+    conn.execute("INSERT INTO receipts(issue_time) VALUES('2001-02-03 04:05:06')")
+    conn.commit()
+    apply_migrations(conn)
+    row = conn.execute("SELECT issue_date, issue_month, issue_year FROM receipts").fetchone()
+    assert tuple(row) == ("2001-02-03", "2001-02", "2001"), row
+    conn.close()
+
+    # Write path: finalize_ticket fills the keys, reports filter on them
+    rid, _, _ = finalize_ticket("1999-12-31 23:59:00", "smoke", "Print", "123456",
+                             "000001", "Walk-in", 10.0, 10.0,
+                             [("Cu#1", 1.0, 11.0, 1.0, 10.0, 10.0)])
+    df = get_receipt_detail_inquiry_df("1999-12-31", "1999-12-31")
+    assert rid in df["Ticket Id"].tolist()
+    assert df.loc[df["Ticket Id"] == rid, "Date Created"].iloc[0] == "1999-12-31"
+    daily = get_daily_summary_df(start_date="1999-12-31", end_date="1999-12-31",
+                                 void_filter="Not Voided")
+    assert daily["invoiced_quantity"].sum() >= 1
+    void_ticket(rid)
+    assert rid not in get_receipt_detail_inquiry_df("1999-12-31", "1999-12-31")["Ticket Id"].tolist()
+    print("  [PASS] Receipts carry issue_date/month/year (backfill + write path)")
+
+
+def _drop_receipts(*rids):
+    """Delete test receipts (lines and photos cascade) and rebuild the rollups,
+    so tests with fixed days can run again on the same DB."""
+    from db.connection import run_write
+    from db.rollups import rebuild_rollups
+
+    run_write(lambda conn: conn.executemany("DELETE FROM receipts WHERE id=?",
+                                            [(int(r),) for r in rids]))
+    rebuild_rollups()
+
+
+def test_daily_rollups():
+    from db.connection import qdf
+    from db.rollups import rebuild_rollups
+    from db.repo_ticketing import (finalize_ticket, void_ticket, restore_ticket,
+                                   update_receipt_lines, get_receipt_lines)
+    from services.report_service import get_daily_summary_df, get_monthly_summary_df
+
+    def snapshot():
+        df = qdf("SELECT day, method, voided, withdrawn, tickets, "
+                 "ROUND(net,3) AS net, ROUND(subtotal,2) AS subtotal, "
+                 "ROUND(rounding,2) AS rounding FROM daily_rollups "
+                 "ORDER BY day, method, voided, withdrawn")
+        return df.to_dict("records")
+
+    day = "1998-06-15"
+    rid, _, _ = finalize_ticket(f"{day} 10:00:00", "smoke", "Print", "111111",
+                             "000001", "Walk-in", 30.0, 30.0,
+                             [("Cu#1", 1.5, 22.0, 2.0, 20.0, 30.0)])
+    try:
+        daily = get_daily_summary_df(start_date=day, end_date=day, void_filter="Not Voided")
+        assert daily["invoiced_quantity"].tolist() == [1] and daily["subtotal"].tolist() == [30.0]
+
+        line_id = int(get_receipt_lines(rid)["id"].iloc[0])
+        update_receipt_lines([(line_id, 12.0, 2.0, 10.0, 15.0)], 15.0, rid)
+        month = get_monthly_summary_df()
+        row = month[month["issue_month"] == day[:7]].iloc[0]
+        assert (row["invoiced_quantity"], row["subtotal"]) == (10.0, 15.0), row
+
+        void_ticket(rid)
+        assert get_daily_summary_df(start_date=day, end_date=day, void_filter="Not Voided").empty
+        assert get_daily_summary_df(start_date=day, end_date=day, void_filter="Voided")["invoiced_quantity"].sum() == 1
+        restore_ticket(rid)
+
+        incremental = snapshot()
+        rebuild_rollups()
+        assert snapshot() == incremental, "incremental rollups drifted from rebuild"
+        print("  [PASS] daily_rollups follow finalize/edit/void/restore and match rebuild")
+    finally:
+        _drop_receipts(rid)
+
+
+def test_connection_pool():
+    import threading
+    from db.connection import get_connection, get_pool, qone
+
+    with get_connection() as outer:
+        with get_connection() as inner:
+            assert inner is outer, "nested get_connection must share the connection"
+
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(20):
+                assert qone("SELECT 1 AS x")["x"] == 1
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+    stats = get_pool().stats()
+    assert stats["in_use"] == 0, stats
+    assert stats["open"] <= stats["max_size"], stats
+    assert stats["checkouts"] >= 120, stats
+    print(f"  [PASS] Connection pool reuses connections: {stats}")
+
+
+def test_single_writer_group_commit():
+    import threading
+    from db.connection import run_write, writer_stats, qone
+    from db.repo_ticketing import create_draft_receipt, delete_draft_receipt
+
+    before = writer_stats()
+    ids, errors = [], []
+
+    def worker():
+        try:
+            ids.append(create_draft_receipt())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+    assert len(set(ids)) == 12 and all(i > 0 for i in ids), ids
+
+    # A failing request is rolled back alone and its error reaches the caller
+    def bad(conn):
+        conn.execute("INSERT INTO settings(key,value) VALUES('__writer_probe__','x')")
+        raise ValueError("boom")
+    try:
+        run_write(bad)
+        raise AssertionError("run_write must re-raise the request's error")
+    except ValueError:
+        pass
+    assert qone("SELECT 1 FROM settings WHERE key='__writer_probe__'") is None
+
+    for rid in ids:
+        delete_draft_receipt(rid)
+
+    # A writer that cannot open its DB fails every request, none hangs
+    from concurrent.futures import ThreadPoolExecutor
+    from db.connection import WriteQueue
+
+    broken = WriteQueue(os.path.join(tempfile.gettempdir(), "no_such_dir", "x", "pos.db"))
+
+    def submit(_):
+        try:
+            broken.submit(lambda conn: 1)
+        except sqlite3.Error:
+            return "raised"
+
+    with ThreadPoolExecutor(8) as pool:
+        outcomes = [f.result(timeout=10) for f in
+                    [pool.submit(submit, i) for i in range(200)]]
+    assert outcomes == ["raised"] * 200, outcomes
+
+    after = writer_stats()
+    assert after["requests"] - before["requests"] >= 25
+    print(f"  [PASS] Single writer: {after['requests']} requests in {after['batches']} batches")
+
+
+def test_query_instrumentation():
+    from db.connection import QueryStats, query_stats
+    from db.repo_products import get_categories
+
+    get_categories()
+    rows = [r for r in query_stats() if r["caller"] == "db.repo_products.get_categories"]
+    assert rows and rows[0]["count"] >= 1 and rows[0]["rows"] > 0, rows
+
+    qs = QueryStats(slow_ms=0.0, slow_log_size=5, max_keys=3)
+    for i in range(20):
+        qs.record(f"SELECT {i}", "t.caller", 0.003, rows=1)
+    assert len(qs.slow_log()) == 5, "slow-query log must stay bounded"
+    assert len(qs.snapshot()) <= 4, "distinct statements must stay bounded"
+    print("  [PASS] Query stats record caller/rows; slow log and key set are bounded")
+
+
 def test_categories_and_materials():
     from db.repo_products import get_categories, get_materials
     cats = get_categories()
@@ -142,7 +430,7 @@ def test_line_photos_write_read():
 
     init_db()
     fake_jpeg = b"\xff\xd8\xff\xe0\x00\x10JFIF" + b"\x00" * 1100
-    rid, verification = finalize_ticket(
+    rid, verification, _ = finalize_ticket(
         "2025-01-01 12:00:00", "SmokeTest", "Print", "W000",
         "000001", "Walk-in", 10.0, 10.0,
         [("Test Material", 1.0, 10.0, 0.0, 10.0, 10.0)],
@@ -162,6 +450,685 @@ def test_line_photos_write_read():
     print("  [PASS] ticket_item_photos BLOB write/read (finalize_ticket + get_item_photos)")
 
 
+def test_photo_store():
+    """New photos live in the store (row keeps hash only); legacy BLOB rows migrate transparently."""
+    from db import photo_store
+    from db.connection import qone, run_write
+    from db.repo_ticketing import insert_line_photos, insert_receipt_line, create_draft_receipt, get_item_photos
+
+    rid = create_draft_receipt()
+    lid = insert_receipt_line(rid, "Photo Store", 1.0, 2.0, 1.0, 1.0, 1.0)
+    jpeg = b"\xff\xd8\xff\xe0store" + os.urandom(2000)
+    insert_line_photos(lid, [(1, jpeg)])
+    row = qone("SELECT sha256, size, length(image_bytes) AS blob_len FROM ticket_item_photos "
+               "WHERE ticket_item_id=?", (lid,))
+    assert row["blob_len"] == 0 and row["size"] == len(jpeg)
+    assert os.path.exists(photo_store.object_path(row["sha256"]))
+
+    # Legacy row (bytes in the main DB) reads the same before and after migrating
+    legacy = b"\xff\xd8legacy" + os.urandom(1500)
+    run_write(lambda conn: conn.execute(
+        "INSERT INTO ticket_item_photos(ticket_item_id, cam_index, image_bytes) VALUES(?,?,?)",
+        (lid, 2, legacy)))
+    assert get_item_photos(lid) == [(1, jpeg), (2, legacy)]
+    assert photo_store.migrate_legacy_blobs(batch_size=1) >= 1
+    assert qone("SELECT COUNT(*) AS c FROM ticket_item_photos WHERE sha256 IS NULL")["c"] == 0
+    assert get_item_photos(lid) == [(1, jpeg), (2, legacy)]
+
+    # gc keeps referenced objects, drops orphans
+    orphan = photo_store.put(b"orphan" + os.urandom(16))
+    assert photo_store.gc(min_age_s=-1) >= 1
+    assert photo_store.get(orphan) is None and photo_store.get(row["sha256"]) == jpeg
+
+    # A row whose object is gone loads as empty bytes and is counted, not printed
+    misses = photo_store.missing_stats()["count"]
+    assert photo_store.load("0" * 64) == b""
+    stats = photo_store.missing_stats()
+    assert stats["count"] == misses + 1 and stats["recent"][0] == "0" * 64
+
+    # A dedup hit refreshes the object's mtime, so gc's age check spares it
+    again = b"again" + os.urandom(16)
+    path = photo_store.object_path(photo_store.put(again))
+    os.utime(path, (0, 0))
+    photo_store.put(again)
+    assert photo_store.gc() == 0 and os.path.exists(path)
+    os.unlink(path)
+    print("  [PASS] Photo store: hash-only rows, legacy BLOB migration, gc")
+
+
+def test_photo_thumbnails():
+    import io
+    from db import photo_store
+    from db.connection import qone
+    from db.repo_ticketing import insert_line_photos, insert_receipt_line, create_draft_receipt, get_item_photos
+
+    if photo_store.Image is None:
+        print("  [SKIP] Pillow not installed — thumbnails disabled")
+        return
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.frombytes("RGB", (1280, 960), os.urandom(1280 * 960 * 3)).save(buf, "JPEG", quality=90)
+    full = buf.getvalue()
+
+    rid = create_draft_receipt()
+    lid = insert_receipt_line(rid, "Thumb", 1.0, 2.0, 1.0, 1.0, 1.0)
+    insert_line_photos(lid, [(1, full)])
+    row = qone("SELECT thumb_sha256, thumb_size FROM ticket_item_photos WHERE ticket_item_id=?", (lid,))
+    assert row["thumb_sha256"] and 0 < row["thumb_size"] < len(full)
+
+    (cam, thumb), = get_item_photos(lid, thumbnails=True)
+    with Image.open(io.BytesIO(thumb)) as im:
+        assert max(im.size) <= photo_store.PHOTO_THUMB_MAX_PX
+    assert get_item_photos(lid) == [(1, full)]
+    print(f"  [PASS] Thumbnail made on write: {len(full)} → {len(thumb)} bytes")
+
+
+def test_receipt_photos_one_query():
+    from db.connection import query_stats, reset_query_stats
+    from db.repo_ticketing import finalize_ticket, get_receipt_photos, get_receipt_lines
+
+    a, b = b"\xff\xd8A" + os.urandom(300), b"\xff\xd8B" + os.urandom(300)
+    rid, _, _ = finalize_ticket("2025-02-02 09:00:00", "smoke", "Print", "222222",
+                             "000001", "Walk-in", 2.0, 2.0,
+                             [("L1", 1.0, 2.0, 1.0, 1.0, 1.0), ("L2", 1.0, 2.0, 1.0, 1.0, 1.0),
+                              ("L3 no photo", 1.0, 1.0, 0.0, 1.0, 1.0)],
+                             line_photos=[[(1, a), (2, b)], [(2, a)], None])
+    l1, l2, _l3 = get_receipt_lines(rid)["id"].tolist()
+
+    reset_query_stats()
+    photos = get_receipt_photos(rid)
+    assert photos == {l1: {1: a, 2: b}, l2: {2: a}}
+    calls = [s for s in query_stats() if s["caller"].endswith("get_receipt_photos")]
+    assert sum(s["count"] for s in calls) == 1
+
+    meta = get_receipt_photos(rid, metadata_only=True)
+    assert meta[l1][1]["size"] == len(a) and meta[l1][1]["sha256"]
+    print("  [PASS] get_receipt_photos: whole receipt in one query, keyed by line/cam")
+
+
+def test_only_active_page_runs():
+    """A ticketing rerun must not execute manage-page queries (and vice versa)."""
+    from streamlit.testing.v1 import AppTest
+    from db.connection import query_stats, reset_query_stats
+    import services.prefetch as prefetch
+
+    def callers():
+        return {s["caller"] for s in query_stats()}
+
+    saved = prefetch.PREFETCH_MANAGE_INTERVAL_S
+    prefetch.PREFETCH_MANAGE_INTERVAL_S = 0
+    try:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        at = AppTest.from_file(os.path.join(root, "app.py"), default_timeout=60)
+        at.run()
+        assert not at.exception, at.exception
+        reset_query_stats()
+        at.run()
+        assert "db.repo_ticketing.get_receipt_detail_inquiry_df" not in callers()
+        # Catalog comes from the shared snapshot (db.catalog)
+        assert not {c for c in callers()
+                    if c.startswith(("db.repo_products.", "db.repo_customers."))}
+
+        at.button(key="_nav_manage").click().run()
+        assert not at.exception and at.session_state.current_page == "manage"
+        reset_query_stats()
+        at.run()
+        assert "db.repo_ticketing.get_receipt_detail_inquiry_df" in callers()
+        assert "db.repo_products.get_materials" not in callers()
+    finally:
+        prefetch.PREFETCH_MANAGE_INTERVAL_S = saved
+
+    from services.report_service import get_monthly_invoice_summary
+    get_monthly_invoice_summary.clear()
+    prefetch.prefetch_manage_data()
+    reset_query_stats()
+    get_monthly_invoice_summary()
+    assert not query_stats(), "prefetched summary must come from the cache"
+    print("  [PASS] Only the active page runs; manage data prefetch works")
+
+
+def test_ticketing_fragments():
+    """Ticketing areas render as keyed fragments; callbacks carry state between them."""
+    from streamlit.testing.v1 import AppTest
+    from core import state
+    import services.prefetch as prefetch
+
+    saved = prefetch.PREFETCH_MANAGE_INTERVAL_S
+    prefetch.PREFETCH_MANAGE_INTERVAL_S = 0
+    try:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        at = AppTest.from_file(os.path.join(root, "app.py"), default_timeout=60)
+        at.run()
+        assert not at.exception, at.exception
+        frags = {state.FRAG_RECEIPT, state.FRAG_MATERIALS, state.FRAG_CAMERA,
+                 state.FRAG_CLIENT, state.FRAG_RECEIVING}
+        assert set(at.session_state["_frag_ms"]) == frags
+
+        mat = next(b for b in at.button if (b.key or "").startswith("mat_"))
+        mat.click().run()
+        assert not at.exception, at.exception
+        assert at.session_state.picked_material_name == mat.label
+
+        before = at.session_state.capture_token
+        at.button(key="switch_to_tare").click().run()
+        assert at.session_state.capture_token == before + 1
+        assert at.session_state.key_target == "tare"
+
+        at.text_input(key="gross_input").input("100")
+        at.text_input(key="tare_input").input("10")
+        next(b for b in at.button if "Confirm Line" in (b.label or "")).click().run()
+        assert not at.exception, at.exception
+        buf = at.session_state.receipt_buf
+        assert len(buf) == 1 and buf.lines[0].net == 90.0
+        assert at.session_state.picked_material_name == ""
+        assert at.session_state.gross_input == ""
+    finally:
+        prefetch.PREFETCH_MANAGE_INTERVAL_S = saved
+    print("  [PASS] Ticketing fragments + cross-fragment callbacks")
+
+
+def test_catalog_snapshot():
+    """Catalog reads come from one shared snapshot, reloaded only after a catalog
+    write — in this process or another one sharing the DB file."""
+    from core.config import DB_PATH
+    from db.catalog import get_catalog, catalog_version, _VERSION_SQL
+    from db.connection import query_stats, reset_query_stats, writer_stats
+    from db.repo_customers import get_client_tier, update_client, get_all_clients_df
+    from db.repo_products import (
+        get_all_materials_df, get_default_operator_email, save_material_tiers, update_material,
+    )
+
+    snap = get_catalog()
+    reset_query_stats()
+    assert get_catalog() is snap
+    assert [q["sql"] for q in query_stats()] == [_VERSION_SQL], "only the version check"
+
+    mats = get_all_materials_df()
+    m = mats[mats["deleted"] == 0].iloc[0]
+    mid = int(m["id"])
+    v = catalog_version()
+    requests = writer_stats()["requests"]
+    save_material_tiers(mid, {1: 0.0, 2: 10.0, 3: 0.0, 4: 0.0, 5: 0.0})
+    update_material(mid, 2.5, float(m["min_unit_price"] or 0), float(m["max_unit_price"] or 0))
+    assert catalog_version() == v + 2
+    assert writer_stats()["requests"] == requests + 2, "data and version bump in one write"
+    snap2 = get_catalog()
+    assert snap2 is not snap
+    row = snap2.materials[snap2.materials["id"] == mid].iloc[0]
+    assert float(row["unit_price"]) == 2.5
+
+    c = get_all_clients_df().iloc[0]
+    update_client(int(c["id"]), c["姓名"] or "", c["手机号码"] or "", tier_level=3)
+    assert get_catalog().client_tier(c["编号"]) == get_client_tier(c["编号"]) == 3
+    assert get_catalog().default_operator_email() == get_default_operator_email()
+
+    # A write from another process (own connection, no in-process state) is seen
+    other = sqlite3.connect(DB_PATH)
+    other.execute("UPDATE materials SET unit_price=7.25 WHERE id=?", (mid,))
+    other.execute("INSERT INTO catalog_changes(tbl, key) VALUES('materials', ?)", (mid,))
+    other.commit()
+    other.close()
+    snap3 = get_catalog()
+    assert float(snap3.materials.loc[snap3.materials["id"] == mid, "unit_price"].iloc[0]) == 7.25
+
+    update_material(mid, float(m["unit_price"] or 0),
+                    float(m["min_unit_price"] or 0), float(m["max_unit_price"] or 0))
+    print("  [PASS] Catalog snapshot: shared, DB-versioned, matches repo lookups")
+
+
+def test_price_book():
+    """Price book: override → tier → base, clamped to min/max, updated in place."""
+    import numpy as np
+    from core.config import DB_PATH
+    from db import catalog
+    from db.catalog import catalog_version
+    from db.connection import qone
+    from db.repo_customers import get_all_clients_df
+    from db.repo_products import (
+        delete_client_material_price, get_all_materials_df, get_client_material_prices,
+        save_client_material_price, save_material_tiers, update_material,
+    )
+    from services import price_book
+    from services.price_book import effective_price, get_price_book
+
+    mats = get_all_materials_df()
+    m = mats[mats["deleted"] == 0].iloc[0]
+    mid = int(m["id"])
+    book = get_price_book()
+    update_material(mid, 4.0, 3.0, 4.2)
+    save_material_tiers(mid, {1: 0.0, 2: 10.0, 3: -50.0, 4: 0.0, 5: 0.0})
+    assert get_price_book() is book  # updated in place, not rebuilt
+    assert book.price(None, 0, mid) == 4.0
+    assert book.price(None, 2, mid) == 4.2   # 4.4 clamped to max
+    assert book.price(None, 3, mid) == 3.0   # 2.0 clamped to min
+    assert book.price(None, 1, 999999) is None
+
+    c = get_all_clients_df().iloc[0]
+    cid, code = int(c["id"]), c["编号"]
+    save_client_material_price(cid, mid, "amount", 0.1)
+    assert effective_price(code, mid) == 4.1
+    assert get_price_book().client_prices(cid, 0)[mid] == 4.1
+    fresh = price_book._build(catalog_version())
+    assert np.array_equal(fresh.matrix, get_price_book().matrix)
+    assert fresh.price(cid, 0, mid) == 4.1
+
+    for rid in get_client_material_prices(cid)["id"]:
+        delete_client_material_price(int(rid))
+    last = qone("SELECT tbl, key FROM catalog_changes ORDER BY version DESC LIMIT 1")
+    assert tuple(last) == ("client_material_prices", cid), tuple(last)  # only this client
+    assert effective_price(code, mid) == get_price_book().price(None, c["Tier级别"], mid)
+
+    # Another process edits the price: seen through its catalog_changes row,
+    # and through the age-based snapshot reload when it did not log one
+    other = sqlite3.connect(DB_PATH)
+    other.execute("UPDATE materials SET unit_price=3.5 WHERE id=?", (mid,))
+    other.execute("INSERT INTO catalog_changes(tbl, key) VALUES('materials', ?)", (mid,))
+    other.commit()
+    assert effective_price(None, mid) == 3.5
+    other.execute("UPDATE materials SET unit_price=3.75 WHERE id=?", (mid,))
+    other.commit()
+    other.close()
+    catalog.get_catalog().loaded_at = 0
+    assert effective_price(None, mid) == 3.75
+    update_material(mid, float(m["unit_price"] or 0),
+                    float(m["min_unit_price"] or 0), float(m["max_unit_price"] or 0))
+    save_material_tiers(mid, {t: 0.0 for t in range(1, 6)})
+    print("  [PASS] Price book: vectorized tiers/overrides, clamps, incremental updates")
+
+
+def test_client_search():
+    """Client search index: ranked top-K, kept in sync by the client write functions."""
+    from core.config import DB_PATH
+    from db.catalog import get_catalog
+    from db.repo_customers import save_customer, update_client, delete_client, get_all_clients_df
+    from services.client_search import get_client_index, search_clients
+
+    index = get_client_index()
+    code = save_customer("Zed Quuxley", "5559876543")
+    assert get_client_index() is index  # updated in place
+    assert search_clients("quux")[0][0] == code
+    assert search_clients("5559876543") == [(code, "Zed Quuxley", "5559876543")]
+    assert search_clients("qu")[0][0] == code          # token prefix
+    assert search_clients("uuxl")[0][0] == code        # substring
+    assert len(search_clients("", k=3)) <= 3
+    assert search_clients("")[0][0] == code            # newest first
+
+    cid = int(get_all_clients_df().query("编号 == @code")["id"].iloc[0])
+    update_client(cid, "Zed Renamed", "5559876543")
+    assert not search_clients("quux")
+    assert search_clients("renamed")[0][0] == code
+    delete_client(cid)
+    assert not search_clients("renamed")
+
+    # Clients written by another process: via catalog_changes, or age reload
+    other = sqlite3.connect(DB_PATH)
+    other.execute("UPDATE clients SET name='Zed Elsewhere', deleted=0 WHERE id=?", (cid,))
+    other.execute("INSERT INTO catalog_changes(tbl, key) VALUES('clients', ?)", (cid,))
+    other.commit()
+    assert search_clients("elsewhere")[0][0] == code
+    other.execute("UPDATE clients SET name='Zed Farther' WHERE id=?", (cid,))
+    other.commit()
+    other.close()
+    get_catalog().loaded_at = 0
+    assert search_clients("farther")[0][0] == code and not search_clients("elsewhere")
+    delete_client(cid)
+    print("  [PASS] Client search index: ranking, top-K, incremental sync")
+
+
+def test_receipt_buffer():
+    """Receipt line buffer: running subtotal in cents, cached DataFrame view."""
+    import streamlit as st
+    from core.receipt import ReceiptBuffer
+    from core.state import ss_init, bump_receipt_ver, receipt_view_df
+    from core.utils import recompute_receipt_df
+
+    buf = ReceiptBuffer()
+    buf.append("Cu", "4.45", "120", "20")
+    buf.append("Al", 0.1, 3, "")
+    buf.append("Fe", 0.07, 10, 20)          # negative net clamps to 0
+    assert [ln.total for ln in buf.lines] == [445.0, 0.3, 0.0]
+    assert buf.subtotal == 445.3
+    buf.update(1, 0.1, 33, 0)
+    assert buf.subtotal == 448.3
+    buf.delete([0])
+    assert buf.subtotal == 3.3 and [ln.material for ln in buf.lines] == ["Al", "Fe"]
+    df = buf.to_df()
+    assert df.equals(recompute_receipt_df(df))
+    assert abs(df["total"].sum() - buf.subtotal) < 1e-9
+
+    ss_init("test@example.com")
+    st.session_state.receipt_buf = ReceiptBuffer()
+    st.session_state.receipt_buf.append("Cu", 4, 10, 0)
+    v1 = receipt_view_df()
+    assert receipt_view_df() is v1
+    st.session_state.receipt_buf.append("Cu", 4, 5, 0)
+    v2 = receipt_view_df()
+    assert v2 is not v1 and len(v2) == 2
+    bump_receipt_ver()
+    assert receipt_view_df() is not v2
+    st.session_state.receipt_buf.clear()
+    print("  [PASS] Receipt buffer: incremental subtotal, cached DataFrame view")
+
+
+def test_receipt_edit_delta():
+    """data_editor delta → receipt buffer + one batched write to the draft lines."""
+    import streamlit as st
+    from core.receipt import ReceiptBuffer
+    from core.state import ss_init
+    from db.repo_ticketing import (
+        create_draft_receipt, insert_receipt_line, get_receipt_lines, delete_draft_receipt,
+    )
+    from ui.page_ticketing import _on_receipt_edit
+
+    ss_init("test@example.com")
+    rid = create_draft_receipt()
+    buf = st.session_state.receipt_buf = ReceiptBuffer()
+    ids = []
+    for mat, p, g, t in [("Cu", 4, 10, 0), ("Al", 1, 20, 5), ("Fe", 0.1, 100, 0)]:
+        ln = buf.append(mat, p, g, t)
+        ids.append(insert_receipt_line(rid, mat, p, g, t, ln.net, ln.total))
+    st.session_state._receipt_line_ids = list(ids)
+    st.session_state._receipt_line_photos = [["a"], ["b"], ["c"]]
+    ver = st.session_state._receipt_edit_ver
+
+    st.session_state["ed"] = {"edited_rows": {0: {"gross": 12}, 2: {"tare": 100, "unit_price": 0.1}},
+                              "added_rows": [], "deleted_rows": []}
+    _on_receipt_edit("ed")
+    assert buf.subtotal == 63.0 and st.session_state._receipt_edit_ver == ver
+    lines = get_receipt_lines(rid)
+    assert lines["gross"].tolist() == [12, 20, 100]
+    assert lines["total"].tolist() == [48, 15, 0]
+
+    st.session_state["ed"] = {"edited_rows": {1: {"Del": True}}, "added_rows": [], "deleted_rows": [2]}
+    _on_receipt_edit("ed")
+    assert [ln.material for ln in buf.lines] == ["Cu"] and buf.subtotal == 48.0
+    assert st.session_state._receipt_line_ids == ids[:1]
+    assert st.session_state._receipt_line_photos == [["a"]]
+    assert st.session_state._receipt_edit_ver == ver + 1
+    assert get_receipt_lines(rid)["id"].tolist() == ids[:1]
+
+    delete_draft_receipt(rid)
+    buf.clear()
+    print("  [PASS] Receipt edits: delta applied to buffer and draft lines in one batch")
+
+
+def test_photo_persist_worker():
+    """Confirm Line photos: spooled, written in the background, final state per line."""
+    import os
+    from core.config import PHOTO_SPOOL_DIR
+    from db.repo_ticketing import (
+        create_draft_receipt, insert_receipt_line, delete_receipt_line,
+        get_photo_verification_for_line, delete_draft_receipt,
+    )
+    from services import photo_persist as pp
+
+    rid = create_draft_receipt()
+    keep = insert_receipt_line(rid, "Cu", 4, 10, 0, 10, 40)
+    gone = insert_receipt_line(rid, "Al", 1, 10, 0, 10, 10)
+    jpeg = b"\xff\xd8" + os.urandom(3000)
+    pp.submit_line_photos(keep, [(1, jpeg), (2, jpeg[::-1])])
+    # A job left in the spool by a stopped process is picked up on recovery
+    delete_receipt_line(gone)
+    pp._spool(gone, [(1, jpeg)])
+    pp._recover()
+    assert pp.wait_for_photos([keep, gone], timeout=10)
+
+    st_keep = pp.photo_status(keep)
+    assert st_keep["state"] == pp.SAVED and st_keep["photo_count"] == 2, st_keep
+    assert get_photo_verification_for_line(keep)["lengths"] == [len(jpeg), len(jpeg)]
+    assert pp.photo_status(gone)["state"] == pp.DROPPED
+    assert get_photo_verification_for_line(gone)["photo_count"] == 0
+    assert pp.pending_photo_jobs() == 0
+    assert not [n for n in os.listdir(PHOTO_SPOOL_DIR) if n != "failed"]
+
+    delete_draft_receipt(rid)
+    print("  [PASS] Photo persistence: background write, recovery, dropped line")
+
+
+def test_camera_payload():
+    """cam_bridge binary payload: round trip, unchanged header skipped, latency kept."""
+    import time
+    from components.camera import (
+        encode_capture, parse_capture, read_new_capture, capture_latency_stats,
+    )
+
+    now = time.time() * 1000.0
+    jpeg1, jpeg2 = b"\xff\xd8" + b"1" * 900, b"\xff\xd8" + b"2" * 700
+    payload = encode_capture(7, now, [(1, jpeg1, 80, 640, 480, now - 30),
+                                      (2, jpeg2, 300 % 256, 1280, 720, now - 20)])
+    cap = parse_capture(payload)
+    assert cap.token == 7 and [f.cam_index for f in cap.frames] == [1, 2]
+    assert cap.frames[0].data == jpeg1 and cap.frames[1].data == jpeg2
+    assert (cap.frames[1].w, cap.frames[1].h) == (1280, 720)
+
+    got, key = read_new_capture(payload, None)
+    assert got is not None
+    assert read_new_capture(payload, key) == (None, key)   # same capture: not parsed again
+    again = encode_capture(7, now + 5, [(1, jpeg1, 80, 640, 480, now)])
+    assert read_new_capture(again, key)[0] is not None      # iframe reload, same token
+
+    assert read_new_capture(payload[:40], None)[0] is None  # truncated
+    assert read_new_capture(b"", None) == (None, None)
+    stats = capture_latency_stats()
+    assert stats["count"] >= 3 and stats["p50_ms"] >= 0
+    print("  [PASS] Camera payload: binary frames, dedup by header, latency stats")
+
+
+def test_pending_photo_cache():
+    """Pending photo cache: byte budget with LRU eviction, TTL expiry, counters."""
+    from core.photo_cache import PendingPhotoCache
+
+    now = [1000.0]
+    cache = PendingPhotoCache(max_bytes=2500, ttl_s=60, clock=lambda: now[0])
+    cache.put("a", {1: b"x" * 1000})
+    cache.put("b", {1: b"y" * 1000})
+    assert cache.get("a") is not None          # a is now most recent
+    cache.put("c", {1: b"z" * 1000, 2: b"w" * 100})
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.bytes == 2100 and cache.evictions == 1
+
+    cache.put("huge", {1: b"h" * 5000})        # newest entry is always kept
+    assert list(cache._entries) == ["huge"] and cache.bytes == 5000
+
+    now[0] += 61
+    assert cache.get("huge") is None and cache.expired == 1 and cache.bytes == 0
+    cache.put("d", {1: b"d" * 10}, {"cam1": {"ts": 1}})
+    entry = cache.pop("d")
+    assert entry.photos == {1: b"d" * 10} and entry.meta["cam1"]["ts"] == 1
+    assert len(cache) == 0 and cache.pop("d") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 2), stats
+    print("  [PASS] Pending photo cache: byte budget, LRU, TTL, counters")
+
+
+def test_cascade_deletes():
+    """v9 rebuilds lines/photos with ON DELETE CASCADE; deletes are one statement."""
+    from db.schema import apply_migrations, SCHEMA_VERSION
+    from db.repo_ticketing import (
+        create_draft_receipt, insert_receipt_line, insert_line_photos,
+        delete_draft_receipt, delete_receipt_lines, get_receipt_lines,
+        get_photo_verification_for_line,
+    )
+
+    # Upgrade a v8 DB that has data: rows, ids and AUTOINCREMENT counter survive
+    conn = sqlite3.connect(":memory:")
+    conn.execute("PRAGMA foreign_keys=ON")
+    apply_migrations(conn, target=8)
+    conn.execute("INSERT INTO receipts(id, issue_time) VALUES(1, '')")
+    conn.executemany("INSERT INTO receipt_lines(id, receipt_id, material_name) VALUES(?,1,'Cu')",
+                     [(i,) for i in range(1, 31)])
+    conn.execute("DELETE FROM receipt_lines WHERE id=30")
+    conn.executemany("INSERT INTO ticket_item_photos(ticket_item_id, cam_index, image_bytes, sha256) "
+                     "VALUES(?,1,X'',?)", [(i, f"h{i}") for i in range(1, 30)])
+    conn.commit()
+    assert apply_migrations(conn) == list(range(9, SCHEMA_VERSION + 1))
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM ticket_item_photos WHERE sha256 LIKE 'h%'").fetchone()[0] == 29
+    assert conn.execute("SELECT seq FROM sqlite_sequence WHERE name='receipt_lines'").fetchone()[0] == 30
+    fks = conn.execute("PRAGMA foreign_key_list(ticket_item_photos)").fetchall()
+    assert fks[0][2] == "receipt_lines" and fks[0][6] == "CASCADE"
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+    statements = []
+    conn.set_trace_callback(statements.append)
+    conn.execute("DELETE FROM receipts WHERE id=1")
+    conn.set_trace_callback(None)
+    # The trace repeats the statement for each cascade step; it is the only one issued
+    assert {q for q in statements if q.strip() != "BEGIN"} == {"DELETE FROM receipts WHERE id=1"}
+    assert conn.execute("SELECT COUNT(*) FROM receipt_lines").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM ticket_item_photos").fetchone()[0] == 0
+    conn.close()
+
+    # Repo APIs on the app DB
+    rid = create_draft_receipt()
+    ids = [insert_receipt_line(rid, "Cu", 1, 10, 0, 10, 10) for _ in range(4)]
+    for lid in ids:
+        insert_line_photos(lid, [(1, b"\xff\xd8" + bytes(2000))])
+    delete_receipt_lines(ids[:2])
+    assert get_receipt_lines(rid)["id"].tolist() == ids[2:]
+    assert get_photo_verification_for_line(ids[0])["photo_count"] == 0
+    delete_draft_receipt(rid)
+    assert get_receipt_lines(rid).empty
+    assert get_photo_verification_for_line(ids[3])["photo_count"] == 0
+    print("  [PASS] Cascade deletes: v9 rebuild keeps rows, one-statement deletes")
+
+
+def test_finalize_ticket_bulk():
+    """finalize_ticket: bulk line/photo inserts, one grouped verification, same shape."""
+    from db.repo_ticketing import finalize_ticket, get_receipt_lines
+
+    jpeg = b"\xff\xd8" + bytes(1500)
+    rows = [(f"M{i}", 1.0, 10.0 + i, 0.0, 10.0 + i, 10.0 + i) for i in range(5)]
+    photos = [[(2, jpeg + b"2"), (1, jpeg)], None, [(1, jpeg)], [], None]
+    rid, verification, _ = finalize_ticket(
+        "2025-01-02 12:00:00", "SmokeTest", "Print", "W001",
+        "000001", "Walk-in", 60.0, 60.0, rows, line_photos=photos)
+    lines = get_receipt_lines(rid)
+    assert lines["material_name"].tolist() == [r[0] for r in rows]
+    assert [v["ticket_item_id"] for v in verification] == lines["id"].tolist()
+    assert [v["photo_count"] for v in verification] == [2, 0, 1, 0, 0]
+    assert verification[0]["lengths"] == [len(jpeg), len(jpeg) + 1]   # cam_index order
+    assert verification[1]["lengths"] == []
+    print("  [PASS] finalize_ticket: bulk inserts + grouped photo verification")
+
+
+def test_update_receipt_lines_set_based():
+    """update_receipt_lines: SQL subtotal over all lines, rollup adjusted by delta."""
+    from db.connection import qdf, qone
+    from db.rollups import rebuild_rollups
+    from db.repo_ticketing import finalize_ticket, update_receipt_lines, get_receipt_lines
+
+    day = "1997-03-04"
+    rid, _, _ = finalize_ticket(f"{day} 09:00:00", "smoke", "Print", "222222",
+                             "000001", "Walk-in", 60.0, 60.0,
+                             [("A", 1.0, 10.0, 0.0, 10.0, 10.0),
+                              ("B", 2.0, 10.0, 0.0, 10.0, 20.0),
+                              ("C", 3.0, 10.0, 0.0, 10.0, 30.0)])
+    try:
+        ids = get_receipt_lines(rid)["id"].tolist()
+        # Only two lines edited: the subtotal still covers line C
+        update_receipt_lines([(ids[0], 20.0, 0.0, 20.0, 20.0), (ids[1], 5.0, 1.0, 4.0, 8.0)], 58.0, rid)
+        r = qone("SELECT subtotal, rounding_amount FROM receipts WHERE id=?", (rid,))
+        assert (r["subtotal"], r["rounding_amount"]) == (58.0, 58.0)
+        assert get_receipt_lines(rid)["net"].tolist() == [20.0, 4.0, 10.0]
+
+        def bucket():
+            return qdf("SELECT tickets, ROUND(net,3) AS net, ROUND(subtotal,2) AS subtotal, "
+                       "ROUND(rounding,2) AS rounding FROM daily_rollups WHERE day=?",
+                       (day,)).to_dict("records")
+        assert bucket() == [{"tickets": 1, "net": 34.0, "subtotal": 58.0, "rounding": 58.0}]
+        incremental = bucket()
+        rebuild_rollups()
+        assert bucket() == incremental
+        print("  [PASS] update_receipt_lines: executemany, SQL subtotal, rollup delta")
+    finally:
+        _drop_receipts(rid)
+
+
+def test_code_allocator():
+    """code_sequences: unique, unpredictable codes without probing; skips taken codes."""
+    from concurrent.futures import ThreadPoolExecutor
+    from db.codes import CLIENT_CODE, WITHDRAW_CODE, allocate_code, next_code, _permute
+    from db.connection import qone
+    from db.repo_customers import gen_code_6, save_customer, _client_code_taken
+    from db.repo_ticketing import finalize_ticket, _withdraw_code_taken
+    from db.schema import apply_migrations
+
+    with ThreadPoolExecutor(8) as pool:
+        wcodes = list(pool.map(lambda _: allocate_code(WITHDRAW_CODE), range(400)))
+    assert len(set(wcodes)) == 400
+    assert all(len(c) == 6 and 100000 <= int(c) <= 999999 for c in wcodes)
+
+    # finalize_ticket(wcode=None) allocates the code in its own transaction
+    def finalize(_):
+        return finalize_ticket("1997-05-05 09:00:00", "smoke", "Print", None, "000001",
+                               "Walk-in", 1.0, 1.0, [("Cu#1", 1.0, 1.0, 0.0, 1.0, 1.0)])
+    with ThreadPoolExecutor(8) as pool:
+        done = list(pool.map(finalize, range(24)))
+    try:
+        assert len({code for _rid, _v, code in done}) == 24
+        for rid, _v, code in done:
+            assert qone("SELECT withdraw_code FROM receipts WHERE id=?", (rid,))[0] == code
+    finally:
+        _drop_receipts(*[rid for rid, _v, _c in done])
+    ccodes = [gen_code_6() for _ in range(50)] + [save_customer("Code Test", "")]
+    assert len(set(ccodes)) == 51 and all(len(c) == 6 and c.isdigit() for c in ccodes)
+
+    # Keyed permutation: a bijection, different per secret, no constant step
+    key1, key2 = "11" * 32, "22" * 32
+    perm = [_permute(n, 900_000, key1) for n in range(2000)]
+    assert len(set(perm)) == 2000 and max(perm) < 900_000
+    assert perm != [_permute(n, 900_000, key2) for n in range(2000)]
+    assert len({(b - a) % 900_000 for a, b in zip(perm, perm[1:])}) > 1900
+    assert sorted(_permute(n, 10, key1) for n in range(10)) == list(range(10))
+
+    # A code already in clients is skipped
+    conn = sqlite3.connect(":memory:")
+    apply_migrations(conn)
+    conn.execute("UPDATE code_sequences SET modulus=10, secret=?, width=2 WHERE name=?",
+                 (key1, CLIENT_CODE))
+    taken = f"{_permute(1, 10, key1):02d}"
+    conn.execute("INSERT INTO clients(code) VALUES(?)", (taken,))
+    got = [next_code(conn, CLIENT_CODE, _client_code_taken) for _ in range(9)]
+    assert got[0] == f"{_permute(0, 10, key1):02d}" and taken not in got
+    assert sorted(got + [taken]) == [f"{i:02d}" for i in range(10)]
+    try:
+        next_code(conn, CLIENT_CODE, lambda c, code: True)
+        raise AssertionError("exhausted code space must raise")
+    except RuntimeError:
+        pass
+    assert next_code(conn, WITHDRAW_CODE).isdigit()
+
+    # A withdraw code held by an unpaid ticket is skipped; paid ones may repeat
+    conn.execute("UPDATE code_sequences SET next_n=0 WHERE name=?", (WITHDRAW_CODE,))
+    first = next_code(conn, WITHDRAW_CODE, _withdraw_code_taken)
+    conn.execute("UPDATE code_sequences SET next_n=0 WHERE name=?", (WITHDRAW_CODE,))
+    conn.execute("INSERT INTO receipts(withdraw_code) VALUES(?)", (first,))
+    assert next_code(conn, WITHDRAW_CODE, _withdraw_code_taken) != first
+    conn.execute("UPDATE receipts SET withdrawn=1 WHERE withdraw_code=?", (first,))
+    conn.execute("UPDATE code_sequences SET next_n=0 WHERE name=?", (WITHDRAW_CODE,))
+    assert next_code(conn, WITHDRAW_CODE, _withdraw_code_taken) == first
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(code_sequences)")}
+    assert cols == {"name", "next_n", "modulus", "secret", "base", "width"}, cols
+    conn.close()
+
+    # A DB made with the first m010 (mult/shift mapping) gets secrets, loses mult/shift
+    conn = sqlite3.connect(":memory:")
+    apply_migrations(conn, target=9)
+    conn.execute("CREATE TABLE code_sequences (name TEXT PRIMARY KEY, "
+                 "next_n INTEGER NOT NULL DEFAULT 0, modulus INTEGER NOT NULL, "
+                 "mult INTEGER NOT NULL, shift INTEGER NOT NULL, "
+                 "base INTEGER NOT NULL DEFAULT 0, width INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID")
+    conn.execute("INSERT INTO code_sequences VALUES(?, 5, 900000, 7, 3, 100000, 6)", (WITHDRAW_CODE,))
+    conn.execute("PRAGMA user_version=10")
+    conn.commit()
+    apply_migrations(conn)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(code_sequences)")}
+    assert not cols & {"mult", "shift"}, cols
+    assert next_code(conn, WITHDRAW_CODE).isdigit()
+    conn.close()
+    print("  [PASS] Code allocator: keyed permutation, unique concurrent codes, skip taken")
+
+
 def test_state_init():
     import streamlit as st
     from core.state import ss_init, bump_receipt_ver, STEP_SELECT_ITEM
@@ -173,17 +1140,112 @@ def test_state_init():
     print("  [PASS] ss_init + bump_receipt_ver work correctly")
 
 
+def test_payout_flow():
+    from db.connection import get_connection, qdf, qone
+    from db.rollups import rebuild_rollups
+    from db.repo_ticketing import (finalize_ticket, void_ticket, get_ticket_by_withdraw_code,
+                                   get_unpaid_tickets_df, mark_withdrawn, mark_withdrawn_batch)
+
+    def snapshot():
+        return qdf("SELECT day, method, voided, withdrawn, tickets, "
+                   "ROUND(net,3) AS net, ROUND(subtotal,2) AS subtotal, "
+                   "ROUND(rounding,2) AS rounding FROM daily_rollups "
+                   "WHERE day = '1998-09-01' ORDER BY method, voided, withdrawn").to_dict("records")
+
+    day = "1998-09-01"
+    codes = ["910001", "910002", "910003", "910004"]
+    rids = [finalize_ticket(f"{day} 09:0{i}:00", "smoke", "Print", code, "000001", "Walk-in",
+                            10.0 * (i + 1), 10.0 * (i + 1),
+                            [("Cu#1", 1.0, 10.0 * (i + 1), 0.0, 10.0 * (i + 1), 10.0 * (i + 1))])[0]
+            for i, code in enumerate(codes)]
+
+    with get_connection() as conn:
+        plan = " ".join(r[3] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM receipts WHERE withdraw_code = ?", ("x",)))
+    assert "idx_receipts_withdraw_code" in plan, plan
+
+    t = get_ticket_by_withdraw_code(codes[0])
+    assert t["id"] == rids[0] and not t["withdrawn"]
+    assert get_ticket_by_withdraw_code("000000") is None
+    assert mark_withdrawn(rids[0]) is True
+    assert mark_withdrawn(rids[0]) is False, "same code paid twice"
+    assert qone("SELECT withdrawn_at FROM receipts WHERE id=?", (rids[0],))["withdrawn_at"]
+
+    void_ticket(rids[1])
+    assert mark_withdrawn(rids[1]) is False
+    assert get_unpaid_tickets_df(day)["id"].tolist() == rids[2:]
+
+    done = mark_withdrawn_batch(rids)
+    assert sorted(done) == rids[2:], done
+    assert mark_withdrawn_batch(rids) == []
+    assert get_unpaid_tickets_df(day).empty
+    assert get_ticket_by_withdraw_code(codes[3])["withdrawn"] == 1
+
+    incremental = snapshot()
+    rebuild_rollups()
+    assert snapshot() == incremental, "payout rollups drifted from rebuild"
+
+    # The batch button pays the tickets it listed, not ones finalized since
+    from streamlit.testing.v1 import AppTest
+
+    def page():
+        import datetime
+        import streamlit as st
+        from ui.page_manage import manage_payout
+        st.session_state.setdefault("payout_day", datetime.date(1998, 9, 2))
+        manage_payout()
+
+    def ticket(code):
+        return finalize_ticket("1998-09-02 09:00:00", "smoke", "Print", code, "000001",
+                               "Walk-in", 5.0, 5.0, [("Cu#1", 1.0, 5.0, 0.0, 5.0, 5.0)])[0]
+
+    shown = ticket("910005")
+    at = AppTest.from_function(page, default_timeout=60)
+    at.run()
+    late = ticket("910006")
+    at.button(key="payout_batch").click().run()
+    assert not at.exception, at.exception
+    assert get_unpaid_tickets_df("1998-09-02")["id"].tolist() == [late], shown
+    mark_withdrawn(late)
+    print("  [PASS] payout: code lookup, single and batch withdraw marking, rollups")
+
+
 def main():
     tests = [
         test_compile_all,
         test_imports,
         test_db_init_and_tables,
+        test_schema_migrations,
+        test_query_plan_audit,
+        test_report_issue_date_keys,
+        test_daily_rollups,
+        test_connection_pool,
+        test_single_writer_group_commit,
+        test_query_instrumentation,
         test_categories_and_materials,
         test_crud_category,
         test_crud_material,
         test_clients,
         test_calc_line,
         test_line_photos_write_read,
+        test_photo_store,
+        test_photo_thumbnails,
+        test_receipt_photos_one_query,
+        test_only_active_page_runs,
+        test_ticketing_fragments,
+        test_catalog_snapshot,
+        test_price_book,
+        test_client_search,
+        test_receipt_buffer,
+        test_receipt_edit_delta,
+        test_photo_persist_worker,
+        test_camera_payload,
+        test_pending_photo_cache,
+        test_cascade_deletes,
+        test_finalize_ticket_bulk,
+        test_update_receipt_lines_set_based,
+        test_code_allocator,
+        test_payout_flow,
         test_state_init,
     ]
     passed = 0
@@ -14,12 +14,13 @@ import pandas as pd
 
 from components.navigation import topbar
 from components.printer import open_print_window
-from core.config import DB_PATH
+from core.config import DB_PATH, SLOW_QUERY_MS
 from db.repo_ticketing import (
-    get_receipt, get_receipt_lines, get_line_photos, get_item_photos,
+    get_receipt, get_receipt_lines, get_line_photos, get_item_photos, get_receipt_photos,
     void_ticket, restore_ticket, update_receipt_lines,
     get_receipt_detail_inquiry_df, get_ticket_report_rows,
     get_void_receipts_df,
+    get_ticket_by_withdraw_code, get_unpaid_tickets_df, mark_withdrawn, mark_withdrawn_batch,
 )
 from db.repo_customers import get_all_clients_df, update_client, delete_client, save_customer
 from db.repo_products import (
@@ -38,6 +39,10 @@ from services.report_service import (
     build_daily_report_html,
 )
 from services.export_service import monthly_summary_export_bytes
+from db.connection import (
+    pool_stats, writer_stats, query_stats, slow_queries, reset_query_stats,
+    LATENCY_BUCKETS_MS,
+)
 
 
 # ---------------------------------------------------------------------------
@@ -102,9 +107,8 @@ def _rdi_ticket_detail_view(rid):
     with ic4:
         st.caption("By"); st.text(f"{issued_by} - {method}")
 
-    # 照片只从 DB 读：ticket_item_photos (BLOB)，按 line_id 查
-    def _photos_for_line(line_id):
-        return get_item_photos(int(line_id))
+    # 整张单据的缩略图一次查出（按 line_id / cam_index），勾选 🔍 才取该行原图
+    receipt_thumbs = get_receipt_photos(rid, thumbnails=True)
 
     st.markdown("---")
     st.markdown("##### Material Lines")
@@ -138,10 +142,9 @@ def _rdi_ticket_detail_view(rid):
         mc[5].text(f"${new_total:.2f}")
         mc[6].text(created_date)
         with mc[7]:
-            line_photos = _photos_for_line(line_id)
-            line_photos.sort(key=lambda x: x[0])
-            cam1_bytes = next((b for c, b in line_photos if c == 1 and b and len(b) > 100), None)
-            cam2_bytes = next((b for c, b in line_photos if c == 2 and b and len(b) > 100), None)
+            line_photos = receipt_thumbs.get(line_id, {})
+            cam1_bytes = line_photos.get(1) if len(line_photos.get(1) or b"") > 100 else None
+            cam2_bytes = line_photos.get(2) if len(line_photos.get(2) or b"") > 100 else None
             ph1, ph2 = st.columns(2)
             with ph1:
                 if cam1_bytes:
@@ -157,6 +160,13 @@ def _rdi_ticket_detail_view(rid):
                     st.markdown(
                         '<div style="width:100%;aspect-ratio:1/1;background:#111;border-radius:4px;"></div>',
                         unsafe_allow_html=True)
+            show_full = (cam1_bytes or cam2_bytes) and st.checkbox(
+                "🔍", key=f"rdi_zoom_{line_id}", help="Show full-size photos")
+        if show_full:
+            full = [b for c, b in get_item_photos(line_id) if b and len(b) > 100]
+            for fc, b in zip(st.columns(max(1, len(full))), full):
+                with fc:
+                    st.image(b, use_container_width=True)
         edited_lines.append((line_id, new_gross, new_tare, new_net, new_total))
         total_gross += new_gross
         total_tare += new_tare
@@ -818,6 +828,60 @@ def manage_void_receipts():
                 st.rerun()
 
 
+def manage_payout():
+    st.subheader("付款 (Payout)")
+
+    with st.form("payout_lookup_form", clear_on_submit=False):
+        wcode = st.text_input("取款码", key="payout_code", max_chars=6)
+        if st.form_submit_button("查询", use_container_width=True):
+            row = get_ticket_by_withdraw_code(wcode)
+            st.session_state.payout_ticket = dict(row) if row else None
+            if row is None:
+                st.warning(f"没有取款码为 {wcode} 的单据。")
+
+    t = st.session_state.get("payout_ticket")
+    if t:
+        c = st.columns(4)
+        c[0].metric("单据", f"#{t['id']}")
+        c[1].metric("客户", f"{t['client_code'] or ''} {t['client_name'] or ''}".strip() or "-")
+        c[2].metric("应付金额", f"${float(t['rounding_amount'] or 0):,.2f}")
+        c[3].metric("开票时间", str(t["issue_time"] or ""))
+        if int(t["voided"] or 0):
+            st.error("该单据已作废，不能付款。")
+        elif int(t["withdrawn"] or 0):
+            st.warning(f"该单据已付款（{t['withdrawn_at'] or '时间未记录'}）。")
+        elif st.button("确认付款", key="payout_confirm", type="primary", use_container_width=True):
+            if mark_withdrawn(int(t["id"])):
+                st.success(f"单据 #{t['id']} 已付款。")
+            else:
+                st.warning(f"单据 #{t['id']} 已被付款或作废，未重复付款。")
+            row = get_ticket_by_withdraw_code(t["withdraw_code"])
+            st.session_state.payout_ticket = dict(row) if row else None
+
+    st.markdown("---")
+    st.markdown("**日终批量付款**")
+    done = st.session_state.pop("payout_batch_done", None)
+    if done is not None:
+        st.success(f"已标记 {done} 张单据为已付款。")
+    day = st.date_input("开票日期", value=datetime.now().date(), key="payout_day")
+    unpaid = get_unpaid_tickets_df(day.strftime("%Y-%m-%d"))
+    if unpaid.empty:
+        st.info("该日没有未付款的单据。")
+        return
+    st.caption(f"共 {len(unpaid)} 张未付款 · 合计 ${float(unpaid['rounding_amount'].sum()):,.2f}")
+    st.dataframe(unpaid, hide_index=True, use_container_width=True)
+    # Only the tickets listed above: the callback runs before the rerun that
+    # would re-query and pick up tickets finalized in the meantime
+    st.session_state.payout_batch_ids = [int(i) for i in unpaid["id"]]
+    st.button("全部标记已付款", key="payout_batch", use_container_width=True,
+              on_click=_on_payout_batch)
+
+
+def _on_payout_batch():
+    done = mark_withdrawn_batch(st.session_state.get("payout_batch_ids", []))
+    st.session_state.payout_batch_done = len(done)
+
+
 def manage_daily_summary():
     st.subheader("Daily Transaction Summary")
 
@@ -1015,6 +1079,51 @@ def manage_monthly_summary_page():
     st.caption(f"当前显示 1-{n} 条, 共 {n} 条")
 
 
+def manage_db_performance():
+    st.subheader("数据库性能监控")
+
+    ps = pool_stats()
+    ws = writer_stats()
+    m = st.columns(6)
+    m[0].metric("连接池 in use / open", f"{ps['in_use']} / {ps['open']}")
+    m[1].metric("取连接等待 avg", f"{ps['wait_ms_avg']:.2f} ms")
+    m[2].metric("取连接等待 max", f"{ps['wait_ms_max']:.1f} ms")
+    m[3].metric("写批次", f"{ws['batches']}")
+    m[4].metric("每批请求 avg / max", f"{ws['avg_batch']:.1f} / {ws['max_batch']}")
+    m[5].metric("写队列等待 max", f"{ws['queue_wait_ms_max']:.1f} ms")
+
+    tb1, tb2, _ = st.columns([1.5, 1, 3])
+    with tb1:
+        order = st.selectbox("排序", ["total_ms", "max_ms", "avg_ms", "count", "lock_wait_ms"],
+                             key="dbperf_order")
+    with tb2:
+        st.markdown("<br>", unsafe_allow_html=True)
+        if st.button("清零统计", key="dbperf_reset", use_container_width=True):
+            reset_query_stats()
+            st.rerun()
+
+    rows = query_stats()
+    if not rows:
+        st.info("暂无查询统计。")
+    else:
+        df = pd.DataFrame(rows).sort_values(order, ascending=False).head(50)
+        labels = [f"≤{b}ms" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        df["histogram"] = df["hist"].apply(
+            lambda h: " ".join(f"{lab}:{n}" for lab, n in zip(labels, h) if n))
+        st.markdown("**最耗时语句 (Top 50)**")
+        st.dataframe(
+            df[["caller", "count", "total_ms", "avg_ms", "p95_ms_le", "max_ms",
+                "rows", "lock_wait_ms", "errors", "histogram", "sql"]],
+            use_container_width=True, hide_index=True, height=420)
+
+    slow = slow_queries()
+    st.markdown(f"**慢查询日志** (≥ {SLOW_QUERY_MS:.0f} ms，最近 {len(slow)} 条)")
+    if slow:
+        st.dataframe(pd.DataFrame(slow), use_container_width=True, hide_index=True, height=300)
+    else:
+        st.caption("没有慢查询。")
+
+
 # ---------------------------------------------------------------------------
 # Main manage page
 # ---------------------------------------------------------------------------
@@ -1086,11 +1195,13 @@ def manage_page():
         ("月票据汇总信息查询", manage_monthly_summary_page),
         ("年票据汇总信息查询", manage_annual_summary),
         ("票据作废", manage_void_receipts),
+        ("付款 (Payout)", manage_payout),
         ("客户信息管理", manage_clients_crud),
         ("操作员信息管理", manage_operators_crud),
         ("类别管理 (Category CRUD)", manage_categories_crud),
         ("物料管理 (Material CRUD)", manage_materials_crud),
         ("系统参数设置", manage_settings),
+        ("数据库性能监控", manage_db_performance),
     ]
 
     labels = [m[0] for m in menu]